@@ -1,17 +1,20 @@
+import os
 import math
+import time
 import random
-import queue
 import asyncio
+import itertools
 from syllables import estimate as estimate_syllables
 from enum import Enum
 
 from utils_config import get_config
+from utils_async import Threadsafe_Event
+from utils_metrics import metrics
+from utils_events import Event_Type, Point_Redemption
 
-from twitchAPI.object.eventsub import ChannelPointsCustomRewardRedemptionAddEvent
-
-# TTS generators
-from gtts import gTTS
-import pyttsx3
+# TTS generation runs on a worker pool so it never blocks the event loop.
+from audiomodule_TTS_synthesizer import TTS_Synthesizer
+from audiomodule_TTS_cache import TTS_Render_Cache
 
 # Used for function annotation. Not required at runtime.
 from utils_hotkey_manager import Hotkey_Manager
@@ -21,12 +24,6 @@ from audiomodule_audio_player import Audio_Manager
 ######### Enum List #########
 
 
-class Reward_Titles(Enum):
-
-    NORMAL_TTS = get_config("INITIALIZATION").get("tts_reward_title")
-
-
-
 class Voice_Codes(Enum):
 
     PYTTS_MALE = "[m]"
@@ -37,73 +34,200 @@ class Voice_Codes(Enum):
 
 
 class TTS_Manager(object):
-    def __init__(self, hotkey_manager:"Hotkey_Manager", audio_player:"Audio_Manager") -> None:
+    def __init__(self, hotkey_manager:"Hotkey_Manager", audio_player:"Audio_Manager", synthesizer:"TTS_Synthesizer" = None, prefetch_count:"int" = 2, render_cache:"TTS_Render_Cache" = None, prewarm_file:"str" = "tts_prewarm.txt", debug_file_output:"bool" = False, reward_title:"str" = None, pyTTS_base_rate:"int" = 200) -> None:
 
         self._audio_player = audio_player
 
-        # Base pyTTS objects, baserate is used for speech speed.
-        self._pyTTS = pyttsx3.init()
-        self._pyTTS_baserate = 200
+        # Renders TTS audio off the event loop, decoded straight into the audio player's PCM format. Baserate is used for pyTTS speech speed.
+        self._synthesizer = synthesizer if synthesizer is not None else TTS_Synthesizer()
+        self._synthesizer.set_output_format(self._audio_player.get_mixer_format())
+        self._pyTTS_baserate = pyTTS_base_rate
 
-        # Sets up ability to pause without closing the function.
+        # Rendered audio is cached so repeated redemptions skip synthesis. pyTTS rates are rounded to this step so near-identical rates share entries.
+        self._render_cache = render_cache if render_cache is not None else TTS_Render_Cache()
+        self._rate_step = 10
+
+        # Phrases in this file, one per line, are rendered into the cache when TTS starts. Skipped if the file doesn't exist.
+        self._prewarm_file = prewarm_file
+
+        # Sets up ability to pause without closing the function. The hotkey runs on the keyboard thread, so the event is set thread-safely.
         self._paused = False
+        self._unpaused = Threadsafe_Event()
+        self._unpaused.set()
+        self._running = False
+        self._stopped = asyncio.Event()
         hotkey_manager.create_hotkey("Pause playing TTS", "backspace+P", self._pause_unpause, force_assignment = True)
         hotkey_manager.create_hotkey("Stop TTS Button", "right shift+backspace", self._skip_current_TTS)
 
-        # Used for generating files.
+        # TTS audio never touches the disk unless debug file output is on, which keeps a copy of every rendered part here.
+        self._debug_file_output = debug_file_output
         self._file_path_base = ".\\sound_effects\\"
 
-        self._TTS_queue = queue.Queue(0)
-        self._TTS_parts = []
+        # Items are (message id, text).
+        self._TTS_queue = asyncio.Queue()
+
+        # Texts of accepted messages that haven't started playing, by message id in the order they arrived.
+        # Handed to the new module on reload, so redemptions waiting to be read aren't lost.
+        self._pending_messages = {}
+        self._message_ids = itertools.count()
+
+        # Holds rendered messages, as (message id, parts), waiting to be played. Bounded so only the next few messages are rendered while the current one plays.
+        self._rendered_queue = asyncio.Queue(prefetch_count)
+
+        # Render time covers waiting for a free worker as well as synthesis. Playback waits show when rendering falls behind playback.
+        self._render_time = metrics.histogram("tts_render_seconds", "Time from starting a TTS part's render to it finishing.")
+        self._playback_wait_time = metrics.histogram("tts_playback_wait_seconds", "Time playback waits for a TTS part to finish rendering.")
+        metrics.gauge("tts_queue_depth", "TTS messages waiting to be rendered.", function = self._TTS_queue.qsize)
+        metrics.gauge("tts_rendered_queue_depth", "Rendered TTS messages waiting to be played.", function = self._rendered_queue.qsize)
+        metrics.counter("tts_cache_hits_total", "TTS parts served from the render cache.", function = lambda: self._render_cache.memory_hits + self._render_cache.disk_hits)
+        metrics.counter("tts_cache_misses_total", "TTS parts that had to be synthesized.", function = lambda: self._render_cache.misses)
+
+        # Every rendered part gets its own index so debug files from prefetched renders never overwrite each other.
+        self._render_index = 0
+        self._skip_requested = False
     
         # Sets up reward IDs for TTS redemptions. Additional TTS redemptions will be added later with fancier voices if desired.
         self._reward_titles = {}
 
-        # The values in [] brackets MUST match the point rewards on your channel, whichever is changed.
-        self._reward_titles.update(dict.fromkeys([Reward_Titles.NORMAL_TTS.value], "normal TTS"))
+        # The titles MUST match the point rewards on your channel. Read from config.ini when the module is created, not when it is imported.
+        if reward_title is None:
+            reward_title = get_config().initialization.tts_reward_title
+        self._reward_titles.update(dict.fromkeys([reward_title], "normal TTS"))
 
 
 
-    # Gets the next TTS message from the queue and processes it while TTS is not paused.
-    async def _next_TTS_message(self) -> None:
-        
-        # Allows concurrent functions to execute while checking for TTS messages every second.
-        while True:
+    # Gets the next TTS message from the queue and starts rendering all of its parts, then hands it to the playback queue.
+    # Waits once the playback queue holds prefetch_count messages, so rendering stays only a few messages ahead of playback.
+    async def _render_next_TTS_message(self) -> None:
+
+        # Sleeps until a message is queued. Raises asyncio.QueueShutDown once terminate_module() shuts the queue down.
+        message_id, text = await self._TTS_queue.get()
+        print(f"TTS message detected: {text}")
+
+        try:
+            rate = self._calculate_rate(text, self._TTS_queue.qsize() + self._rendered_queue.qsize())
+            TTS_future_list = self._generate_TTS_parts(self._split_TTS_parts(text), rate)
+        except Exception:
+            self._pending_messages.pop(message_id, None)
+            raise
+
+        await self._rendered_queue.put((message_id, TTS_future_list))
+
+
+    # Renders queued TTS messages ahead of playback until the queues are shut down.
+    async def _render_loop(self) -> None:
+
+        while self._running:
             try:
-                text = self._TTS_queue.get(timeout = 0.02)
-            except queue.Empty:
-                if not self._running:
-                    print("No longer listening to TTS message.")
-                    return
-                await asyncio.sleep(1)
-            else:
-                print(f"TTS message detected: {text}")
+                await self._render_next_TTS_message()
+            except asyncio.QueueShutDown:
+                return
+            except Exception as e:
+                print(f"TTS message could not be rendered. Exception {e}")
+
+
+    # Gets the next rendered TTS message and plays its parts in order while TTS is not paused.
+    async def _next_TTS_message(self) -> None:
+
+        # Sleeps until a message is rendered. Raises asyncio.QueueShutDown once terminate_module() shuts the queue down.
+        message_id, TTS_future_list = await self._rendered_queue.get()
+        self._pending_messages.pop(message_id, None)
+        self._skip_requested = False
+
+        # Plays all TTS parts in order before getting the next message to process. Later parts keep rendering while earlier parts play.
+        for TTS_future in TTS_future_list:
+            if not self._running or self._skip_requested:
                 break
 
-        # Adjusts rate according to remaining messages in queue as well as length of message. Only for pyTTS audio.
-        rate = int(math.sqrt(self._TTS_queue.qsize() + 15) * 45)
+            wait_start = time.perf_counter()
+            try:
+                TTS_Part = await TTS_future
+            except Exception as e:
+                print(f"TTS part could not be rendered. Exception {e}")
+                continue
+            finally:
+                self._playback_wait_time.observe(time.perf_counter() - wait_start)
+
+            await self._audio_player.play_TTS(TTS_Part)
+
+
+    # Adjusts rate according to remaining messages in queue as well as length of message. Only for pyTTS audio.
+    # Rounded to the rate step so repeated messages produce the same cache key.
+    def _calculate_rate(self, text:"str", queued_count:"int") -> int:
+
+        rate = int(math.sqrt(queued_count + 15) * 45)
         rate += int(self._estimate_syllables(text) * 0.5)
 
-        self._TTS_parts = self._split_TTS_parts(text)
+        return round(rate / self._rate_step) * self._rate_step
 
-        TTS_path_list = await self._generate_TTS_parts(rate)
 
-        # Plays all TTS parts in order before getting the next message to process.
-        for TTS_Part in TTS_path_list:
-            await self._audio_player.play_TTS(TTS_Part)
+    # Runs on a synthesizer worker thread. Returns cached PCM on a hit, or synthesizes, decodes and caches it on a miss.
+    # With debug file output on, the encoded audio from a miss is also saved to the file path.
+    def _render_cached(self, key:"tuple", audio_format:"str", file_path:"str", synthesize:"function", *args) -> bytes:
+
+        audio = self._render_cache.get(key)
+        if audio is not None:
+            return audio
+
+        encoded_audio = synthesize(*args)
+
+        if self._debug_file_output:
+            with open(file_path, "wb") as TTS_file:
+                TTS_file.write(encoded_audio)
 
+        audio = self._synthesizer.decode_to_pcm(encoded_audio, audio_format)
+        self._render_cache.put(key, audio)
 
-    # Generates a series of TTS files based on the list of TTS parts held by the TTS_Manager object. Returns a list of file paths to the generated TTS files.
-    # TTS files are generated with an index after them in the format: [path\speech1.ext, path\speech2.ext, path\speech3.ext, etc]
-    async def _generate_TTS_parts(self, pyTTS_rate:"int") -> list:
+        return audio
+
+
+    # Renders every phrase in the prewarm file with each voice into the cache, at the rate used when the queue is empty.
+    async def _prewarm_cache(self) -> None:
+
+        if self._prewarm_file is None or not os.path.isfile(self._prewarm_file):
+            return
+
+        with open(self._prewarm_file, "r", encoding = "utf-8") as prewarm_file:
+            phrases = [line.strip() for line in prewarm_file if line.strip()]
+
+        TTS_future_list = []
+        for phrase in phrases:
+            TTS_future_list.append(self.generate_gTTS(phrase, filename = "prewarm", TTS_fragment_index = self._next_render_index()))
+
+            for voice in [0, 1]:
+                rate = self._calculate_rate(phrase, 0)
+                TTS_future_list.append(self.generate_pyTTS(phrase, voice = voice, rate = rate, filename = "prewarm", TTS_fragment_index = self._next_render_index()))
+
+        await asyncio.gather(*TTS_future_list, return_exceptions = True)
+
+        print(f"TTS cache prewarmed with {len(phrases)} phrases. Cache stats: {self._render_cache.get_stats()}")
+
+
+    # Returns the next unique index for a rendered TTS part.
+    def _next_render_index(self) -> int:
+        self._render_index += 1
+        return self._render_index
+
+
+    # Records the render time of a part once its future finishes. Returns the same future.
+    def _time_render(self, TTS_future:"asyncio.Future") -> "asyncio.Future":
+
+        start = time.perf_counter()
+        TTS_future.add_done_callback(lambda future: self._render_time.observe(time.perf_counter() - start))
+        return TTS_future
+
+
+    # Starts rendering a series of TTS parts based on the given list. Returns a list of futures for each part's PCM audio, in part order.
+    # Debug files are generated with a unique index after them in the format: [path\speech1.ext, path\speech2.ext, path\speech3.ext, etc]
+    def _generate_TTS_parts(self, TTS_parts:"list", pyTTS_rate:"int") -> list:
         
-        TTS_path_list = []
+        TTS_future_list = []
 
-        for i, TTS in enumerate(self._TTS_parts):
+        for TTS in TTS_parts:
 
-            #print(f"DEBUG: {TTS} <-- Message | Index--> {str(i)}")
+            i = self._next_render_index()
 
-            await asyncio.sleep(0.1) # Provides a period for other concurrent functions to run as needed.
+            #print(f"DEBUG: {TTS} <-- Message | Index--> {str(i)}")
 
             # Checks if a voice code exists at the start of the TTS part and maintains the full string if none are detected.
             if TTS.split(maxsplit = 1)[0] not in [k.value for k in Voice_Codes]:
@@ -111,10 +235,10 @@ class TTS_Manager(object):
                 # Randomly selects voice type.
                 voice_type = random.randint(0,len(Voice_Codes)-2)
                 if voice_type in [0,1]:
-                    TTS_file_path = self.generate_pyTTS(TTS, voice = voice_type, rate = pyTTS_rate, TTS_fragment_index=i)
+                    TTS_future = self.generate_pyTTS(TTS, voice = voice_type, rate = pyTTS_rate, TTS_fragment_index=i)
                 elif voice_type == 2:
-                    TTS_file_path = self.generate_gTTS(TTS, TTS_fragment_index=i)
-                TTS_path_list.append(TTS_file_path)
+                    TTS_future = self.generate_gTTS(TTS, TTS_fragment_index=i)
+                TTS_future_list.append(TTS_future)
                 continue
                 
 
@@ -124,26 +248,26 @@ class TTS_Manager(object):
 
             match TTS[0]:
                 case Voice_Codes.PYTTS_MALE.value:
-                    TTS_file_path = self.generate_pyTTS(TTS[1], voice = 0, rate = pyTTS_rate, TTS_fragment_index=i)
+                    TTS_future = self.generate_pyTTS(TTS[1], voice = 0, rate = pyTTS_rate, TTS_fragment_index=i)
 
                 case Voice_Codes.PYTTS_FEMALE.value:
-                    TTS_file_path = self.generate_pyTTS(TTS[1], voice = 1, rate = pyTTS_rate, TTS_fragment_index=i)
+                    TTS_future = self.generate_pyTTS(TTS[1], voice = 1, rate = pyTTS_rate, TTS_fragment_index=i)
 
                 case Voice_Codes.GTTS.value:
-                    TTS_file_path = self.generate_gTTS(TTS[1], TTS_fragment_index=i)
+                    TTS_future = self.generate_gTTS(TTS[1], TTS_fragment_index=i)
 
                 case Voice_Codes.RANDOM.value:
                     voice_type = random.randint(0,len(Voice_Codes)-2)
                     if voice_type in [0,1]:
-                        TTS_file_path = self.generate_pyTTS(TTS[1], voice = voice_type, rate = pyTTS_rate, TTS_fragment_index=i)
+                        TTS_future = self.generate_pyTTS(TTS[1], voice = voice_type, rate = pyTTS_rate, TTS_fragment_index=i)
                     elif voice_type == 2:
-                        TTS_file_path = self.generate_gTTS(TTS[1], TTS_fragment_index=i)
+                        TTS_future = self.generate_gTTS(TTS[1], TTS_fragment_index=i)
 
-            #print(f"DEBUG: File path generated: {TTS_file_path}")
+            #print(f"DEBUG: File render started: {TTS_future}")
 
-            TTS_path_list.append(TTS_file_path)
+            TTS_future_list.append(TTS_future)
         
-        return TTS_path_list
+        return TTS_future_list
 
 
     # Returns a list of TTS sections divided by voice codes in the enum Voice_Codes.
@@ -181,8 +305,9 @@ class TTS_Manager(object):
         return syllable_count
     
 
+    # To be called via hotkey only. Stops the current part and skips the rest of the message.
     def _skip_current_TTS(self) -> None:
-        self._TTS_parts = []
+        self._skip_requested = True
         self._audio_player.skip_TTS()
 
 
@@ -190,8 +315,10 @@ class TTS_Manager(object):
     def _pause_unpause(self) -> None:
         self._paused = not self._paused
         if self._paused:
+            self._unpaused.clear_threadsafe()
             print("Text to speech integration is now paused.")
         elif not self._paused:
+            self._unpaused.set_threadsafe()
             print("Text to speech integration is now unpaused.")
 
 
@@ -200,67 +327,129 @@ class TTS_Manager(object):
 
     ##### Public functions
 
-    # Generates TTS file using google voice.
-    def generate_gTTS(self, text:"str", slow:"bool" = False, filename:"str" = "speech", TTS_fragment_index:"int" = 1) -> str:
+    # Starts generating TTS audio using google voice on the synthesizer's worker pool, or from the render cache. Await the returned future for the PCM bytes.
+    # The file name and index are only used for debug file output.
+    def generate_gTTS(self, text:"str", slow:"bool" = False, filename:"str" = "speech", TTS_fragment_index:"int" = 1) -> "asyncio.Future":
         file_path = self._file_path_base + filename + str(TTS_fragment_index) + ".mp3"
 
-        speech = gTTS(text = text, lang = "en", slow = False)
-        speech.save(file_path)
+        key = self._render_cache.make_key("gTTS", None, None, text, self._synthesizer.get_output_format())
+        return self._time_render(self._synthesizer.submit(self._render_cached, key, "mp3", file_path, self._synthesizer.synthesize_gTTS, text))
 
 
+    # Starts generating TTS audio using pyTTS voices on the synthesizer's worker pool, or from the render cache. Voices are male or female by default and selected using a random int.
+    # Await the returned future for the PCM bytes. The file name and index are only used for debug file output.
+    def generate_pyTTS(self, text:"str", voice:"int" = random.randint(0,1), rate:"int" = 200, filename:"str" = "speech", TTS_fragment_index:"int" = 1) -> "asyncio.Future":
+        file_path = self._file_path_base + filename + str(TTS_fragment_index) + ".wav"
 
-        return file_path
+        key = self._render_cache.make_key("pyTTS", voice, rate, text, self._synthesizer.get_output_format())
+        return self._time_render(self._synthesizer.submit(self._render_cached, key, "wav", file_path, self._synthesizer.synthesize_pyTTS, text, voice, rate))
 
 
-    # Generates TTS file using pyTTS voices. Voices are male or female by default and selected using a random int.
-    def generate_pyTTS(self, text:"str", voice:"int" = random.randint(0,1), rate:"int" = 200, filename:"str" = "speech", TTS_fragment_index:"int" = 1) -> str:
-        file_path = self._file_path_base + filename + str(TTS_fragment_index) + ".wav"
+    # Returns hit, miss and size counters for the render cache.
+    def get_cache_stats(self) -> dict:
+        return self._render_cache.get_stats()
 
-        pyTTS_voices = self._pyTTS.getProperty('voices')
 
-        
-        self._pyTTS.setProperty("voice", pyTTS_voices[voice].id)
-        self._pyTTS.setProperty("rate", rate)
+    # Stops reading new messages and returns the texts of every message that hasn't started playing, in order. Called on reload before terminating.
+    def take_pending_messages(self) -> list:
+
+        self._TTS_queue.shutdown(immediate = True)
+        self._rendered_queue.shutdown(immediate = True)
+
+        messages = list(self._pending_messages.values())
+        self._pending_messages.clear()
+        return messages
 
-        self._pyTTS.save_to_file(text, file_path)
-        self._pyTTS.runAndWait()
 
-        return file_path
+    # Queues messages taken from the module this one replaced, ahead of any new redemptions.
+    def queue_pending_messages(self, messages:"list") -> None:
+
+        for text in messages:
+            self._queue_message(text)
     
 
     # Async handling functions & termination functions.
 
     async def terminate_module(self) -> None:
 
+        was_running = self._running
+
         self._running = False
         self._TTS_queue.shutdown(immediate = True)
+        self._rendered_queue.shutdown(immediate = True)
         self._audio_player.skip_TTS()
+        self._synthesizer.shutdown()
 
-        # Waits for 3 seconds to allow queue to shut down properly.
-        await asyncio.sleep(3)
+        if self._pending_messages:
+            print(f"{len(self._pending_messages)} TTS messages were not read.")
+            self._pending_messages.clear()
+
+        # Wakes update() if it is waiting while paused, then waits only as long as it takes to exit.
+        self._unpaused.set()
+        if was_running:
+            await self._stopped.wait()
     
 
     async def update(self) -> None:
         self._running = True
+        self._stopped.clear()
+        self._unpaused.bind_loop()
+
+        # Rendering runs alongside playback so the next messages are ready by the time the current one finishes.
+        render_task = asyncio.create_task(self._render_loop())
+        prewarm_task = asyncio.create_task(self._prewarm_cache())
+
         while self._running:
             if not self._paused:
                 print("Waiting for next TTS message")
                 try:
                     await self._next_TTS_message()
+                except asyncio.QueueShutDown:
+                    print("No longer listening to TTS message.")
+                    break
                 except Exception as e:
                     print(f"TTS Queue is shut down. Exception {e}")
                     break
             else:
-                # Less frequent checking occurs while paused to improve performance.
-                await asyncio.sleep(5)
+                # Sleeps until the pause hotkey or terminate_module() wakes it.
+                await self._unpaused.wait()
+
+        for task in [render_task, prewarm_task]:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+        print(f"TTS cache stats: {self._render_cache.get_stats()}")
+        self._stopped.set()
 
     
+    # Returns the eventsub event types this module handles. The Twitch connection only subscribes to types some module handles.
+    def get_event_types(self) -> list:
+        return [Event_Type.REDEMPTION]
+
+
+    # Queues a message to be read. Returns False if TTS is shutting down.
+    def _queue_message(self, text:"str") -> bool:
+
+        message_id = next(self._message_ids)
+        try:
+            self._TTS_queue.put_nowait((message_id, text))
+        except asyncio.QueueShutDown:
+            return False
+
+        self._pending_messages[message_id] = text
+        return True
+
+
     # Receives channel point redemption event and directs it according to the matching point reward based on self._reward_titles.
-    async def handle_point_reward(self, point_reward:"ChannelPointsCustomRewardRedemptionAddEvent") -> None:
+    async def handle_point_reward(self, point_reward:"Point_Redemption") -> None:
         
 
         # TTS messages are only placed on the queue. update() constantly awaits the next TTS message.
-        match self._reward_titles.get(point_reward.event.reward.title): 
+        match self._reward_titles.get(point_reward.reward_title): 
             case "normal TTS":
-                print(f"TTS redemption from {point_reward.event.user_name} with text: {point_reward.event.user_input}")
-                self._TTS_queue.put(point_reward.event.user_input)
\ No newline at end of file
+                print(f"TTS redemption from {point_reward.user_name} with text: {point_reward.user_input}")
+                if not self._queue_message(point_reward.user_input):
+                    print("TTS is shutting down. Redemption was not queued.")
\ No newline at end of file
@@ -0,0 +1,165 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+
+##############################################################################################
+###############  Caches rendered TTS audio so repeated redemptions (copypastas ###############
+###############  and memes) skip synthesis entirely. Entries are keyed by      ###############
+###############  (engine, voice, rate, normalized text). Holds a memory tier   ###############
+###############  and an optional disk tier, each with its own byte budget.     ###############
+##############################################################################################
+
+
+
+class TTS_Render_Cache(object):
+    def __init__(self, memory_byte_budget:"int" = 32 * 1024 * 1024, disk_path:"str" = None, disk_byte_budget:"int" = 256 * 1024 * 1024) -> None:
+
+        # Renders run on worker threads, so every tier is guarded by one lock.
+        self._lock = threading.Lock()
+
+        # Both tiers keep least recently used entries first. The memory tier maps key to audio bytes, the disk tier maps file name to size.
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._memory_byte_budget = memory_byte_budget
+
+        self._disk_path = disk_path
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        self._disk_byte_budget = disk_byte_budget
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self._disk_path is not None:
+            self._load_disk_index()
+
+
+
+    ##### Private Functions
+
+    # Indexes files already in the disk tier, oldest first, so entries survive between streams.
+    def _load_disk_index(self) -> None:
+
+        os.makedirs(self._disk_path, exist_ok = True)
+
+        entries = []
+        for entry in os.scandir(self._disk_path):
+            if entry.is_file():
+                entries.append((entry.stat().st_mtime, entry.name, entry.stat().st_size))
+
+        for _, name, size in sorted(entries):
+            self._disk[name] = size
+            self._disk_bytes += size
+
+        self._evict_disk()
+
+
+    # Returns the file name used for a key in the disk tier.
+    def _disk_name(self, key:"tuple") -> str:
+        return hashlib.sha1(repr(key).encode("utf-8")).hexdigest() + ".tts"
+
+
+    def _store_memory(self, key:"tuple", audio:"bytes") -> None:
+
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+
+        self._memory[key] = audio
+        self._memory_bytes += len(audio)
+
+        while self._memory_bytes > self._memory_byte_budget and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last = False)
+            self._memory_bytes -= len(evicted)
+
+
+    def _store_disk(self, key:"tuple", audio:"bytes") -> None:
+
+        name = self._disk_name(key)
+        with open(os.path.join(self._disk_path, name), "wb") as cache_file:
+            cache_file.write(audio)
+
+        if name in self._disk:
+            self._disk_bytes -= self._disk.pop(name)
+
+        self._disk[name] = len(audio)
+        self._disk_bytes += len(audio)
+
+        self._evict_disk()
+
+
+    # Deletes least recently used disk entries until the disk tier fits its budget.
+    def _evict_disk(self) -> None:
+
+        while self._disk_bytes > self._disk_byte_budget and self._disk:
+            name, size = self._disk.popitem(last = False)
+            self._disk_bytes -= size
+
+            try:
+                os.remove(os.path.join(self._disk_path, name))
+            except FileNotFoundError:
+                pass
+
+
+
+    ##### Public Functions
+
+    # Builds a cache key. Text is lowercased and whitespace collapsed, but punctuation is kept because it changes how speech sounds.
+    # The output format is included because cached PCM is only playable by a mixer running in that format, and disk entries outlive the session.
+    @staticmethod
+    def make_key(engine:"str", voice:"int", rate:"int", text:"str", output_format:"tuple" = None) -> tuple:
+        return (engine, voice, rate, " ".join(text.lower().split()), output_format)
+
+
+    # Returns cached audio bytes for the key, or None on a miss. Disk hits are promoted to the memory tier.
+    def get(self, key:"tuple") -> "bytes | None":
+
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return audio
+
+            name = self._disk_name(key) if self._disk_path is not None else None
+            if name in self._disk:
+                try:
+                    with open(os.path.join(self._disk_path, name), "rb") as cache_file:
+                        audio = cache_file.read()
+                except FileNotFoundError:
+                    self._disk_bytes -= self._disk.pop(name)
+                else:
+                    self._disk.move_to_end(name)
+                    self._store_memory(key, audio)
+                    self.disk_hits += 1
+                    return audio
+
+            self.misses += 1
+            return None
+
+
+    # Stores rendered audio bytes in every enabled tier.
+    def put(self, key:"tuple", audio:"bytes") -> None:
+
+        with self._lock:
+            self._store_memory(key, audio)
+
+            if self._disk_path is not None:
+                self._store_disk(key, audio)
+
+
+    def get_stats(self) -> dict:
+
+        with self._lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes
+            }
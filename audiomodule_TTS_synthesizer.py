@@ -0,0 +1,141 @@
+import os
+import io
+import sys
+import asyncio
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# TTS generators
+from gtts import gTTS
+import pyttsx3
+
+# Decodes rendered speech into raw PCM for the mixer. Only mp3 needs ffmpeg; wav is read in-process.
+from pydub import AudioSegment
+
+
+
+##############################################################################################
+###############  Renders TTS audio on a pool of worker threads so synthesis    ###############
+###############  never blocks the event loop. Each worker thread owns its own  ###############
+###############  pyttsx3 engine, since engines can't be shared across threads. ###############
+###############  Audio is rendered and decoded in memory, straight into the    ###############
+###############  mixer's PCM format, so playback needs no files or ffmpeg.     ###############
+##############################################################################################
+
+
+
+class TTS_Synthesizer(object):
+    def __init__(self, worker_count:"int" = 2) -> None:
+
+        # A worker count of 0 renders synchronously on the calling thread, which blocks the event loop. Kept for benchmarking.
+        self._worker_count = worker_count
+        self._pool = None
+        if worker_count > 0:
+            self._pool = ThreadPoolExecutor(max_workers = worker_count, thread_name_prefix = "TTS_Synthesizer")
+
+        # Holds one pyttsx3 engine per thread, created the first time that thread renders a pyTTS voice.
+        self._thread_state = threading.local()
+
+        # Mixer output format as returned by pygame's mixer.get_init(): (frequency, sample format in bits, channels).
+        self._output_format = (44100, -16, 2)
+
+
+
+    ##### Private Functions
+
+    # Returns the pyttsx3 engine owned by the current thread, creating it if needed.
+    def _get_pyTTS_engine(self) -> "pyttsx3.Engine":
+
+        engine = getattr(self._thread_state, "engine", None)
+        if engine is None:
+
+            # SAPI5 voices are COM objects, and COM must be initialized on every thread that uses them.
+            if sys.platform == "win32" and threading.current_thread() is not threading.main_thread():
+                import comtypes
+                comtypes.CoInitialize()
+
+            # pyttsx3.init() hands back a cached engine shared by every thread, so a fresh Engine is built directly instead.
+            engine = pyttsx3.Engine()
+            self._thread_state.engine = engine
+
+        return engine
+
+
+    ##### Public Functions
+
+    # Runs a render function on the worker pool, or inline if the pool is disabled. Returns a future for its result.
+    def submit(self, render_function:"function", *args) -> "asyncio.Future":
+
+        loop = asyncio.get_running_loop()
+
+        if self._pool is not None:
+            return loop.run_in_executor(self._pool, render_function, *args)
+
+        future = loop.create_future()
+        try:
+            future.set_result(render_function(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+    # Sets the PCM format decoded audio is converted to. Should match the mixer that plays it.
+    def set_output_format(self, output_format:"tuple") -> None:
+        self._output_format = output_format
+
+
+    def get_output_format(self) -> tuple:
+        return self._output_format
+
+
+    # Renders speech using google voice and returns the encoded mp3 bytes. Blocking, so only call from a worker thread through submit().
+    def synthesize_gTTS(self, text:"str") -> bytes:
+
+        speech = gTTS(text = text, lang = "en", slow = False)
+
+        audio = io.BytesIO()
+        speech.write_to_fp(audio)
+
+        return audio.getvalue()
+
+
+    # Renders speech using pyTTS voices and returns the encoded wav bytes. Blocking, so only call from a worker thread through submit().
+    # pyttsx3 can only render to a file, so each render gets its own temporary file that is removed straight after reading.
+    def synthesize_pyTTS(self, text:"str", voice:"int", rate:"int") -> bytes:
+
+        engine = self._get_pyTTS_engine()
+        pyTTS_voices = engine.getProperty('voices')
+
+        engine.setProperty("voice", pyTTS_voices[voice].id)
+        engine.setProperty("rate", rate)
+
+        file_descriptor, file_path = tempfile.mkstemp(suffix = ".wav")
+        os.close(file_descriptor)
+
+        try:
+            engine.save_to_file(text, file_path)
+            engine.runAndWait()
+
+            with open(file_path, "rb") as TTS_file:
+                return TTS_file.read()
+        finally:
+            os.remove(file_path)
+
+
+    # Decodes encoded audio ("mp3" or "wav") once into raw PCM bytes in the output format, ready for mixer.Sound(buffer = ...).
+    def decode_to_pcm(self, audio:"bytes", audio_format:"str") -> bytes:
+
+        frequency, sample_format, channels = self._output_format
+
+        sound = AudioSegment.from_file(io.BytesIO(audio), format = audio_format)
+        sound = sound.set_frame_rate(frequency).set_channels(channels).set_sample_width(abs(sample_format) // 8)
+
+        return sound.raw_data
+
+
+    # Stops the worker pool. Renders that have not started yet are cancelled.
+    def shutdown(self) -> None:
+
+        if self._pool is not None:
+            self._pool.shutdown(wait = False, cancel_futures = True)
@@ -1,13 +1,22 @@
 import os
+import time
 import asyncio
-from pydub import AudioSegment
+from collections import OrderedDict
 
 from pygame import mixer
 
 from tkinter import *
 
+from utils_async import Threadsafe_Event
+from utils_metrics import metrics
+from audiomodule_voice_manager import Voice_Manager, Steal_Policy
+from utils_clock import Clock
+
+# Used for function annotation. Not required at runtime.
+from audiomodule_sound_bank import Sound_Bank
+
 class Audio_Manager():
-    def __init__(self) -> None:
+    def __init__(self, sample_cache_size:"int" = 64, sound_bank:"Sound_Bank" = None, polyphony:"int" = 8, steal_policy:"Steal_Policy" = Steal_Policy.OLDEST, sound_effect_volume:"float" = 1.0, clock:"Clock" = None) -> None:
 
         mixer.init()
 
@@ -15,6 +24,12 @@ class Audio_Manager():
         mixer.set_reserved(1)
         self._TTS_channel = mixer.Channel(0)
 
+        # Sound effects play on the remaining channels, handed out by the voice manager.
+        self._voice_manager = Voice_Manager(first_channel = 1, polyphony = polyphony, steal_policy = steal_policy, base_volume = sound_effect_volume, clock = clock)
+
+        # Set by skip_TTS() to wake play_TTS() immediately instead of waiting for the message to finish. Skipping can come from the hotkey thread.
+        self._TTS_skipped = Threadsafe_Event()
+
         # Sets up tkinter window to send audio through.
         self._window = Tk()
         self._tk_label = Label(self._window, text="Stream audio player window.")
@@ -22,6 +37,27 @@ class Audio_Manager():
 
 
         self._audio_file_exts = [".wav", ".ogg"]
+
+        # play_sound() runs on the event loop, so its duration is time the loop spends on sound effects.
+        self._play_sound_time = metrics.histogram("audio_play_sound_seconds", "Time spent in play_sound(), including loading uncached sounds.")
+        self._TTS_played = metrics.counter("audio_tts_parts_played_total", "TTS parts played.")
+        metrics.counter("audio_sounds_played_total", "Sound effects started.", function = lambda: self._voice_manager.plays)
+        metrics.counter("audio_sounds_coalesced_total", "Sound effect triggers merged into a sound already playing.", function = lambda: self._voice_manager.coalesced)
+        metrics.counter("audio_voices_stolen_total", "Sound effects cut off to make room for another.", function = lambda: self._voice_manager.steals)
+        metrics.counter("audio_sounds_dropped_total", "Sound effects not played because every voice was busy with higher priority sounds.", function = lambda: self._voice_manager.dropped)
+        metrics.gauge("audio_sample_cache_size", "Decoded sound effects in the sample cache.", function = lambda: len(self._sample_cache))
+
+        # Decoded sound effects by file path, least recently played first. Bounded so large sound libraries can't use unlimited memory.
+        self._sample_cache = OrderedDict()
+        self._sample_cache_size = sample_cache_size
+
+        # Pre-decoded sounds are built straight from the memory-mapped bank instead of decoding files. Only used if it matches the mixer's format.
+        self._sound_bank = None
+        if sound_bank is not None:
+            if sound_bank.mixer_format == mixer.get_init():
+                self._sound_bank = sound_bank
+            else:
+                print(f"Sound bank format {sound_bank.mixer_format} does not match the mixer format {mixer.get_init()}. Please rebuild the sound bank. Playing sound files instead.")
     
     # Converts the given .mp3 into a .wav file
     def _convert_mp3_to_wav(self, file_path:"str") -> str:
@@ -32,14 +68,80 @@ class Audio_Manager():
             print(f"{file_path} does not lead to a valid mp3 file. Only mp3 files can be converted.")
             return ""
 
+        # pydub is only needed for conversions, so it isn't loaded with the rest of the audio player.
+        from pydub import AudioSegment
+
         sound = AudioSegment.from_mp3(file_path)
         sound.export(file_path[:-4] + ".wav", format="wav")
         
         return file_path[:-4] + ".wav"
 
-    # Plays a sound with the given file path.
-    def play_sound(self, file_path:"str") -> None:
-    
+    # Decodes a sound file, or builds it from the sound bank if the bank has it, and stores it in the sample cache.
+    # Evicts the least recently played sound if the cache is full.
+    def _load_sample(self, file_path:"str") -> "mixer.Sound":
+
+        buffer = self._sound_bank.get_buffer(file_path) if self._sound_bank is not None else None
+
+        if buffer is not None:
+            sound = mixer.Sound(buffer = buffer)
+            buffer.release()
+        else:
+            sound = mixer.Sound(file_path)
+
+        self._sample_cache[file_path] = sound
+        if len(self._sample_cache) > self._sample_cache_size:
+            self._sample_cache.popitem(last = False)
+
+        return sound
+
+
+    # Decodes sound files into the sample cache ahead of time so their first play doesn't decode from disk. Stops once the cache is full.
+    def preload_sounds(self, file_paths:"list") -> None:
+
+        for file_path in file_paths[:self._sample_cache_size]:
+            if file_path not in self._sample_cache:
+                self._load_sample(file_path)
+
+
+    # Empties the sample cache. Used when sound files change on disk.
+    def clear_sample_cache(self) -> None:
+        self._sample_cache.clear()
+
+
+    # Sets the voice priority of a sound effect by sound name. Higher priority sounds can take voices from lower ones when every voice is busy.
+    def set_sound_priority(self, sound_name:"str", priority:"int") -> None:
+        self._voice_manager.set_priority(sound_name, priority)
+
+
+    # Returns counters for sound effect plays, coalesced triggers, stolen voices and dropped sounds.
+    def get_voice_stats(self) -> dict:
+        return self._voice_manager.get_stats()
+
+
+    # Plays a sound with the given file path. Cached sounds are played without any filesystem access.
+    # Triggers with the same sound name are treated as identical for coalescing, so all variations of a sound share one name.
+    def play_sound(self, file_path:"str", sound_name:"str" = None) -> None:
+
+        start = time.perf_counter()
+        self._play_sound(file_path, sound_name)
+        self._play_sound_time.observe(time.perf_counter() - start)
+
+
+    def _play_sound(self, file_path:"str", sound_name:"str" = None) -> None:
+
+        sound_key = sound_name if sound_name is not None else file_path
+
+        sound = self._sample_cache.get(file_path)
+        if sound is not None:
+            self._sample_cache.move_to_end(file_path)
+            self._voice_manager.play(sound_key, sound)
+            return
+
+        # Sounds in the bank are already decoded, so they skip the file checks below.
+        if self._sound_bank is not None and self._sound_bank.has_sound(file_path):
+            self._voice_manager.play(sound_key, self._load_sample(file_path))
+            return
+
 
         if os.path.isfile(file_path) and file_path[-4:] in self._audio_file_exts:
             pass
@@ -50,16 +152,27 @@ class Audio_Manager():
             print(f"{file_path} does not lead to a playable audio file. Please make sure the audio file has an extension from the following list: {self._audio_file_exts}")
             return
         
-        sound = mixer.Sound(file_path)
+        sound = self._load_sample(file_path)
 
-        sound.play()
+        self._voice_manager.play(sound_key, sound)
 
 
 
-    # This function is awaited until TTS is no longer playing, in order to allow deletion of TTS file after playing.
-    async def play_TTS(self, file_path:"str") -> None:
+    # Returns the mixer's output format as (frequency, sample format in bits, channels). Raw PCM buffers must match it.
+    def get_mixer_format(self) -> tuple:
+        return mixer.get_init()
 
 
+    # This function is awaited until TTS is no longer playing. Takes raw PCM bytes in the mixer's format, which are played without touching the disk.
+    # A file path is also accepted, in which case the TTS file is deleted after playing.
+    async def play_TTS(self, audio:"bytes | str") -> None:
+
+        if isinstance(audio, (bytes, bytearray, memoryview)):
+            await self._play_TTS_sound(mixer.Sound(buffer = audio))
+            return
+
+        file_path = audio
+
         if os.path.isfile(file_path) and file_path[-4:] in self._audio_file_exts:
             pass
         elif os.path.isfile(file_path) and file_path[-4:] == ".mp3":
@@ -73,23 +186,38 @@ class Audio_Manager():
             print(f"{file_path} does not lead to a playable audio file. Please make sure the audio file has an extension from the following list: {self._audio_file_exts}")
             return
         
-        TTS = mixer.Sound(file_path)
-
-        self._TTS_channel.play(TTS)
-
-        while self._TTS_channel.get_busy():
-            await asyncio.sleep(0.7) # Provides other concurrent functions time to run while TTS messages are being played.
+        await self._play_TTS_sound(mixer.Sound(file_path))
 
         # Removes tts after it plays, in order to allow a new TTS file to be generated
         os.remove(file_path)
         return
+
+
+    # Plays a sound on the TTS channel and waits until it finishes or is skipped.
+    async def _play_TTS_sound(self, TTS:"mixer.Sound") -> None:
+
+        self._TTS_played.inc()
+        self._TTS_skipped.clear()
+        self._TTS_channel.play(TTS)
+
+        # Sleeps for the length of the message unless skipped, then only checks briefly in case playback started late.
+        try:
+            await asyncio.wait_for(self._TTS_skipped.wait(), timeout = TTS.get_length())
+        except TimeoutError:
+            pass
+
+        while self._TTS_channel.get_busy() and not self._TTS_skipped.is_set():
+            await asyncio.sleep(0.02)
     
     # Skips the current TTS message being played.
     def skip_TTS(self) -> None:
         self._TTS_channel.stop()
+        self._TTS_skipped.set_threadsafe()
 
     # Closes tkinter window properly. 
     async def terminate_module(self) -> None:
+        print(f"Sound effect voice stats: {self._voice_manager.get_stats()}")
+        self._voice_manager.stop_all()
         self._window.quit()
 
     # Maintains tkinter window.
@@ -0,0 +1,184 @@
+import mmap
+import random
+import struct
+
+from pygame import mixer
+
+from audiomodule_sound_library import Sound_Library
+
+
+
+##############################################################################################
+###############  Packs the sound_effects folder into one sample bank file of   ###############
+###############  pre-decoded PCM in the mixer's native format, plus an index.  ###############
+###############  The bank is memory-mapped at startup, so loading takes the    ###############
+###############  same time for any library size and unused clips are never     ###############
+###############  paged in. Build it with: py audiomodule_sound_bank.py         ###############
+##############################################################################################
+
+
+SOUND_BANK_FILENAME = "sound_effects.bank"
+
+# Header: magic, version, frequency, sample format in bits, channels, entry count.
+_HEADER = struct.Struct("<4sHIhHI")
+# Index entry: sound name length, file path length, data offset, data length. Followed by the name and path in utf-8.
+_ENTRY = struct.Struct("<HHQQ")
+
+_MAGIC = b"SKSB"
+_VERSION = 1
+
+# Clip data starts on page boundaries so reading one clip never pages in part of another.
+_PAGE_SIZE = 4096
+
+
+
+# Decodes every sound in the sound effects folder and writes them to a bank file. The mixer must be initialized in the format it will play in.
+def build_sound_bank(directory:"str" = ".\\sound_effects\\", bank_path:"str" = SOUND_BANK_FILENAME) -> None:
+
+    mixer_format = mixer.get_init()
+    if mixer_format is None:
+        raise Exception("The mixer must be initialized before building a sound bank.")
+
+    library = Sound_Library(directory)
+
+    entries = []
+    for sound_name in library.get_sound_names():
+        for file_path in library.get_variations(sound_name):
+            entries.append((sound_name, file_path, mixer.Sound(file_path).get_raw()))
+
+    index_size = sum(_ENTRY.size + len(name.encode("utf-8")) + len(path.encode("utf-8")) for name, path, _ in entries)
+    offset = _align(_HEADER.size + index_size)
+
+    with open(bank_path, "wb") as bank_file:
+        bank_file.write(_HEADER.pack(_MAGIC, _VERSION, *mixer_format, len(entries)))
+
+        data_offsets = []
+        for name, path, pcm in entries:
+            data_offsets.append(offset)
+            bank_file.write(_ENTRY.pack(len(name.encode("utf-8")), len(path.encode("utf-8")), offset, len(pcm)))
+            bank_file.write(name.encode("utf-8"))
+            bank_file.write(path.encode("utf-8"))
+            offset = _align(offset + len(pcm))
+
+        for data_offset, (_, _, pcm) in zip(data_offsets, entries):
+            bank_file.seek(data_offset)
+            bank_file.write(pcm)
+
+    print(f"Built {bank_path} with {len(entries)} sounds in format {mixer_format}.")
+
+
+def _align(offset:"int") -> int:
+    return (offset + _PAGE_SIZE - 1) // _PAGE_SIZE * _PAGE_SIZE
+
+
+
+#### Read-only view of a sound bank file. Can stand in for Sound_Library, with the bank's file paths used as sound keys.
+
+class Sound_Bank(object):
+    def __init__(self, bank_path:"str" = SOUND_BANK_FILENAME) -> None:
+
+        self._bank_path = bank_path
+        self._file = None
+        self._map = None
+
+        # Maps file path to (offset, length) in the bank, and sound name to the file paths of its variations.
+        self._entries = {}
+        self._sounds = {}
+        self.mixer_format = None
+
+        self.refresh()
+
+
+
+    ##### Public Functions
+
+    # Maps the bank file and reads its index. Call again after rebuilding the bank while live.
+    def refresh(self) -> None:
+
+        self.close()
+
+        self._file = open(self._bank_path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ)
+
+        magic, version, frequency, sample_format, channels, count = _HEADER.unpack_from(self._map, 0)
+        if magic != _MAGIC or version != _VERSION:
+            self.close()
+            raise Exception(f"{self._bank_path} is not a version {_VERSION} sound bank. Please rebuild it.")
+
+        self.mixer_format = (frequency, sample_format, channels)
+
+        entries = {}
+        sounds = {}
+        position = _HEADER.size
+        for _ in range(count):
+            name_length, path_length, offset, length = _ENTRY.unpack_from(self._map, position)
+            position += _ENTRY.size
+
+            name = bytes(self._map[position:position + name_length]).decode("utf-8")
+            position += name_length
+            path = bytes(self._map[position:position + path_length]).decode("utf-8")
+            position += path_length
+
+            entries[path] = (offset, length)
+            sounds.setdefault(name, []).append(path)
+
+        self._entries = entries
+        self._sounds = {name: tuple(paths) for name, paths in sounds.items()}
+
+
+    # Returns a zero-copy view of a sound's PCM data, or None if the bank doesn't contain it. Only the pages read are loaded from disk.
+    def get_buffer(self, file_path:"str") -> "memoryview | None":
+
+        entry = self._entries.get(file_path)
+        if entry is None:
+            return None
+
+        offset, length = entry
+        return memoryview(self._map)[offset:offset + length]
+
+
+    def has_sound(self, file_path:"str") -> bool:
+        return file_path in self._entries
+
+
+    # Returns the file path of a random variation of the sound, or an empty string if the sound doesn't exist.
+    def choose(self, sound_name:"str") -> str:
+
+        paths = self._sounds.get(sound_name)
+        if not paths:
+            return ""
+
+        return random.choice(paths)
+
+
+    def get_variations(self, sound_name:"str") -> tuple:
+        return self._sounds.get(sound_name, ())
+
+
+    def get_all_paths(self) -> list:
+        return list(self._entries.keys())
+
+
+    def get_sound_names(self) -> list:
+        return list(self._sounds.keys())
+
+
+    def close(self) -> None:
+
+        # Views handed out by get_buffer() keep the map open until they are released, so closing is best effort.
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                pass
+            self._map = None
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+
+if __name__ == "__main__":
+    mixer.init()
+    build_sound_bank()
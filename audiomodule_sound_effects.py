@@ -1,8 +1,6 @@
-import os
-import string
-import random
-
-from twitchAPI.object.eventsub import ChannelChatMessageEvent
+from utils_events import Chat_Message, Event_Type
+from audiomodule_sound_library import Sound_Library
+from utils_clock import Clock, real_clock
 
 # Used for function annotation. Not required at runtime.
 from audiomodule_audio_player import Audio_Manager
@@ -10,13 +8,26 @@ from audiomodule_audio_player import Audio_Manager
 
 
 class Sound_Manager(object):
-    def __init__(self, audio_player:"Audio_Manager") -> None:
+    def __init__(self, audio_player:"Audio_Manager", sound_library:"Sound_Library" = None, preload_sounds:"bool" = True, cooldown:"float" = 0.0, sound_priorities:"dict" = None, clock:"Clock" = None) -> None:
         
         self._audio_player = audio_player
 
-        # Creates dictionary of available commands as well as values to identify conditions for gameplay.
-        self._last_message = None
+        # Seconds before the same sound can play again, with the time each sound last played.
+        self._cooldown = cooldown
+        self._last_played = {}
+        self._clock = clock if clock is not None else real_clock
+
+        # Sounds with a higher priority can cut off lower ones when every voice is busy. Unlisted sounds have priority 0.
+        for sound_name, priority in (sound_priorities or {}).items():
+            self._audio_player.set_sound_priority(sound_name, priority)
+
+        # Sound files are indexed once at startup. With preloading, they are also decoded up front instead of on first play.
+        self._sound_library = sound_library if sound_library is not None else Sound_Library()
+        self._preload_sounds = preload_sounds
+        if self._preload_sounds:
+            self._audio_player.preload_sounds(self._sound_library.get_all_paths())
 
+        # Creates dictionary of available commands as well as values to identify conditions for gameplay.
         self._chat_commands = {}
 
         self._chat_commands.update(dict.fromkeys(["meow", "myar", "mrow", "mrowr"], "meow"))
@@ -24,60 +35,60 @@ class Sound_Manager(object):
 
     
 
-    # Verifies that a .ogg or .wav file exists based on a given sound name. Ogg files are always prioritized over Wav files.
-    # A number of variations can be provided to check a list of files in the sound_effects\ folder, with each file in the list following the format: [name][index][filetype].
-    def _construct_filepath(self, sound_name:"str", variations:"int" = 1) -> str:
-        file_path_base = ".\\sound_effects\\"
+    # Plays a random variation of the named sound, unless it played less than the cooldown ago.
+    def _play(self, sound_name:"str") -> None:
 
-        if variations > 1:
-            variation_list = []
-            for i in range(variations):
-                variation_list.append(i)
+        if self._cooldown > 0:
+            now = self._clock.now()
+            if now - self._last_played.get(sound_name, -self._cooldown) < self._cooldown:
+                return
+            self._last_played[sound_name] = now
 
-            while len(variation_list) > 0:
+        file_path = self._sound_library.choose(sound_name)
+        if file_path == "":
+            print(f"No sound files found for {sound_name}.")
+            return
 
-                variation = random.randint(0, len(variation_list) - 1)
+        self._audio_player.play_sound(file_path, sound_name)
 
-                if os.path.isfile(file_path_base + sound_name + str(variation) + ".ogg"):
-                    return file_path_base + sound_name + str(variation) + ".ogg"
-                elif os.path.isfile(file_path_base + sound_name + str(variation) + ".wav"):
-                    return file_path_base + sound_name + str(variation) + ".wav"
-                else:
 
-                    variation_list.pop(variation)
-        else:
-            if os.path.isfile(file_path_base + sound_name + ".ogg"):
-                return file_path_base + sound_name + ".ogg"
-            elif os.path.isfile(file_path_base + sound_name + ".wav"):
-                return file_path_base + sound_name + ".wav"
-        
-        print("No matching files. Returning empty string.")
-        return ""
-            
 
+    ##### Public functions
 
+    # Rescans the sound effects folder and drops decoded sounds, so files added or changed while live can be played.
+    def refresh_sounds(self) -> None:
 
-    ##### Public functions
+        self._sound_library.refresh()
+        self._audio_player.clear_sample_cache()
+
+        if self._preload_sounds:
+            self._audio_player.preload_sounds(self._sound_library.get_all_paths())
+
+        print(f"Sound effects refreshed. Available sounds: {self._sound_library.get_sound_names()}")
+
+
+    # Returns the eventsub event types this module handles. The Twitch connection only subscribes to types some module handles.
+    def get_event_types(self) -> list:
+        return [Event_Type.CHAT]
+
+
+    # Returns every chat command and alias this module reacts to. Used by the Twitch connection to build its command index.
+    def get_chat_commands(self) -> list:
+        return list(self._chat_commands.keys())
 
 
     # Receives chat message event and directs it according to the matching command based on self._chat_commands.
-    async def handle_chat_message(self, chat_message:"ChannelChatMessageEvent") -> None:
+    async def handle_chat_message(self, chat_message:"Chat_Message") -> None:
         
-        # Normalizes username to lowercase and removes punctuation for flexible command matching.
-        text = str.lower(chat_message.event.message.text)
-        text.translate(str.maketrans('', '', string.punctuation))
+        # Text is already lowercased and stripped of punctuation by the Twitch connection.
+        text = chat_message.text
 
         match self._chat_commands.get(text): 
 
             case "meow":
-                if self._chat_commands.get(text) != self._chat_commands.get(self._last_message):
-                    meow = self._construct_filepath("meow", variations=17)
-                    self._audio_player.play_sound(meow)
+                if self._chat_commands.get(text) != self._chat_commands.get(chat_message.previous_text):
+                    self._play("meow")
 
             case "bonk":
-                if self._chat_commands.get(text) != self._chat_commands.get(self._last_message):
-                    bonk = self._construct_filepath("bonk")
-                    self._audio_player.play_sound(bonk)
-
-        
-        self._last_message = text
\ No newline at end of file
+                if self._chat_commands.get(text) != self._chat_commands.get(chat_message.previous_text):
+                    self._play("bonk")
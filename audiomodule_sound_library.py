@@ -0,0 +1,82 @@
+import os
+import re
+import random
+
+
+
+##############################################################################################
+###############  Index of sound effects in the sound_effects folder, built by  ###############
+###############  scanning the folder once so triggering a sound never touches  ###############
+###############  the filesystem. Files follow the format [name][index][type],  ###############
+###############  so meow0.ogg to meow16.ogg are all variations of "meow".      ###############
+##############################################################################################
+
+
+
+class Sound_Library(object):
+    def __init__(self, directory:"str" = ".\\sound_effects\\") -> None:
+
+        self._directory = directory
+
+        # Ogg files are always prioritized over Wav files when both exist for the same variation.
+        self._audio_file_exts = [".ogg", ".wav"]
+        self._file_name_pattern = re.compile(r"^(.*?)(\d*)$")
+
+        # Maps sound name to the file paths of all of its variations.
+        self._sounds = {}
+
+        self.refresh()
+
+
+
+    ##### Public Functions
+
+    # Rescans the sound effects folder. Call after adding or removing sound files while live.
+    def refresh(self) -> None:
+
+        variations = {}
+
+        try:
+            file_names = os.listdir(self._directory)
+        except FileNotFoundError:
+            print(f"{self._directory} does not exist. No sound effects are available.")
+            file_names = []
+
+        for file_name in file_names:
+            base_name, ext = os.path.splitext(file_name)
+            if ext.lower() not in self._audio_file_exts:
+                continue
+
+            sound_name, variation = self._file_name_pattern.match(base_name).groups()
+            sound_name = sound_name.lower()
+
+            # Keeps one file per variation, preferring the higher priority extension.
+            existing = variations.setdefault(sound_name, {}).get(variation)
+            if existing is None or self._audio_file_exts.index(ext.lower()) < self._audio_file_exts.index(os.path.splitext(existing)[1].lower()):
+                variations[sound_name][variation] = self._directory + file_name
+
+        # Swapped in as a whole so lookups never see a half-built index.
+        self._sounds = {sound_name: tuple(paths.values()) for sound_name, paths in variations.items()}
+
+
+    # Returns the file path of a random variation of the sound, or an empty string if the sound doesn't exist.
+    def choose(self, sound_name:"str") -> str:
+
+        paths = self._sounds.get(sound_name)
+        if not paths:
+            return ""
+
+        return random.choice(paths)
+
+
+    def get_variations(self, sound_name:"str") -> tuple:
+        return self._sounds.get(sound_name, ())
+
+
+    # Returns every file path in the library.
+    def get_all_paths(self) -> list:
+        return [path for paths in self._sounds.values() for path in paths]
+
+
+    def get_sound_names(self) -> list:
+        return list(self._sounds.keys())
@@ -0,0 +1,132 @@
+from enum import Enum
+
+from pygame import mixer
+
+from utils_clock import Clock, real_clock
+
+
+
+##############################################################################################
+###############  Allocates mixer channels ("voices") to sound effects. Caps    ###############
+###############  how many effects play at once, steals voices by priority when ###############
+###############  every voice is busy, and merges identical triggers that land  ###############
+###############  within a short window into one play, so chat spam            ###############
+###############  can't drop sounds at random or pile up mixing work.           ###############
+##############################################################################################
+
+
+
+class Steal_Policy(Enum):
+
+    OLDEST = "oldest"
+    QUIETEST = "quietest"
+
+
+
+class Voice_Manager(object):
+    def __init__(self, first_channel:"int" = 1, polyphony:"int" = 8, steal_policy:"Steal_Policy" = Steal_Policy.OLDEST, coalesce_window:"float" = 0.08, base_volume:"float" = 1.0, coalesce_volume_step:"float" = 0.1, clock:"Clock" = None) -> None:
+
+        self._clock = clock if clock is not None else real_clock
+
+        # Channels below first_channel are left alone, since they are reserved for things like TTS.
+        mixer.set_num_channels(first_channel + polyphony)
+        self._channels = [mixer.Channel(i) for i in range(first_channel, first_channel + polyphony)]
+
+        # Per voice state, by index into self._channels: [sound key, start time, priority]. None while the voice has never played.
+        self._voices = [None] * polyphony
+        self._steal_policy = steal_policy
+
+        # Identical triggers within the window are merged into the voice already playing instead of starting another one.
+        # Sounds play at full volume unless base_volume is lowered, which leaves room for each merged trigger to make the voice louder.
+        self._coalesce_window = coalesce_window
+        self._base_volume = base_volume
+        self._coalesce_volume_step = coalesce_volume_step
+        self._last_trigger = {}
+
+        self._priorities = {}
+
+        self.plays = 0
+        self.coalesced = 0
+        self.steals = 0
+        self.dropped = 0
+
+
+
+    ##### Private Functions
+
+    # Returns the index of a free voice, or a voice that may be stolen for a sound with the given priority. Returns None if no voice can be used.
+    def _allocate_voice(self, priority:"int") -> "int | None":
+
+        for i, channel in enumerate(self._channels):
+            if not channel.get_busy():
+                return i
+
+        candidates = [i for i, voice in enumerate(self._voices) if voice is not None and voice[2] <= priority]
+        if not candidates:
+            return None
+
+        # Lower priority voices are always stolen first. Ties are broken by the steal policy.
+        match self._steal_policy:
+            case Steal_Policy.OLDEST:
+                victim = min(candidates, key = lambda i: (self._voices[i][2], self._voices[i][1]))
+            case Steal_Policy.QUIETEST:
+                victim = min(candidates, key = lambda i: (self._voices[i][2], self._channels[i].get_volume(), self._voices[i][1]))
+
+        self.steals += 1
+        return victim
+
+
+
+    ##### Public Functions
+
+    # Sets the priority of a sound. Higher priority sounds can steal voices from lower ones, never the other way around. Defaults to 0.
+    def set_priority(self, sound_key:"str", priority:"int") -> None:
+        self._priorities[sound_key] = priority
+
+
+    # Plays a sound under the given key, which identifies identical triggers. Returns True if the sound was played or merged into a playing one.
+    def play(self, sound_key:"str", sound:"mixer.Sound") -> bool:
+
+        now = self._clock.now()
+
+        # Merges the trigger into the voice still playing the same sound, if it started within the window.
+        last_trigger = self._last_trigger.get(sound_key)
+        if last_trigger is not None:
+            voice_index, start_time = last_trigger
+            voice = self._voices[voice_index]
+            if now - start_time <= self._coalesce_window and voice is not None and voice[0] == sound_key and self._channels[voice_index].get_busy():
+                channel = self._channels[voice_index]
+                channel.set_volume(min(1.0, channel.get_volume() + self._coalesce_volume_step))
+                self.coalesced += 1
+                return True
+
+        priority = self._priorities.get(sound_key, 0)
+        voice_index = self._allocate_voice(priority)
+        if voice_index is None:
+            self.dropped += 1
+            return False
+
+        channel = self._channels[voice_index]
+        channel.play(sound)
+        channel.set_volume(self._base_volume)
+
+        self._voices[voice_index] = [sound_key, now, priority]
+        self._last_trigger[sound_key] = (voice_index, now)
+        self.plays += 1
+        return True
+
+
+    # Stops every voice.
+    def stop_all(self) -> None:
+        for channel in self._channels:
+            channel.stop()
+
+
+    def get_stats(self) -> dict:
+        return {
+            "plays": self.plays,
+            "coalesced": self.coalesced,
+            "steals": self.steals,
+            "dropped": self.dropped,
+            "active_voices": sum(1 for channel in self._channels if channel.get_busy())
+        }
@@ -0,0 +1,104 @@
+import time
+import asyncio
+
+from audiomodule_TTS import TTS_Manager
+from audiomodule_TTS_synthesizer import TTS_Synthesizer
+from benchmark_stubs import Stub_Hotkey_Manager
+
+
+##############################################################################################
+###############  Measures how long TTS synthesis blocks the event loop, and    ###############
+###############  the silent gap between TTS messages, with synthesis inline    ###############
+###############  (worker count 0) and on the worker pool with prefetch.        ###############
+###############  Run with: py benchmark_TTS.py                                 ###############
+##############################################################################################
+
+
+MESSAGE_COUNT = 8
+RENDER_SECONDS = 0.3
+PLAY_SECONDS = 0.5
+LAG_SAMPLE_SECONDS = 0.005
+
+
+
+# Sleeps instead of synthesizing, the same way pyttsx3's runAndWait() and gTTS's save() hold the calling thread.
+class Fake_Synthesizer(TTS_Synthesizer):
+    def synthesize_gTTS(self, text:"str") -> bytes:
+        time.sleep(RENDER_SECONDS)
+        return b"\x00" * 4
+
+    def synthesize_pyTTS(self, text:"str", voice:"int", rate:"int") -> bytes:
+        time.sleep(RENDER_SECONDS)
+        return b"\x00" * 4
+
+    def decode_to_pcm(self, audio:"bytes", audio_format:"str") -> bytes:
+        return audio
+
+
+
+# Records when each TTS part starts and finishes playing.
+class Timing_Audio_Manager(object):
+    def __init__(self) -> None:
+        self.play_times = []
+
+    def get_mixer_format(self) -> tuple:
+        return (44100, -16, 2)
+
+    async def play_TTS(self, audio:"bytes") -> None:
+        start = time.perf_counter()
+        await asyncio.sleep(PLAY_SECONDS)
+        self.play_times.append((start, time.perf_counter()))
+
+    def skip_TTS(self) -> None:
+        return
+
+
+
+# Samples how late short sleeps wake up. Anything beyond the requested sleep is time the loop was blocked.
+async def monitor_loop_lag(lag_samples:"list") -> None:
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(LAG_SAMPLE_SECONDS)
+        lag_samples.append(time.perf_counter() - start - LAG_SAMPLE_SECONDS)
+
+
+
+async def run_benchmark(worker_count:"int") -> dict:
+
+    audio_player = Timing_Audio_Manager()
+    TTS = TTS_Manager(Stub_Hotkey_Manager(), audio_player, synthesizer = Fake_Synthesizer(worker_count), prewarm_file = None, reward_title = "TTS")
+
+    lag_samples = []
+    lag_task = asyncio.create_task(monitor_loop_lag(lag_samples))
+    update_task = asyncio.create_task(TTS.update())
+
+    # Single-voice messages so each message renders exactly one part.
+    for i in range(MESSAGE_COUNT):
+        TTS._queue_message(f"[g] benchmark message number {i}")
+
+    while len(audio_player.play_times) < MESSAGE_COUNT:
+        await asyncio.sleep(0.05)
+
+    await TTS.terminate_module()
+    await update_task
+    lag_task.cancel()
+
+    gaps = [audio_player.play_times[i + 1][0] - audio_player.play_times[i][1] for i in range(MESSAGE_COUNT - 1)]
+
+    return {
+        "max_loop_block_ms": max(lag_samples) * 1000,
+        "mean_gap_ms": sum(gaps) / len(gaps) * 1000,
+        "total_seconds": audio_player.play_times[-1][1] - audio_player.play_times[0][0]
+    }
+
+
+
+if __name__ == "__main__":
+
+    for label, worker_count in [("Inline synthesis (before)", 0), ("Worker pool + prefetch (after)", 2)]:
+        results = asyncio.run(run_benchmark(worker_count))
+
+        print(label)
+        print(f"  Max event loop block: {results['max_loop_block_ms']:.1f}ms")
+        print(f"  Mean gap between messages: {results['mean_gap_ms']:.1f}ms")
+        print(f"  Total playback time for {MESSAGE_COUNT} messages: {results['total_seconds']:.2f}s\n")
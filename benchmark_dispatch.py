@@ -0,0 +1,404 @@
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import tempfile
+import contextlib
+from types import MethodType
+
+from twitch_api import Twitch_Connection
+from utils_dispatch import Dispatch_Mode, Overflow_Policy
+from audiomodule_TTS import TTS_Manager
+from audiomodule_TTS_synthesizer import TTS_Synthesizer
+from audiomodule_sound_effects import Sound_Manager
+from audiomodule_sound_library import Sound_Library
+from mode_minigolf import Minigolf_Manager
+from utils_input_backend import Recording_Input_Backend
+from utils_memory_profiler import Memory_Profiler
+from utils_clock import Clock, Virtual_Clock, real_clock
+from utils_event_log import Event_Replayer, Logged_Event, make_chat_message_event, make_redemption_event
+from benchmark_stubs import Stub_Hotkey_Manager, Stub_Audio_Manager
+from benchmark_TTS import monitor_loop_lag
+
+
+##############################################################################################
+###############  Feeds synthetic chat messages and point redemptions through   ###############
+###############  the Twitch connection's eventsub callbacks into the real      ###############
+###############  sound effect, minigolf and TTS modules, with stub audio,      ###############
+###############  input and speech backends. Reports throughput, dispatch       ###############
+###############  latency and event loop lag, and saves them as JSON so runs    ###############
+###############  can be compared. Needs no display, audio device or input      ###############
+###############  injection, so it runs headless, including on Linux without    ###############
+###############  an X server. Recorded sessions can be replayed instead of     ###############
+###############  synthetic chat. With --virtual-time, runs on simulated time   ###############
+###############  so long soak runs finish in seconds with deterministic        ###############
+###############  timing. Run with: py benchmark_dispatch.py --help             ###############
+##############################################################################################
+
+
+DEFAULT_OUTPUT_FILE = "benchmark_dispatch.json"
+DRAIN_TIMEOUT_SECONDS = 10
+DRAIN_POLL_SECONDS = 0.01
+
+# Relative weights of chat messages. Most chat matches no command, and commands arrive in a few spellings.
+DEFAULT_CHAT_MIX = {
+    "meow": 6, "Meow!!": 2, "mrow": 1, "bonk": 3,
+    "up": 4, "left": 3, "right": 3, "down": 2, "slightly left": 1, "more": 2, "stop": 1, "jump": 1,
+    "hello chat": 30, "lol": 20, "is this golf it": 10, "KEKW": 10
+}
+
+TTS_MESSAGES = ["[g] hello stream", "[m] this is a test [f] of two voices", "[r] meow meow meow"]
+
+SOUND_FILES = ["meow0.ogg", "meow1.ogg", "bonk0.ogg"]
+
+
+
+# Returns silence instantly, so the benchmark measures dispatch and not speech synthesis.
+class Silent_Synthesizer(TTS_Synthesizer):
+    def synthesize_gTTS(self, text:"str") -> bytes:
+        return b"\x00" * 4
+
+    def synthesize_pyTTS(self, text:"str", voice:"int", rate:"int") -> bytes:
+        return b"\x00" * 4
+
+    def decode_to_pcm(self, audio:"bytes", audio_format:"str") -> bytes:
+        return audio
+
+
+
+#### Builds synthetic chat messages and redemptions as eventsub stand-ins.
+
+class Load_Generator(object):
+    def __init__(self, chat_mix:"dict", redemption_share:"float", viewer_count:"int", seed:"int", reward_title:"str") -> None:
+
+        self._random = random.Random(seed)
+        self._chat_texts = list(chat_mix.keys())
+        self._chat_weights = list(chat_mix.values())
+        self._redemption_share = redemption_share
+
+        self._viewers = [(str(100000 + i), f"viewer{i}") for i in range(viewer_count)]
+        self._reward_title = reward_title
+        self._next_id = 0
+
+
+
+    ##### Private Functions
+
+    def _new_id(self) -> str:
+        self._next_id += 1
+        return f"benchmark-{self._next_id}"
+
+
+
+
+    ##### Public Functions
+
+    # Returns a list of (send offset in seconds, is redemption, event id, event), drawn from the chat mix and redemption share.
+    # A rate of 0 gives every event an offset of 0, so they are sent as fast as possible.
+    def generate(self, count:"int", rate:"float") -> list:
+
+        events = []
+        for i in range(count):
+            offset = i / rate if rate else 0
+            user_id, user_name = self._random.choice(self._viewers)
+            event_id = self._new_id()
+
+            if self._random.random() < self._redemption_share:
+                event = make_redemption_event(event_id, user_id, user_name, self._random.choice(TTS_MESSAGES), self._reward_title)
+                events.append((offset, True, event_id, event))
+            else:
+                event = make_chat_message_event(event_id, self._random.choices(self._chat_texts, self._chat_weights)[0], user_id, user_name)
+                events.append((offset, False, event_id, event))
+
+        return events
+
+
+
+# Returns the chat and redemptions of a recorded session in the same form as Load_Generator.generate(), with offsets scaled by the speed.
+# A speed of 0 sends them as fast as possible.
+def load_recording(recording_path:"str", speed:"float") -> list:
+
+    events = []
+    first_timestamp = None
+
+    for timestamp, event_type, event in Event_Replayer(recording_path).read_events():
+        if event_type == Logged_Event.SESSION:
+            continue
+
+        if first_timestamp is None:
+            first_timestamp = timestamp
+
+        offset = (timestamp - first_timestamp) / speed if speed else 0
+        if event_type == Logged_Event.REDEMPTION:
+            events.append((offset, True, event.event.id, event))
+        else:
+            events.append((offset, False, event.event.message_id, event))
+
+    return events
+
+
+
+# Returns the value below which the given fraction of samples fall.
+def percentile(samples:"list", fraction:"float") -> float:
+
+    if not samples:
+        return 0.0
+
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize_ms(samples:"list") -> dict:
+    return {
+        "p50": percentile(samples, 0.5) * 1000,
+        "p99": percentile(samples, 0.99) * 1000,
+        "max": max(samples, default = 0.0) * 1000
+    }
+
+
+# Replaces a module's eventsub handler with one that records how long after its scheduled send time each event was handled.
+# The replacement is bound to the module, so the connection still groups it with the module's other callbacks.
+def time_handler(module, handler_name:"str", sent_times:"dict", latencies:"list", clock:"Clock") -> None:
+
+    handler = getattr(module, handler_name)
+
+    async def timed_handler(self, data) -> None:
+        await handler(data)
+
+        event_id = data.message_id if handler_name == "handle_chat_message" else data.redemption_id
+        latencies.append(clock.now() - sent_times[event_id])
+
+    setattr(module, handler_name, MethodType(timed_handler, module))
+
+
+# Waits until every inbox and the TTS queues are empty, or the timeout passes. Returns False on timeout.
+async def wait_for_drain(connection:"Twitch_Connection", TTS:"TTS_Manager", clock:"Clock") -> bool:
+
+    deadline = clock.now() + DRAIN_TIMEOUT_SECONDS
+    while clock.now() < deadline:
+        if not any(connection.get_inbox_depths().values()) and TTS._TTS_queue.empty() and TTS._rendered_queue.empty():
+            return True
+        await asyncio.sleep(DRAIN_POLL_SECONDS)
+
+    return False
+
+
+
+# Latencies and send times are in the clock's time, which is simulated with a virtual clock. Throughput is always in real time.
+async def run_benchmark(settings:"dict", clock:"Clock" = real_clock) -> dict:
+
+    virtual_time = isinstance(clock, Virtual_Clock)
+
+    hotkey_manager = Stub_Hotkey_Manager()
+    audio_player = Stub_Audio_Manager()
+
+    # Sound_Library only reads file names, so empty files are enough to give the sound commands something to choose.
+    sound_directory = tempfile.TemporaryDirectory()
+    for file_name in SOUND_FILES:
+        open(os.path.join(sound_directory.name, file_name), "wb").close()
+
+    sound_effects = Sound_Manager(audio_player, Sound_Library(os.path.join(sound_directory.name, "")), preload_sounds = False)
+    minigolf = Minigolf_Manager(hotkey_manager, input_backend = Recording_Input_Backend(clock = clock), clock = clock)
+
+    # On simulated time, speech renders inline so worker threads running in real time can't make the timing vary between runs.
+    TTS = TTS_Manager(hotkey_manager, audio_player, synthesizer = Silent_Synthesizer(0 if virtual_time else 2), prewarm_file = None, reward_title = settings["reward_title"])
+    modules = [sound_effects, minigolf, TTS]
+
+    # Soak runs can profile memory alongside the modules, the same way a stream would.
+    if settings["memory_profile_interval"]:
+        modules.append(Memory_Profiler(snapshot_interval = settings["memory_profile_interval"], report_file = settings["memory_report_file"]))
+
+    # Minigolf ignores chat while paused, which is how it starts.
+    minigolf._paused = False
+
+    sent_times = {}
+    module_latencies = {type(module).__name__: [] for module in modules}
+    for module in modules:
+        for handler_name in ("handle_chat_message", "handle_point_reward"):
+            if callable(getattr(module, handler_name, None)):
+                time_handler(module, handler_name, sent_times, module_latencies[type(module).__name__], clock)
+
+    connection = Twitch_Connection(modules, dispatch_mode = settings["dispatch_mode"], inbox_size = settings["inbox_size"], overflow_policy = settings["overflow_policy"])
+
+    # Events are built or read up front so generating them isn't measured.
+    if settings["replay"]:
+        events = load_recording(settings["replay"], settings["replay_speed"])
+    else:
+        event_count = int(settings["rate"] * settings["seconds"]) if settings["rate"] else settings["event_count"]
+        generator = Load_Generator(settings["chat_mix"], settings["redemption_share"], settings["viewer_count"], settings["seed"], settings["reward_title"])
+        events = generator.generate(event_count, settings["rate"])
+
+    for inbox in connection._inboxes.values():
+        inbox.start()
+    update_tasks = [asyncio.create_task(module.update()) for module in modules if callable(getattr(module, "update", None))]
+
+    # Loop lag is measured in real time, so it means nothing on simulated time.
+    lag_samples = []
+    lag_task = asyncio.create_task(monitor_loop_lag(lag_samples)) if not virtual_time else None
+
+    # Lets every module reach its idle wait before sending.
+    await asyncio.sleep(0.1)
+
+    # Latency is measured from each event's scheduled send time, so falling behind the target rate shows up as latency.
+    wall_start = time.perf_counter()
+    start = clock.now()
+    for offset, is_redemption, event_id, event in events:
+
+        scheduled = start + offset
+        delay = scheduled - clock.now()
+        # On simulated time waiting costs nothing, so every event is sent exactly on schedule.
+        if delay > 0.001 or (virtual_time and delay > 0):
+            await asyncio.sleep(delay)
+        else:
+            # Eventsub reads each event off the websocket, so the loop gets a turn between events even when running flat out.
+            await asyncio.sleep(0)
+
+        # Events sent up to a millisecond early, or as fast as possible with no schedule, are timed from when they are sent.
+        sent_times[event_id] = max(clock.now(), scheduled)
+
+        if is_redemption:
+            await connection._on_point_redemption(event)
+        else:
+            await connection._on_chat_message(event)
+
+    send_seconds = time.perf_counter() - wall_start
+    drained = await wait_for_drain(connection, TTS, clock)
+    total_seconds = time.perf_counter() - wall_start
+    clock_seconds = clock.now() - start
+
+    if lag_task is not None:
+        lag_task.cancel()
+    for module in modules:
+        if callable(getattr(module, "terminate_module", None)):
+            await module.terminate_module()
+    for inbox in connection._inboxes.values():
+        await inbox.stop()
+    await asyncio.gather(*update_tasks, return_exceptions = True)
+    sound_directory.cleanup()
+
+    latencies = [latency for samples in module_latencies.values() for latency in samples]
+    redemption_count = sum(1 for _, is_redemption, _, _ in events if is_redemption)
+
+    return {
+        "events": len(events),
+        "chat_messages": len(events) - redemption_count,
+        "redemptions": redemption_count,
+        "deliveries": len(latencies),
+        "dropped": sum(inbox.dropped for inbox in connection._inboxes.values()),
+        "drained": drained,
+        "send_rate": len(events) / send_seconds,
+        "throughput": len(events) / total_seconds,
+        "wall_seconds": total_seconds,
+        "simulated_seconds": clock_seconds if virtual_time else None,
+        "dispatch_latency_ms": summarize_ms(latencies),
+        "loop_lag_ms": summarize_ms(lag_samples),
+        "modules": {name: {"deliveries": len(samples), "dispatch_latency_ms": summarize_ms(samples)} for name, samples in module_latencies.items()},
+        "injected_moves": minigolf._input.injected_moves
+    }
+
+
+def print_results(results:"dict", previous:"dict" = None) -> None:
+
+    # Shows the change from a previous run next to each headline number.
+    def compare(value:"float", path:"list") -> str:
+        if previous is None:
+            return ""
+        try:
+            old = previous
+            for key in path:
+                old = old[key]
+        except (KeyError, TypeError):
+            return ""
+        return f"   (was {old:,.2f}, {value - old:+,.2f})"
+
+    latency = results["dispatch_latency_ms"]
+    lag = results["loop_lag_ms"]
+
+    print(f"{results['events']} events: {results['chat_messages']} chat messages, {results['redemptions']} redemptions.")
+    print(f"Deliveries to modules: {results['deliveries']}, dropped by inboxes: {results['dropped']}{'' if results['drained'] else ', NOT fully drained'}")
+    if results["simulated_seconds"] is not None:
+        print(f"Simulated {results['simulated_seconds']:,.1f}s in {results['wall_seconds']:,.1f}s of real time.")
+    print(f"Send rate: {results['send_rate']:,.0f} events/s")
+    print(f"Throughput: {results['throughput']:,.0f} events/s{compare(results['throughput'], ['results', 'throughput'])}")
+    print(f"Dispatch latency p50: {latency['p50']:.3f}ms{compare(latency['p50'], ['results', 'dispatch_latency_ms', 'p50'])}")
+    print(f"Dispatch latency p99: {latency['p99']:.3f}ms{compare(latency['p99'], ['results', 'dispatch_latency_ms', 'p99'])}")
+    print(f"Event loop lag p99: {lag['p99']:.3f}ms, max: {lag['max']:.3f}ms{compare(lag['p99'], ['results', 'loop_lag_ms', 'p99'])}")
+
+    for name, module in results["modules"].items():
+        print(f"  {name}: {module['deliveries']} deliveries, p50 {module['dispatch_latency_ms']['p50']:.3f}ms, p99 {module['dispatch_latency_ms']['p99']:.3f}ms")
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "End-to-end dispatch benchmark with synthetic chat load.")
+    parser.add_argument("--rate", type = float, default = 2000, help = "Events per second. 0 sends as fast as possible.")
+    parser.add_argument("--seconds", type = float, default = 5, help = "How long to send for at the given rate.")
+    parser.add_argument("--events", type = int, default = 20000, help = "Number of events to send when the rate is 0.")
+    parser.add_argument("--redemption-share", type = float, default = 0.01, help = "Share of events that are TTS redemptions.")
+    parser.add_argument("--viewers", type = int, default = 500, help = "Number of distinct chatters.")
+    parser.add_argument("--mix", help = "JSON file mapping chat message text to its relative weight.")
+    parser.add_argument("--dispatch-mode", choices = [mode.value for mode in Dispatch_Mode], default = Dispatch_Mode.CONCURRENT.value)
+    parser.add_argument("--inbox-size", type = int, default = 100)
+    parser.add_argument("--overflow-policy", choices = [policy.value for policy in Overflow_Policy], default = Overflow_Policy.DROP_OLDEST.value)
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--reward-title", default = "TTS", help = "TTS point reward title. Replays need the title from the recorded channel.")
+    parser.add_argument("--profile-memory", type = float, default = 0, help = "Seconds between memory snapshots. 0 disables memory profiling.")
+    parser.add_argument("--memory-report", default = "memory_report.txt", help = "File the memory report is written to.")
+    parser.add_argument("--virtual-time", action = "store_true", help = "Run on simulated time instead of real time.")
+    parser.add_argument("--replay", help = "Recording folder or part to replay instead of synthetic chat.")
+    parser.add_argument("--replay-speed", type = float, default = 1, help = "Replay speed multiplier. 0 replays as fast as possible.")
+    parser.add_argument("--output", default = DEFAULT_OUTPUT_FILE, help = "File the results are saved to.")
+    parser.add_argument("--compare", help = "Results file of a previous run to compare against.")
+    arguments = parser.parse_args()
+
+    chat_mix = DEFAULT_CHAT_MIX
+    if arguments.mix:
+        with open(arguments.mix) as mix_file:
+            chat_mix = json.load(mix_file)
+
+    settings = {
+        "rate": arguments.rate,
+        "seconds": arguments.seconds,
+        "event_count": arguments.events,
+        "redemption_share": arguments.redemption_share,
+        "viewer_count": arguments.viewers,
+        "chat_mix": chat_mix,
+        "dispatch_mode": Dispatch_Mode(arguments.dispatch_mode),
+        "inbox_size": arguments.inbox_size,
+        "overflow_policy": Overflow_Policy(arguments.overflow_policy),
+        "seed": arguments.seed,
+        "reward_title": arguments.reward_title,
+        "replay": arguments.replay,
+        "replay_speed": arguments.replay_speed,
+        "memory_profile_interval": arguments.profile_memory,
+        "memory_report_file": arguments.memory_report,
+        "virtual_time": arguments.virtual_time
+    }
+
+    # Modules print for every event they handle, which would bury the results.
+    clock = Virtual_Clock() if arguments.virtual_time else real_clock
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), asyncio.Runner(loop_factory = clock.new_event_loop) as runner:
+        results = runner.run(run_benchmark(settings, clock))
+
+    previous = None
+    if arguments.compare:
+        with open(arguments.compare) as previous_file:
+            previous = json.load(previous_file)
+
+    print_results(results, previous)
+
+    report = {
+        "settings": {**settings, "dispatch_mode": settings["dispatch_mode"].value, "overflow_policy": settings["overflow_policy"].value},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "results": results
+    }
+
+    with open(arguments.output, "w") as output_file:
+        json.dump(report, output_file, indent = 2)
+
+    print(f"\nResults saved to {arguments.output}")
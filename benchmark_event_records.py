@@ -0,0 +1,151 @@
+import gc
+import time
+import uuid
+import random
+import argparse
+import tracemalloc
+
+from twitchAPI.object.eventsub import ChannelChatMessageEvent, ChannelPointsCustomRewardRedemptionAddEvent
+
+from utils_events import Chat_Message, Point_Redemption
+
+
+##############################################################################################
+###############  Measures the memory a backlog of events takes when queued as  ###############
+###############  full eventsub objects, and when queued as the records the     ###############
+###############  Twitch connection now converts them to at ingress. Also times ###############
+###############  the conversion. Run with: py benchmark_event_records.py       ###############
+##############################################################################################
+
+
+BACKLOG_SIZE = 100000
+REDEMPTION_SHARE = 0.05
+
+# Records should take a small fraction of the memory the eventsub objects did.
+MEMORY_BUDGET_FRACTION = 0.25
+CONVERSION_BUDGET_SECONDS = 0.00001
+
+CHAT_TEXTS = ["bonk", "meow", "up", "left 20", "right 5", "hit 1500", "lol that was so close", "gg", "can you do the thing again?", "first time here, love the stream"]
+TTS_MESSAGES = ["hello chat", "this is a longer message to read out loud on stream", "meow meow meow"]
+
+
+
+def _subscription(subscription_type:"str") -> dict:
+    return {"id": str(uuid.uuid4()), "status": "enabled", "type": subscription_type, "version": "1", "cost": 0,
+            "condition": {"broadcaster_user_id": "1337"}, "transport": {"method": "websocket", "session_id": "benchmark"}, "created_at": "2024-01-01T00:00:00.000000000Z"}
+
+
+def _metadata(subscription_type:"str") -> dict:
+    return {"message_id": str(uuid.uuid4()), "message_type": "notification", "message_timestamp": "2024-01-01T00:00:00.000000000Z",
+            "subscription_type": subscription_type, "subscription_version": "1"}
+
+
+# Builds the notification payload Twitch sends for one chat message, with the fields a typical message has.
+def make_chat_payload(index:"int", text:"str") -> dict:
+
+    user_id = str(100000 + index)
+    return {
+        "subscription": _subscription("channel.chat.message"),
+        "metadata": _metadata("channel.chat.message"),
+        "event": {
+            "broadcaster_user_id": "1337", "broadcaster_user_login": "streamer", "broadcaster_user_name": "Streamer",
+            "chatter_user_id": user_id, "chatter_user_login": f"viewer{user_id}", "chatter_user_name": f"Viewer{user_id}",
+            "message_id": str(uuid.uuid4()),
+            "message": {"text": text, "fragments": [{"type": "text", "text": text, "cheermote": None, "emote": None, "mention": None}]},
+            "color": "#00FF7F",
+            "badges": [{"set_id": "subscriber", "id": "6", "info": "6"}],
+            "message_type": "text", "cheer": None, "reply": None, "channel_points_custom_reward_id": None
+        }
+    }
+
+
+# Builds the notification payload Twitch sends for one channel point redemption.
+def make_redemption_payload(index:"int", user_input:"str") -> dict:
+
+    user_id = str(100000 + index)
+    return {
+        "subscription": _subscription("channel.channel_points_custom_reward_redemption.add"),
+        "metadata": _metadata("channel.channel_points_custom_reward_redemption.add"),
+        "event": {
+            "id": str(uuid.uuid4()),
+            "broadcaster_user_id": "1337", "broadcaster_user_login": "streamer", "broadcaster_user_name": "Streamer",
+            "user_id": user_id, "user_login": f"viewer{user_id}", "user_name": f"Viewer{user_id}",
+            "user_input": user_input, "status": "unfulfilled",
+            "reward": {"id": str(uuid.uuid4()), "title": "TTS", "cost": 500, "prompt": "Read a message out loud"},
+            "redeemed_at": "2024-01-01T00:00:00.000000000Z"
+        }
+    }
+
+
+# Yields eventsub objects one at a time, so only the objects kept by the caller stay in memory.
+def generate_events(count:"int", seed:"int"):
+
+    rng = random.Random(seed)
+    for index in range(count):
+        if rng.random() < REDEMPTION_SHARE:
+            yield ChannelPointsCustomRewardRedemptionAddEvent(**make_redemption_payload(index, rng.choice(TTS_MESSAGES)))
+        else:
+            yield ChannelChatMessageEvent(**make_chat_payload(index, rng.choice(CHAT_TEXTS)))
+
+
+def to_record(event) -> "Chat_Message | Point_Redemption":
+
+    if isinstance(event, ChannelChatMessageEvent):
+        return Chat_Message.from_event(event)
+    return Point_Redemption.from_event(event)
+
+
+# Returns the bytes held by a backlog of eventsub objects, as traced by tracemalloc, and by the same backlog once converted to records.
+# The records are converted from the objects in the backlog, which are then freed, so they only keep the strings they need.
+def measure_backlog(count:"int", seed:"int") -> tuple:
+
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+
+    backlog = list(generate_events(count, seed))
+    gc.collect()
+    object_bytes = tracemalloc.get_traced_memory()[0] - baseline
+
+    backlog = [to_record(event) for event in backlog]
+    gc.collect()
+    record_bytes = tracemalloc.get_traced_memory()[0] - baseline
+
+    tracemalloc.stop()
+    return object_bytes, record_bytes
+
+
+# Returns the average seconds to convert one event to its record.
+def measure_conversion(count:"int", seed:"int") -> float:
+
+    events = list(generate_events(count, seed))
+
+    start = time.perf_counter()
+    for event in events:
+        to_record(event)
+
+    return (time.perf_counter() - start) / count
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Measures the memory of a backlog of eventsub objects against the records they are converted to.")
+    parser.add_argument("--events", type = int, default = BACKLOG_SIZE, help = "Events in the backlog.")
+    parser.add_argument("--seed", type = int, default = 1)
+    arguments = parser.parse_args()
+
+    # Building eventsub objects is slow, so conversion is timed on a sample without tracing.
+    object_bytes, record_bytes = measure_backlog(arguments.events, arguments.seed)
+    conversion_seconds = measure_conversion(min(arguments.events, 10000), arguments.seed)
+
+    print(f"Backlog of {arguments.events:,} events ({REDEMPTION_SHARE:.0%} redemptions):")
+    print(f"  Eventsub objects: {object_bytes / 1024 / 1024:8.1f}MB   {object_bytes / arguments.events:6.0f} bytes per event")
+    print(f"  Records:          {record_bytes / 1024 / 1024:8.1f}MB   {record_bytes / arguments.events:6.0f} bytes per event   [Budget: {MEMORY_BUDGET_FRACTION:.0%} of eventsub objects]")
+    print(f"Conversion at ingress: {conversion_seconds * 1000000:.2f}us per event   [Budget: {CONVERSION_BUDGET_SECONDS * 1000000:.0f}us]")
+
+    if record_bytes > object_bytes * MEMORY_BUDGET_FRACTION or conversion_seconds > CONVERSION_BUDGET_SECONDS:
+        print("Benchmark FAILED.")
+        exit(1)
+
+    print("Benchmark passed.")
@@ -0,0 +1,256 @@
+import uuid
+import asyncio
+import argparse
+
+from aiohttp import web
+
+from utils_eventsub import EventSub_Supervisor, EventSub_Subscription, Event_Deduplicator
+
+
+##############################################################################################
+###############  Runs the eventsub supervisor against a local stand-in for     ###############
+###############  Twitch's eventsub websocket server, sending chat events at a  ###############
+###############  steady rate with some redelivered. Forces a session_reconnect ###############
+###############  handoff and a dropped connection mid stream, and measures how ###############
+###############  long delivery pauses, and whether any events were missed,     ###############
+###############  repeated or reordered. Run with: py benchmark_eventsub.py     ###############
+##############################################################################################
+
+
+EVENT_INTERVAL_SECONDS = 0.005
+EVENT_COUNT = 1000
+
+# Every nth event is sent a second time with the same message id, the way Twitch redelivers.
+REDELIVERY_EVERY = 10
+
+# A handoff should pause delivery for little more than one round trip. A dropped connection also has to subscribe again.
+HANDOFF_PAUSE_BUDGET_SECONDS = 0.05
+DROP_PAUSE_BUDGET_SECONDS = 0.25
+
+
+
+#### Serves the parts of eventsub the supervisor uses: the websocket, session_reconnect handoffs and the subscription endpoint.
+#### Like Twitch, events sent while no connection is open are lost.
+
+class Stand_In_EventSub_Server(object):
+    def __init__(self) -> None:
+
+        self.url = None
+        self.subscription_requests = 0
+        self._runner = None
+
+        # The connection events are sent on, and the request it came from so it can be dropped without a close handshake.
+        self._websocket = None
+        self._request = None
+        self._session_id = None
+
+        # Set once a connection is welcomed, so events aren't sent before the client is ready.
+        self._connected = asyncio.Event()
+        self._handed_off = None
+
+
+    async def _handle_websocket(self, request:"web.Request") -> web.WebSocketResponse:
+
+        websocket = web.WebSocketResponse()
+        await websocket.prepare(request)
+
+        # A reconnect keeps its session and subscriptions. Anything else is a new session.
+        reconnecting = "reconnect" in request.query
+        if not reconnecting:
+            self._session_id = str(uuid.uuid4())
+
+        await websocket.send_json(self._message("session_welcome", {"session": {"id": self._session_id, "status": "connected", "keepalive_timeout_seconds": 10, "reconnect_url": None}}))
+
+        old_websocket = self._websocket
+        self._websocket, self._request = websocket, request
+        self._connected.set()
+
+        # Twitch closes the old connection once the new one is welcomed, and sends events on the new one from then on.
+        if reconnecting and old_websocket is not None:
+            await old_websocket.close(code = 4004)
+            self._handed_off.set()
+
+        async for _ in websocket:
+            pass
+
+        if self._websocket is websocket:
+            self._websocket = None
+            self._connected.clear()
+
+        return websocket
+
+
+    async def _handle_subscription(self, request:"web.Request") -> web.Response:
+
+        self.subscription_requests += 1
+        data = await request.json()
+        return web.json_response({"data": [{"id": str(uuid.uuid4()), "status": "enabled", "type": data["type"], "version": data["version"]}]}, status = 202)
+
+
+    def _message(self, message_type:"str", payload:"dict", message_id:"str" = None) -> dict:
+        return {"metadata": {"message_id": message_id or str(uuid.uuid4()), "message_type": message_type, "message_timestamp": ""}, "payload": payload}
+
+
+    async def start(self) -> None:
+
+        app = web.Application()
+        app.router.add_get("/ws", self._handle_websocket)
+        app.router.add_post("/eventsub/subscriptions", self._handle_subscription)
+
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+
+
+    async def stop(self) -> None:
+        await self._runner.cleanup()
+
+
+    async def wait_connected(self) -> None:
+        await self._connected.wait()
+
+
+    # Sends one chat notification on the current connection. Returns False if no connection is open.
+    async def send_event(self, sequence:"int", message_id:"str") -> bool:
+
+        if self._websocket is None or self._websocket.closed:
+            return False
+
+        subscription = {"id": "chat", "type": "channel.chat.message", "version": "1", "status": "enabled", "condition": {}, "transport": {"method": "websocket", "session_id": self._session_id}}
+        await self._websocket.send_json(self._message("notification", {"subscription": subscription, "event": {"sequence": sequence}}, message_id))
+        return True
+
+
+    # Asks the client to move to a new connection. Returns once the old connection has been closed.
+    async def force_reconnect(self) -> None:
+
+        self._handed_off = asyncio.Event()
+        reconnect_url = f"{self.url.replace('http', 'ws')}/ws?reconnect={self._session_id}"
+        await self._websocket.send_json(self._message("session_reconnect", {"session": {"id": self._session_id, "status": "reconnecting", "keepalive_timeout_seconds": None, "reconnect_url": reconnect_url}}))
+        await self._handed_off.wait()
+
+
+    # Drops the current connection without a close handshake, like a network failure.
+    def drop_connection(self) -> None:
+
+        self._websocket = None
+        self._connected.clear()
+        self._request.transport.abort()
+
+
+
+# Sends events at a steady rate, interrupting the stream halfway with the scenario. Returns delivery statistics.
+async def run_scenario(scenario:"str", event_count:"int", interval:"float") -> dict:
+
+    loop = asyncio.get_running_loop()
+    server = Stand_In_EventSub_Server()
+    await server.start()
+
+    deliveries = []
+
+    async def on_chat_message(payload:"dict") -> None:
+        deliveries.append((payload["event"]["sequence"], loop.time()))
+
+    async def get_request_headers() -> dict:
+        return {"Client-ID": "benchmark", "Authorization": "Bearer benchmark"}
+
+    subscriptions = [EventSub_Subscription("channel.chat.message", "1", {}, on_chat_message)]
+    supervisor = EventSub_Supervisor(subscriptions, get_request_headers, connection_url = f"{server.url.replace('http', 'ws')}/ws", subscription_url = f"{server.url}/eventsub/subscriptions",
+                                     reconnect_delays = (0, 0.1), deduplicator = Event_Deduplicator())
+    supervisor_task = asyncio.create_task(supervisor.run())
+
+    await server.wait_connected()
+    while not supervisor.is_connected():
+        await asyncio.sleep(0.001)
+
+    sent = set()
+    unsent = 0
+    interruption = None
+
+    for sequence in range(event_count):
+
+        # Events keep coming on the old connection while the client moves to the new one, as they do on Twitch.
+        if sequence == event_count // 2:
+            if scenario == "handoff":
+                interruption = asyncio.create_task(server.force_reconnect())
+            else:
+                server.drop_connection()
+
+        message_id = str(uuid.uuid4())
+        if await server.send_event(sequence, message_id):
+            sent.add(sequence)
+        else:
+            unsent += 1
+
+        if sequence % REDELIVERY_EVERY == 0:
+            await server.send_event(sequence, message_id)
+
+        await asyncio.sleep(interval)
+
+    if interruption is not None:
+        await interruption
+
+    # Gives the last events time to arrive.
+    await asyncio.sleep(0.1)
+
+    await supervisor.stop()
+    await supervisor_task
+    await server.stop()
+
+    sequences = [sequence for sequence, delivered_time in deliveries]
+    delivery_times = [delivered_time for sequence, delivered_time in deliveries]
+    gaps = [later - earlier for earlier, later in zip(delivery_times, delivery_times[1:])]
+
+    return {
+        "sent": len(sent),
+        "unsent": unsent,
+        "delivered": len(set(sequences)),
+        "missed": len(sent - set(sequences)),
+        "repeated": len(sequences) - len(set(sequences)),
+        "in_order": sequences == sorted(sequences),
+        "subscription_requests": server.subscription_requests,
+        "steady_gap": sorted(gaps)[len(gaps) // 2] if gaps else 0.0,
+        "max_pause": max(gaps) if gaps else 0.0
+    }
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Measures eventsub delivery across a forced reconnect, against a local stand-in server.")
+    parser.add_argument("--events", type = int, default = EVENT_COUNT, help = "Events sent per scenario. The interruption comes halfway through.")
+    parser.add_argument("--interval", type = float, default = EVENT_INTERVAL_SECONDS, help = "Seconds between events.")
+    arguments = parser.parse_args()
+
+    budgets = {"handoff": HANDOFF_PAUSE_BUDGET_SECONDS, "drop": DROP_PAUSE_BUDGET_SECONDS}
+
+    print('{:<8}  |  {:>9}  |  {:>6}  |  {:>6}  |  {:>8}  |  {:>8}  |  {:>8}  |  {:>10}  |  {:>10}'.format("Scenario", "Delivered", "Missed", "Lost", "Repeated", "In order", "Requests", "Steady gap", "Max pause"))
+
+    failed = False
+    for scenario, budget in budgets.items():
+        results = asyncio.run(run_scenario(scenario, arguments.events, arguments.interval))
+
+        print('{:<8}  |  {:>9}  |  {:>6}  |  {:>6}  |  {:>8}  |  {:>8}  |  {:>8}  |  {:>8.1f}ms  |  {:>8.1f}ms'.format(
+            scenario, results["delivered"], results["missed"], results["unsent"], results["repeated"], str(results["in_order"]), results["subscription_requests"],
+            results["steady_gap"] * 1000, results["max_pause"] * 1000))
+
+        # Only events the server sent count as missed. Events sent while a dropped connection was down are lost on Twitch too.
+        if results["missed"] or results["repeated"] or not results["in_order"] or results["max_pause"] - results["steady_gap"] > budget:
+            failed = True
+
+        # A handoff keeps the session's subscriptions, so the one chat subscription should only be requested once.
+        if scenario == "handoff" and (results["unsent"] or results["subscription_requests"] != 1):
+            failed = True
+
+    print(f"\nEvery {REDELIVERY_EVERY}th event was redelivered and must be dropped as a duplicate.")
+    print(f"Delivery pauses beyond the steady gap are budgeted at {HANDOFF_PAUSE_BUDGET_SECONDS * 1000:.0f}ms for a handoff and {DROP_PAUSE_BUDGET_SECONDS * 1000:.0f}ms for a dropped connection.")
+
+    if failed:
+        print("Benchmark FAILED.")
+        exit(1)
+
+    print("Benchmark passed.")
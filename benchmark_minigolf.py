@@ -0,0 +1,74 @@
+import time
+import random
+import asyncio
+
+from mode_minigolf import Minigolf_Manager, Vote_Rule
+from utils_events import Chat_Message
+from benchmark_stubs import Stub_Hotkey_Manager
+from utils_input_backend import Recording_Input_Backend
+
+
+##############################################################################################
+###############  Measures Minigolf chat handling throughput at 10k messages    ###############
+###############  per second, in anarchy mode and in democracy mode with each   ###############
+###############  vote rule, and how many movement changes reach the game.      ###############
+###############  Run with: py benchmark_minigolf.py                            ###############
+##############################################################################################
+
+
+MESSAGES_PER_SECOND = 10000
+SIMULATED_SECONDS = 5
+VOTE_WINDOW = 0.5
+
+# Aiming commands that only change movement vectors, so no input is injected into the game during the benchmark.
+COMMAND_MIX = ["up"] * 4 + ["left"] * 3 + ["right"] * 2 + ["down", "stop", "mario", "luigi", "hello chat"]
+
+
+
+async def run_benchmark(democracy:"bool", vote_rule:"Vote_Rule") -> dict:
+
+    manager = Minigolf_Manager(Stub_Hotkey_Manager(), democracy = democracy, vote_window = VOTE_WINDOW, vote_rule = vote_rule, input_backend = Recording_Input_Backend())
+    manager._paused = False
+
+    # Counts every change to the movement vectors, which is what turns into mouse movement.
+    vector_changes = [0]
+    change_vectors = manager._change_vectors
+    def counting_change_vectors(xmod:"int", ymod:"int") -> None:
+        vector_changes[0] += 1
+        change_vectors(xmod, ymod)
+    manager._change_vectors = counting_change_vectors
+
+    random.seed(0)
+    messages = [Chat_Message(text, text, "0", "viewer") for text in random.choices(COMMAND_MIX, k = MESSAGES_PER_SECOND * SIMULATED_SECONDS)]
+    messages_per_window = int(MESSAGES_PER_SECOND * VOTE_WINDOW)
+
+    # Messages are handled as fast as possible, with votes applied after each window's worth of messages.
+    start = time.perf_counter()
+    for i, message in enumerate(messages):
+        await manager.handle_chat_message(message)
+
+        if democracy and (i + 1) % messages_per_window == 0:
+            manager._apply_votes()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "messages_per_second": len(messages) / elapsed,
+        "cpu_share_at_target_rate": elapsed / SIMULATED_SECONDS,
+        "vector_changes": vector_changes[0]
+    }
+
+
+
+if __name__ == "__main__":
+
+    runs = [("Anarchy", False, Vote_Rule.PLURALITY)] + [(f"Democracy ({vote_rule.value})", True, vote_rule) for vote_rule in Vote_Rule]
+
+    print(f"{MESSAGES_PER_SECOND * SIMULATED_SECONDS} messages, {SIMULATED_SECONDS}s of chat at {MESSAGES_PER_SECOND} messages/s.\n")
+
+    for label, democracy, vote_rule in runs:
+        results = asyncio.run(run_benchmark(democracy, vote_rule))
+
+        print(label)
+        print(f"  Throughput: {results['messages_per_second']:,.0f} messages/s")
+        print(f"  Share of one core used at {MESSAGES_PER_SECOND} messages/s: {results['cpu_share_at_target_rate'] * 100:.1f}%")
+        print(f"  Movement changes applied: {results['vector_changes']}\n")
@@ -0,0 +1,77 @@
+import time
+import asyncio
+import selectors
+
+from audiomodule_TTS import TTS_Manager
+from mode_minigolf import Minigolf_Manager
+from benchmark_stubs import Stub_Hotkey_Manager, Stub_Audio_Manager
+from utils_input_backend import Recording_Input_Backend
+
+
+##############################################################################################
+###############  Measures how quickly the update() loops of stream modules     ###############
+###############  shut down, and how often the event loop wakes up while every  ###############
+###############  module is idle. Run with: py benchmark_shutdown.py            ###############
+##############################################################################################
+
+
+IDLE_SECONDS = 5.0
+SHUTDOWN_BUDGET_SECONDS = 0.5
+IDLE_WAKEUP_BUDGET = 10
+
+
+
+# Counts every time the event loop returns from waiting on its selector, which is one wakeup.
+class Counting_Selector(selectors.DefaultSelector):
+    def __init__(self) -> None:
+        super().__init__()
+        self.wakeups = 0
+
+    def select(self, timeout = None):
+        events = super().select(timeout)
+        self.wakeups += 1
+        return events
+
+
+
+async def measure_shutdown(selector:"Counting_Selector") -> dict:
+
+    hotkey_manager = Stub_Hotkey_Manager()
+    modules = [TTS_Manager(hotkey_manager, Stub_Audio_Manager(), reward_title = "TTS"), Minigolf_Manager(hotkey_manager, input_backend = Recording_Input_Backend())]
+
+    tasks = [asyncio.create_task(module.update()) for module in modules]
+
+    # Lets every module reach its idle wait before counting.
+    await asyncio.sleep(0.1)
+
+    wakeups_before = selector.wakeups
+    await asyncio.sleep(IDLE_SECONDS)
+
+    # The benchmark's own sleep accounts for one wakeup.
+    idle_wakeups = selector.wakeups - wakeups_before - 1
+
+    start = time.perf_counter()
+    for module in modules:
+        await module.terminate_module()
+    await asyncio.gather(*tasks)
+    shutdown_seconds = time.perf_counter() - start
+
+    return {"idle_wakeups": idle_wakeups, "idle_seconds": IDLE_SECONDS, "shutdown_seconds": shutdown_seconds}
+
+
+
+if __name__ == "__main__":
+
+    selector = Counting_Selector()
+
+    with asyncio.Runner(loop_factory = lambda: asyncio.SelectorEventLoop(selector)) as runner:
+        results = runner.run(measure_shutdown(selector))
+
+    print(f"Idle wakeups over {results['idle_seconds']}s: {results['idle_wakeups']}   [Budget: {IDLE_WAKEUP_BUDGET}]")
+    print(f"Shutdown time: {results['shutdown_seconds'] * 1000:.1f}ms   [Budget: {SHUTDOWN_BUDGET_SECONDS * 1000:.0f}ms]")
+
+    if results["idle_wakeups"] > IDLE_WAKEUP_BUDGET or results["shutdown_seconds"] > SHUTDOWN_BUDGET_SECONDS:
+        print("Benchmark FAILED.")
+        exit(1)
+
+    print("Benchmark passed.")
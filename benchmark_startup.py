@@ -0,0 +1,158 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+import configparser
+
+import utils_config
+
+
+##############################################################################################
+###############  Measures how long startup spends importing, for each          ###############
+###############  combination of stream modules, using python -X importtime in  ###############
+###############  a fresh interpreter per run. Compares lazy imports, where     ###############
+###############  main.py only imports the modules that were selected, against  ###############
+###############  importing every module up front. Also times config            ###############
+###############  validation and lookups. Run with: py benchmark_startup.py     ###############
+##############################################################################################
+
+
+PROJECT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PROJECT_MODULES = {file_name[:-3] for file_name in os.listdir(PROJECT_DIRECTORY) if file_name.endswith(".py")}
+
+# The modules main.py imports once each stream module is selected.
+SOUND_EFFECT_MODULES = ["audiomodule_audio_player", "audiomodule_sound_effects", "audiomodule_sound_bank"]
+TTS_MODULES = ["audiomodule_audio_player", "audiomodule_TTS"]
+MINIGOLF_MODULES = ["mode_minigolf"]
+
+COMBINATIONS = {
+    "No modules": [],
+    "Sound effects": SOUND_EFFECT_MODULES,
+    "TTS": TTS_MODULES,
+    "Minigolf": MINIGOLF_MODULES,
+    "Sound effects + TTS": SOUND_EFFECT_MODULES + TTS_MODULES,
+    "Everything": SOUND_EFFECT_MODULES + TTS_MODULES + MINIGOLF_MODULES
+}
+
+# Importing every module up front is what startup cost for any combination before imports were lazy.
+EAGER_MODULES = COMBINATIONS["Everything"]
+
+STARTUP_BUDGET_SECONDS = 1.0
+CONFIG_LOOKUPS = 1000
+
+
+
+# Parses -X importtime output into (indent level, package, cumulative seconds) per import.
+def parse_importtime(output:"str") -> list:
+
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+
+        self_time, cumulative, package = line[len("import time:"):].split("|")
+        indent = len(package) - len(package.lstrip()) - 1
+        imports.append((indent // 2, package.strip(), int(cumulative) / 1000000))
+
+    return imports
+
+
+# Imports main and the given modules in a fresh interpreter. Returns (seconds spent on those imports, {third party package: seconds}).
+def measure_imports(modules:"list", python:"str") -> tuple:
+
+    targets = ["main"] + list(dict.fromkeys(modules))
+    process = subprocess.run([python, "-X", "importtime", "-c", f"import {', '.join(targets)}"], cwd = PROJECT_DIRECTORY, capture_output = True, text = True)
+
+    if process.returncode != 0:
+        errors = [line for line in process.stderr.splitlines() if not line.startswith("import time:")]
+        raise Exception(errors[-1] if errors else f"Exited with code {process.returncode}")
+
+    imports = parse_importtime(process.stderr)
+
+    # Top level lines for the targets cover everything they import that the interpreter hadn't already loaded.
+    total = sum(cumulative for level, package, cumulative in imports if level == 0 and package in targets)
+
+    dependencies = {}
+    for level, package, cumulative in imports:
+        if "." not in package and package not in PROJECT_MODULES and package not in sys.stdlib_module_names and not package.startswith("_"):
+            dependencies[package] = dependencies.get(package, 0) + cumulative
+
+    return total, dependencies
+
+
+# Runs each measurement several times and keeps the median, since the first runs also warm up the disk cache.
+def measure_combination(modules:"list", python:"str", runs:"int") -> dict:
+
+    totals = []
+    dependencies = {}
+    for _ in range(runs):
+        total, dependencies = measure_imports(modules, python)
+        totals.append(total)
+
+    return {"seconds": statistics.median(totals), "dependencies": dependencies}
+
+
+# Times validating config.ini and reading sections from it, on a throwaway copy with placeholder values.
+def measure_config() -> dict:
+
+    with tempfile.TemporaryDirectory() as directory:
+        config = configparser.RawConfigParser()
+        config["INITIALIZATION"] = {"client_id": "id", "client_secret": "secret", "scope": "user:read:chat", "login_name": "name", "tts_reward_title": "TTS"}
+
+        config_path = os.path.join(directory, "config.ini")
+        with open(config_path, "w") as config_file:
+            config.write(config_file)
+
+        utils_config.CONFIG_FILENAME = config_path
+
+        start = time.perf_counter()
+        utils_config.validate_config_file()
+        validate_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(CONFIG_LOOKUPS):
+            utils_config.get_config().initialization.login_name
+        lookup_seconds = (time.perf_counter() - start) / CONFIG_LOOKUPS
+
+    return {"validate_seconds": validate_seconds, "lookup_seconds": lookup_seconds}
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Measures import time at startup for each combination of stream modules.")
+    parser.add_argument("--runs", type = int, default = 5, help = "Fresh interpreters per combination. The median is reported.")
+    parser.add_argument("--python", default = sys.executable, help = "Interpreter to measure with.")
+    arguments = parser.parse_args()
+
+    try:
+        eager = measure_combination(EAGER_MODULES, arguments.python, arguments.runs)
+    except Exception as e:
+        print(f"Could not import every module. Install the requirements first. Exception {e}")
+        exit(1)
+
+    print(f"Importing every module up front: {eager['seconds'] * 1000:.0f}ms\n")
+    print('{:<22}  |  {:>10}  |  {:>10}  |  {}'.format("Modules selected", "Lazy", "Saved", "Heaviest dependencies"))
+
+    failed = False
+    for name, modules in COMBINATIONS.items():
+        results = measure_combination(modules, arguments.python, arguments.runs)
+        heaviest = sorted(results["dependencies"].items(), key = lambda item: item[1], reverse = True)[:3]
+
+        print('{:<22}  |  {:>8.0f}ms  |  {:>8.0f}ms  |  {}'.format(name, results["seconds"] * 1000, (eager["seconds"] - results["seconds"]) * 1000, ", ".join(f"{package} {seconds * 1000:.0f}ms" for package, seconds in heaviest)))
+
+        if name == "No modules" and results["seconds"] > STARTUP_BUDGET_SECONDS:
+            failed = True
+
+    config_results = measure_config()
+    print(f"\nConfig validation: {config_results['validate_seconds'] * 1000:.2f}ms. Config lookup: {config_results['lookup_seconds'] * 1000000:.1f}us.")
+    print(f"Startup imports with no modules selected are budgeted at {STARTUP_BUDGET_SECONDS * 1000:.0f}ms.")
+
+    if failed:
+        print("Benchmark FAILED.")
+        exit(1)
+
+    print("Benchmark passed.")
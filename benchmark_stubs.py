@@ -0,0 +1,39 @@
+##############################################################################################
+###############  Stand-ins for hardware-facing parts of the program, so        ###############
+###############  benchmarks can drive stream modules without a keyboard hook,  ###############
+###############  a sound device or a Twitch connection.                        ###############
+##############################################################################################
+
+
+
+class Stub_Hotkey_Manager(object):
+    def __init__(self) -> None:
+        self._hotkey_dict = {}
+
+    def create_hotkey(self, hotkey_name:"str", hotkey_keys:"str", func:"function", force_assignment:"bool" = False, *args) -> bool:
+        self._hotkey_dict[hotkey_name] = hotkey_keys
+        return True
+
+    def get_hotkey_dict(self) -> dict:
+        return self._hotkey_dict
+
+
+
+class Stub_Audio_Manager(object):
+    def get_mixer_format(self) -> tuple:
+        return (44100, -16, 2)
+
+    async def play_TTS(self, audio:"bytes") -> None:
+        return
+
+    def skip_TTS(self) -> None:
+        return
+
+    def play_sound(self, file_path:"str", sound_name:"str" = None) -> None:
+        return
+
+    def preload_sounds(self, file_paths:"list") -> None:
+        return
+
+    def clear_sample_cache(self) -> None:
+        return
@@ -0,0 +1,143 @@
+import math
+import time
+import argparse
+
+from utils_clock import Virtual_Clock
+from utils_events import Chat_Message
+from utils_throttle import Chat_Throttle
+
+
+##############################################################################################
+###############  Runs chat throttling through a raid of tens of thousands of   ###############
+###############  chatters, a single viewer spamming a command, and a module    ###############
+###############  over its budget, on simulated time. Measures the cost per     ###############
+###############  message, how many buckets are kept during and after the raid, ###############
+###############  and how many messages got through. Run with:                  ###############
+###############  py benchmark_throttle.py                                      ###############
+##############################################################################################
+
+
+RAID_CHATTERS = 50000
+RAID_SECONDS = 10
+SPAM_RATE = 100
+SPAM_SECONDS = 10
+
+USER_RATE = 1.0
+USER_BURST = 4
+MODULE_RATE = 20.0
+MODULE_BURST = 40
+
+COST_BUDGET_SECONDS = 0.000005
+
+# The simulated clock adds up float steps, which can move one refill across the end of a run either way.
+DRIFT_TOLERANCE = 1
+
+
+
+# Stands in for a stream module. Throttling only looks at which module a callback belongs to.
+class Stand_In_Module(object):
+    async def handle_chat_message(self, chat_message:"Chat_Message") -> None:
+        return
+
+
+
+# Sends every chatter's message once, spread evenly over the raid, then lets every bucket go idle.
+# Returns (seconds per message, messages let through, most buckets kept, buckets kept once idle).
+def run_raid(chatters:"int", seconds:"float") -> tuple:
+
+    clock = Virtual_Clock()
+    throttle = Chat_Throttle(USER_RATE, USER_BURST, clock = clock)
+    callbacks = (Stand_In_Module().handle_chat_message,)
+    messages = [Chat_Message("bonk", "bonk", str(user_id), f"viewer{user_id}") for user_id in range(chatters)]
+
+    allowed = 0
+    most_buckets = 0
+    step = seconds / chatters
+
+    start = time.perf_counter()
+    for chat_message in messages:
+        clock.advance(step)
+        if throttle.filter(chat_message, callbacks):
+            allowed += 1
+        most_buckets = max(most_buckets, throttle.get_user_count())
+    cost = (time.perf_counter() - start) / chatters
+
+    # Idle buckets are forgotten on the next message, whoever it is from.
+    clock.advance(USER_BURST / USER_RATE)
+    throttle.filter(Chat_Message("bonk", "bonk", "late", "late viewer"), callbacks)
+
+    return cost, allowed, most_buckets, throttle.get_user_count()
+
+
+# Returns how many of the messages sent at a steady rate an ideal bucket lets through. Its burst goes at once,
+# and refilling starts with the first message, one send interval in, so it earns a token per 1 / rate until the last message.
+def expected_allowed(rate:"float", burst:"int", send_rate:"float", seconds:"float") -> int:
+    return burst + math.floor(rate * (seconds - 1 / send_rate))
+
+
+# Sends one viewer's command at a steady rate. Returns how many got through.
+def run_spam(rate:"float", seconds:"float") -> int:
+
+    clock = Virtual_Clock()
+    throttle = Chat_Throttle(USER_RATE, USER_BURST, clock = clock)
+    callbacks = (Stand_In_Module().handle_chat_message,)
+    chat_message = Chat_Message("bonk", "bonk", "spammer", "spammer")
+
+    allowed = 0
+    for _ in range(int(rate * seconds)):
+        clock.advance(1 / rate)
+        if throttle.filter(chat_message, callbacks):
+            allowed += 1
+
+    return allowed
+
+
+# Sends commands from a different viewer each time to a module with a budget, so only the module budget applies. Returns how many got through.
+def run_module_budget(rate:"float", seconds:"float") -> int:
+
+    clock = Virtual_Clock()
+    throttle = Chat_Throttle(user_rate = 0, module_rate = MODULE_RATE, module_burst = MODULE_BURST, clock = clock)
+    callbacks = (Stand_In_Module().handle_chat_message,)
+
+    allowed = 0
+    for index in range(int(rate * seconds)):
+        clock.advance(1 / rate)
+        if throttle.filter(Chat_Message("up", "up", str(index), f"viewer{index}"), callbacks):
+            allowed += 1
+
+    return allowed
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Measures chat throttling through a raid, a spammer and a module over its budget.")
+    parser.add_argument("--chatters", type = int, default = RAID_CHATTERS, help = "Chatters in the raid, each sending one command.")
+    arguments = parser.parse_args()
+
+    failed = False
+
+    cost, allowed, most_buckets, idle_buckets = run_raid(arguments.chatters, RAID_SECONDS)
+    print(f"Raid of {arguments.chatters:,} chatters over {RAID_SECONDS}s: {allowed:,} let through, {cost * 1000000:.2f}us per message   [Budget: {COST_BUDGET_SECONDS * 1000000:.0f}us]")
+    print(f"  Buckets kept: {most_buckets:,} at most, {idle_buckets} once idle")
+    if allowed != arguments.chatters or idle_buckets > 1 or cost > COST_BUDGET_SECONDS:
+        failed = True
+
+    # A bucket lets its burst through at once, then one message per refill. Letting through too few fails as well as too many.
+    expected = expected_allowed(USER_RATE, USER_BURST, SPAM_RATE, SPAM_SECONDS)
+    allowed = run_spam(SPAM_RATE, SPAM_SECONDS)
+    print(f"One viewer sending {SPAM_RATE} commands/s for {SPAM_SECONDS}s: {allowed} let through   [Expected: {expected} ± {DRIFT_TOLERANCE}]")
+    if abs(allowed - expected) > DRIFT_TOLERANCE:
+        failed = True
+
+    expected = expected_allowed(MODULE_RATE, MODULE_BURST, SPAM_RATE, SPAM_SECONDS)
+    allowed = run_module_budget(SPAM_RATE, SPAM_SECONDS)
+    print(f"Module budget of {MODULE_RATE:.0f}/s with {SPAM_RATE} commands/s from different viewers for {SPAM_SECONDS}s: {allowed} let through   [Expected: {expected} ± {DRIFT_TOLERANCE}]")
+    if abs(allowed - expected) > DRIFT_TOLERANCE:
+        failed = True
+
+    if failed:
+        print("Benchmark FAILED.")
+        exit(1)
+
+    print("Benchmark passed.")
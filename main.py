@@ -1,26 +1,26 @@
+import os
+import sys
+import time
 import asyncio
+import argparse
+import importlib
 
-from enum import Enum
+from typing import NamedTuple
 
 from twitch_api import Twitch_Connection
 
-from utils_config import validate_config_file
+from utils_config import validate_config_file, get_config, get_launch_profile, save_launch_profile, Launch_Profile
+from utils_dispatch import Dispatch_Mode
+from utils_async import Threadsafe_Event
+from utils_event_log import Event_Recorder
+from utils_metrics import Metrics_Reporter
+from utils_watchdog import Loop_Watchdog
+from utils_memory_profiler import Memory_Profiler
 from utils_hotkey_manager import Hotkey_Manager
-from mode_minigolf import Minigolf_Manager
-from audiomodule_audio_player import Audio_Manager
-from audiomodule_sound_effects import Sound_Manager
-from audiomodule_TTS import TTS_Manager
+from utils_throttle import Chat_Throttle
 
-
-
-######### Script Init & General Variables #########
-
-class MSG_TYPE(Enum):
-    
-    NOTIFICATION = "notification"
-    SESSION_KEEPALIVE = "session_keepalive"
-    SESSION_RECONNECT = "session_reconnect"
-    REVOCATION = "revocation"
+# Stream modules are imported in get_module_list, only once they are selected, so their audio, speech and input
+# dependencies don't slow down startup when they aren't used. Compare with: py benchmark_startup.py
 
 
 
@@ -32,18 +32,42 @@ game_options = [
 
 
 
+# A stream module that can be rebuilt while live. build() creates it from its freshly imported source module.
+class Reloadable_Module(NamedTuple):
+
+    source_name: str
+    build: "function"
+    hotkey_names: tuple
+    modified_time: float
+
+
+
 class Integration(object):
-    def __init__(self):
+    def __init__(self, profile:"Launch_Profile" = None):
         # Initializes websocket connection.
         
 
         self.hotkey_manager = Hotkey_Manager()
 
-        # Sets up kill switch.
+        # Parsed once by validate_config_file(). Each module is handed its own section.
+        self.config = get_config()
+
+        # Sets up kill switch. The hotkey runs on the keyboard thread, so the stop event must be set thread-safely.
         self.running = True
+        self._stop_event = Threadsafe_Event()
         self.hotkey_manager.create_hotkey("Terminate Program", "right ctrl+right shift+backspace", self._stop_running, force_assignment = True)
 
-        self.module_list = self.get_module_list()
+        # Rebuilds any stream module whose source file changed since it was loaded, without reconnecting to Twitch.
+        self._reloadable_modules = {}
+        self._reload_event = Threadsafe_Event()
+        self.hotkey_manager.create_hotkey("Reload Changed Modules", "right ctrl+right shift+R", self._reload_event.set_threadsafe, force_assignment = True)
+
+        # Modules come from a launch profile when one is given, so the program starts without any prompts.
+        self.profile = profile if profile is not None else self.ask_launch_profile()
+        self.module_list = self.get_module_list(self.profile)
+
+        # Recording is opt-in. Recorded sessions can be replayed with: py benchmark_dispatch.py --replay [recording folder]
+        self.event_recorder = Event_Recorder() if self.profile.record_events else None
 
         # Used to create a reference to all async functions run as concurrent tasks, to prevent python's garbage collector from killing them mid-execution.
         self.tasks = set()
@@ -51,43 +75,51 @@ class Integration(object):
         
     async def main(self) -> None:
         
-        self.twitch_connection = Twitch_Connection(self.module_list)
+        # Chat command limits are shared by every module, so one viewer spamming commands can't flood any of them.
+        throttle_config = self.config.throttle
+        throttle = Chat_Throttle(throttle_config.user_rate, throttle_config.user_burst, throttle_config.command_rate, throttle_config.command_burst, throttle_config.module_rate, throttle_config.module_burst)
+
+        # Each module handles events from its own inbox so a slow module can't hold up the others.
+        self.twitch_connection = Twitch_Connection(self.module_list, dispatch_mode = Dispatch_Mode.CONCURRENT, event_recorder = self.event_recorder, config = self.config.initialization, throttle = throttle)
         await self.twitch_connection.initialize_twitch()
 
         # Adds all selected stream module update() functions and websocket connection to Task Manager to execute in concurrent loops. Maintains in a loop until self.tg no longer has tasks to manage.
         async with asyncio.TaskGroup() as self.tg:
 
-            kill_switch = self.tg.create_task(self.kill_switch())
-            self.tasks.add(kill_switch)
-            kill_switch.add_done_callback(self.tasks.discard)
+            self._create_task(self.kill_switch())
+            self._create_task(self.reload_listener())
 
             for module in self.module_list:
                 if callable(getattr(module, "update", None)):
-                    update_task = self.tg.create_task(module.update())
-                    self.tasks.add(update_task)
-                    update_task.add_done_callback(self.tasks.discard)
+                    self._create_task(module.update())
 
-            connection_task = self.tg.create_task(self.twitch_connection.run())
-            self.tasks.add(connection_task)
-            connection_task.add_done_callback(self.tasks.discard)
+            self._create_task(self.twitch_connection.run())
 
 
         exit()
 
 
+    def _create_task(self, coroutine) -> None:
+
+        task = self.tg.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+
     # Only to be called by hotkey. Tells the program to stop running, obviously.
     def _stop_running(self) -> None:
 
         print("Program shutdown initiated. Please wait for program to shut down...")
         self.running = False
+        self._stop_event.set_threadsafe()
+        self._reload_event.set_threadsafe()
         
 
     # Closes program gracefully once program is told to stop running.
     async def kill_switch(self) -> None:
         
-        # Perpetually sleeps until hotkey is pressed to stop the program from continuing to run, then shuts down the program.
-        while self.running:
-            await asyncio.sleep(2)
+        # Waits without polling until hotkey is pressed to stop the program from continuing to run, then shuts down the program.
+        await self._stop_event.wait()
 
 
         print("Terminating list of running tasks.")
@@ -103,42 +135,201 @@ class Integration(object):
         print("All tasks should be terminated now. Closing program.")
 
 
-    # Requests input on list of modules to run in the integration program, initializes them, then returns the list.
-    def get_module_list(self) -> list:
-        
-        
-        module_list = []
+    # Waits without polling for the reload hotkey until the program stops.
+    async def reload_listener(self) -> None:
+
+        while True:
+            await self._reload_event.wait()
+            self._reload_event.clear()
+
+            if not self.running:
+                return
+
+            await self.reload_changed_modules()
+
+
+    # Imports a stream module's source, builds the module and remembers how, so it can be rebuilt the same way after its file changes.
+    def _build_module(self, source_name:"str", build:"function"):
+
+        source = importlib.import_module(source_name)
+
+        hotkeys_before = set(self.hotkey_manager.get_hotkey_dict())
+        module = build(source)
+        hotkey_names = tuple(name for name in self.hotkey_manager.get_hotkey_dict() if name not in hotkeys_before)
+
+        self._reloadable_modules[module] = Reloadable_Module(source_name, build, hotkey_names, os.path.getmtime(source.__file__))
+        return module
+
+
+    # Rebuilds one module from its source file and swaps it into the running Twitch connection. Eventsub stays connected throughout.
+    # If the source can't be imported or the module can't be built, the old module keeps running.
+    async def _reload_module(self, old_module) -> None:
+
+        reloadable = self._reloadable_modules[old_module]
+        start = time.perf_counter()
+
+        try:
+            source = importlib.reload(sys.modules[reloadable.source_name])
+        except Exception as e:
+            print(f"Could not reload {reloadable.source_name}. Keeping the running version. Exception {e}")
+            return
+
+        # The new module registers the same hotkeys, so the old module's hotkeys are removed first and put back if building fails.
+        old_hotkeys = [(name, self.hotkey_manager.get_hotkey_dict()[name], self.hotkey_manager.get_hotkey_callback(name)) for name in reloadable.hotkey_names]
+        for name, _, _ in old_hotkeys:
+            self.hotkey_manager.remove_hotkey(name)
+
+        hotkeys_before = set(self.hotkey_manager.get_hotkey_dict())
+        try:
+            new_module = reloadable.build(source)
+        except Exception as e:
+            for name, keys, (function, args) in old_hotkeys:
+                self.hotkey_manager.create_hotkey(name, keys, function, True, *args)
+            print(f"Could not rebuild {type(old_module).__name__}. Keeping the running version. Exception {e}")
+            return
+
+        hotkey_names = tuple(name for name in self.hotkey_manager.get_hotkey_dict() if name not in hotkeys_before)
+        self._reloadable_modules.pop(old_module)
+        self._reloadable_modules[new_module] = reloadable._replace(hotkey_names = hotkey_names, modified_time = os.path.getmtime(source.__file__))
+
+        # Messages the old module accepted but hasn't finished, like TTS waiting to be read, go to the new module before its inbox events.
+        if callable(getattr(old_module, "take_pending_messages", None)) and callable(getattr(new_module, "queue_pending_messages", None)):
+            new_module.queue_pending_messages(old_module.take_pending_messages())
+
+        await self.twitch_connection.replace_module(old_module, new_module)
+        self.module_list[self.module_list.index(old_module)] = new_module
+
+        if callable(getattr(new_module, "update", None)):
+            self._create_task(new_module.update())
+
+        if callable(getattr(old_module, "terminate_module", None)):
+            await old_module.terminate_module()
+
+        print(f"Reloaded {type(new_module).__name__} from {reloadable.source_name} in {(time.perf_counter() - start) * 1000:.1f}ms.")
+
+
+    # Reloads every stream module whose source file changed since it was loaded.
+    async def reload_changed_modules(self) -> None:
+
+        changed = [module for module, reloadable in self._reloadable_modules.items() if os.path.getmtime(sys.modules[reloadable.source_name].__file__) != reloadable.modified_time]
+        if not changed:
+            print("No stream modules have changed since they were loaded.")
+            return
+
+        for module in changed:
+            await self._reload_module(module)
+
+
+    # Requests input on which modules to run, and offers to save the choices as a launch profile for next time.
+    def ask_launch_profile(self) -> Launch_Profile:
 
         print("Would you like sound effects enabled during this stream? y/n   [Default: y]")
-        if input() != "n":
-            audio_manager = Audio_Manager()
-            module_list.append(audio_manager)
-            module_list.append(Sound_Manager(audio_manager))
+        sound_effects = input() != "n"
 
         print("Would you like Text to Speech enabled during this stream? y/n   [Default: y]")
-        if input() != "n":
-            try:
-                module_list.append(TTS_Manager(self.hotkey_manager, audio_manager))
-            except:
-                module_list.append(TTS_Manager(self.hotkey_manager, Audio_Manager()))
+        tts = input() != "n"
 
         print("Select the game you are playing from the following options:")
         print("1: None [Default]")
         for i, game in enumerate(game_options):
             print(f"{str(i + 2)}: {game}")
 
+        game = ""
         try:
             selection = int(input()) - 2
             if selection < 0 or selection >= len(game_options):
                 raise Exception("No game selected.")
-            else:
-                match game_options[selection]:
-                    case "Minigolf":
-                        module_list.append(Minigolf_Manager(self.hotkey_manager))
+            game = game_options[selection]
 
         except:
             print("\nNo game selected.\n")
 
+        # Metrics are collected either way. The reporter only serves them locally and prints a summary now and then.
+        print("Would you like the metrics endpoint and console summary enabled? y/n   [Default: n]")
+        metrics = input() == "y"
+
+        print("Would you like the event loop watchdog enabled, to report what blocks the program? y/n   [Default: n]")
+        watchdog = input() == "y"
+
+        print("Would you like memory profiling enabled, to find leaks over long streams? It slows the program down. y/n   [Default: n]")
+        memory_profiler = input() == "y"
+
+        print("Would you like incoming events recorded for replay? y/n   [Default: n]")
+        record_events = input() == "y"
+
+        profile = Launch_Profile(sound_effects, tts, game, record_events, metrics, watchdog, memory_profiler)
+
+        print("To skip these questions next time, type a name to save these choices as a launch profile. Press Enter to skip.")
+        profile_name = input().strip()
+        if profile_name:
+            save_launch_profile(profile_name, profile)
+            print(f"Saved. Start with these choices using: py main.py --profile {profile_name}\n")
+
+        return profile
+
+
+    # Imports and initializes the modules chosen in the launch profile, then returns the list.
+    def get_module_list(self, profile:"Launch_Profile") -> list:
+        
+        
+        module_list = []
+
+        # Sound effects and TTS share one audio player. It can't be rebuilt while live, since it owns the mixer and the tkinter window.
+        audio_manager = None
+        audio_config = self.config.audio
+
+        if profile.sound_effects:
+            from audiomodule_audio_player import Audio_Manager
+            from audiomodule_sound_bank import Sound_Bank, SOUND_BANK_FILENAME
+
+            sound_config = self.config.sound_effects
+            sound_priorities = sound_config.get_sound_priorities()
+
+            # Sound effects come from the prebuilt sound bank if there is one, which needs no decoding at startup.
+            if os.path.isfile(SOUND_BANK_FILENAME):
+                sound_bank = Sound_Bank(SOUND_BANK_FILENAME)
+                audio_manager = Audio_Manager(sample_cache_size = audio_config.sample_cache_size, sound_bank = sound_bank, polyphony = audio_config.polyphony, sound_effect_volume = audio_config.sound_effect_volume)
+                module_list.append(audio_manager)
+                module_list.append(self._build_module("audiomodule_sound_effects", lambda source: source.Sound_Manager(audio_manager, sound_library = sound_bank, preload_sounds = False, cooldown = sound_config.cooldown,
+                                                                                                                       sound_priorities = sound_priorities)))
+            else:
+                audio_manager = Audio_Manager(sample_cache_size = audio_config.sample_cache_size, polyphony = audio_config.polyphony, sound_effect_volume = audio_config.sound_effect_volume)
+                module_list.append(audio_manager)
+                module_list.append(self._build_module("audiomodule_sound_effects", lambda source: source.Sound_Manager(audio_manager, preload_sounds = sound_config.preload_sounds, cooldown = sound_config.cooldown,
+                                                                                                                       sound_priorities = sound_priorities)))
+
+        if profile.tts:
+            from audiomodule_audio_player import Audio_Manager
+
+            TTS_config = self.config.tts
+            reward_title = self.config.initialization.tts_reward_title
+            if audio_manager is None:
+                audio_manager = Audio_Manager(sample_cache_size = audio_config.sample_cache_size, polyphony = audio_config.polyphony, sound_effect_volume = audio_config.sound_effect_volume)
+
+            module_list.append(self._build_module("audiomodule_TTS", lambda source: source.TTS_Manager(self.hotkey_manager, audio_manager, prefetch_count = TTS_config.prefetch_count, prewarm_file = TTS_config.prewarm_file,
+                                                                                                      reward_title = reward_title, pyTTS_base_rate = TTS_config.pytts_base_rate)))
+
+        match profile.game:
+            case "":
+                pass
+
+            case "Minigolf":
+                minigolf_config = self.config.minigolf
+                module_list.append(self._build_module("mode_minigolf", lambda source: source.Minigolf_Manager(self.hotkey_manager, democracy = minigolf_config.democracy, vote_window = minigolf_config.vote_window, vote_rule = source.Vote_Rule(minigolf_config.vote_rule),
+                                                                                                               vote_threshold = minigolf_config.vote_threshold, vector_limit = minigolf_config.vector_limit, power_limit = minigolf_config.power_limit)))
+
+            case _:
+                print(f"\nUnknown game {profile.game}. Games are: {', '.join(game_options)}. No game selected.\n")
+
+        if profile.metrics:
+            module_list.append(Metrics_Reporter())
+
+        if profile.watchdog:
+            module_list.append(Loop_Watchdog())
+
+        if profile.memory_profiler:
+            module_list.append(Memory_Profiler())
+
         # Prints all relevant hotkeys to the session.
         print("Hotkeys are: ")
 
@@ -155,11 +346,22 @@ class Integration(object):
 
 if __name__ == "__main__":
 
+    parser = argparse.ArgumentParser(description = "SkyeWint's Twitch Integration program.")
+    parser.add_argument("--profile", help = "Launch profile from profiles.ini to start with, instead of answering the startup questions.")
+    arguments = parser.parse_args()
+
     print("Welcome to SkyeWint's Twitch Integration program!\n")
 
     validate_config_file()
 
-    program = Integration()
+    profile = None
+    if arguments.profile:
+        try:
+            profile = get_launch_profile(arguments.profile)
+        except Exception as e:
+            print(f"{e}\nAnswer the questions below instead.\n")
+
+    program = Integration(profile)
 
     # Initiates main loop after other initialization is complete.
-    asyncio.run(program.main())
\ No newline at end of file
+    asyncio.run(program.main())
@@ -1,12 +1,15 @@
-import string
-import pydirectinput
 import asyncio
-import pyautogui
 import numpy
+from array import array
+from enum import Enum
 
 from utils_keycodes import *
+from utils_async import Threadsafe_Event
+from utils_input_backend import Input_Backend, Direct_Input_Backend
+from utils_metrics import metrics
+from utils_clock import Clock, real_clock
 
-from twitchAPI.object.eventsub import ChannelChatMessageEvent
+from utils_events import Chat_Message, Event_Type
 
 # Used for function annotation. Not required at runtime.
 from utils_hotkey_manager import Hotkey_Manager
@@ -22,20 +25,47 @@ from utils_hotkey_manager import Hotkey_Manager
 
 
 
+# Decides how votes collected over a democracy mode window become a single action.
+class Vote_Rule(Enum):
+
+    # The command with the most votes is applied.
+    PLURALITY = "plurality"
+
+    # Direction commands are averaged into one movement, weighted by their votes. Other commands only win if they outvote every direction combined.
+    WEIGHTED_AVERAGE = "weighted average"
+
+    # The command with the most votes is only applied if it has at least the threshold share of all votes.
+    THRESHOLD = "threshold"
+
+
+
 class Minigolf_Manager():
-    def __init__(self, hotkey_manager:"Hotkey_Manager") -> None:
-        
-        pyautogui.FAILSAFE = False
+    def __init__(self, hotkey_manager:"Hotkey_Manager", democracy:"bool" = False, vote_window:"float" = 0.5, vote_rule:"Vote_Rule" = Vote_Rule.PLURALITY, vote_threshold:"float" = 0.5, vector_limit:"int" = 50, power_limit:"int" = 2000, input_backend:"Input_Backend" = None, clock:"Clock" = None) -> None:
+
+        # Ticks and vote windows follow this clock, which must match the running event loop's.
+        self._clock = clock if clock is not None else real_clock
+
+        # All mouse and keyboard input goes through the backend's own thread, so injecting it never blocks the event loop.
+        self._input = input_backend if input_backend is not None else Direct_Input_Backend(clock = self._clock)
+
+        # How late each 20ms movement tick runs. Late ticks mean the event loop is busy elsewhere, and aiming stutters.
+        self._tick_jitter = metrics.histogram("minigolf_tick_jitter_seconds", "How late each Minigolf movement tick wakes up.")
+        metrics.counter("minigolf_injected_moves_total", "Mouse moves injected into the game after merging.", function = lambda: self._input.injected_moves)
+
+        # Timed key holds are scheduled instead of slept through, so holds can overlap and never delay other commands.
+        self._keys = Key_Scheduler(self._input.key_down, self._input.key_up, self._clock)
 
 
         # Defines mouse movement vectors. ...and some limits to movement. Movement speed is measured in mickeys/0.02s
         self._vectors = [0,0]
-        self._vector_limit = 50
+        self._vector_limit = vector_limit
         self._power_total = 0
-        self._power_limit = 2000
+        self._power_limit = power_limit
 
-        # Sets up ability to pause without closing the function.
+        # Sets up ability to pause without closing the function. The hotkey runs on the keyboard thread, so the event is set thread-safely.
         self._paused = True
+        self._unpaused = Threadsafe_Event()
+        self._running = False
         hotkey_manager.create_hotkey("Pause Button", "right shift+P", self._pause_unpause, force_assignment = True)
 
         # Creates dictionary of available commands as well as values to identify conditions for gameplay.
@@ -72,6 +102,32 @@ class Minigolf_Manager():
         self._chat_commands.update(dict.fromkeys(["targeted", "target lock", "focus", "lock in", "lock on"], "lock in"))
 
         self._chat_commands.update(dict.fromkeys(["jump", "yeet"], "jump"))
+
+        # Democracy mode counts votes per command over a window and applies one decision per window. Anarchy mode applies every message.
+        # Votes are stored in an array indexed by command slot, so counting a vote is a single increment.
+        self._democracy = democracy
+        self._vote_window = vote_window
+        self._vote_rule = vote_rule
+        self._vote_threshold = vote_threshold
+        hotkey_manager.create_hotkey("Toggle Minigolf Democracy", "right shift+D", self._toggle_democracy, force_assignment = True)
+
+        self._commands = sorted(set(self._chat_commands.values()))
+        self._command_slots = {command: i for i, command in enumerate(self._commands)}
+        self._empty_votes = array("I", [0]) * len(self._commands)
+        self._votes = array("I", self._empty_votes)
+
+        # Commands valid in each state, and the movement each direction command stands for.
+        global_commands = ["stop", "jump"]
+        self._aiming_slots = [self._command_slots[command] for command in ["up", "down", "left", "right", "lock in", "slightly left", "slightly right"] + global_commands]
+        self._power_slots = [self._command_slots[command] for command in ["more", "less", "slightly more", "slightly less", "aim", "fire"] + global_commands]
+        self._direction_vectors = {
+            self._command_slots["up"]: (0, 4),
+            self._command_slots["down"]: (0, -4),
+            self._command_slots["left"]: (-4, 0),
+            self._command_slots["right"]: (4, 0),
+            self._command_slots["more"]: (0, 4),
+            self._command_slots["less"]: (0, -4)
+        }
     
 
 
@@ -114,7 +170,7 @@ class Minigolf_Manager():
         if self._power_total >= self._power_limit and y > 0:
             self._vectors[1] = 0
         
-        pydirectinput.moveRel(x, y, duration = 0.02, relative = True)
+        self._input.move_relative(x, y)
 
         # Total power quantity is actively tracked each time the mouse is moved.
         if not self._aiming:
@@ -125,21 +181,21 @@ class Minigolf_Manager():
 
     def _lock_in_aim(self) -> None:
         self._reset_vectors()
-        pydirectinput.mouseDown()
+        self._input.mouse_down()
         self._aiming = False
 
 
     def _go_back_to_aiming(self) -> None:
         self._reset_vectors()
-        pydirectinput.moveRel(0, -5000, relative = True)
-        pydirectinput.rightClick()
-        pydirectinput.mouseUp()
+        self._input.move_relative(0, -5000)
+        self._input.right_click()
+        self._input.mouse_up()
         self._aiming = True
 
 
     def _fire(self) -> None:
         self._reset_vectors()
-        pydirectinput.mouseUp()
+        self._input.mouse_up()
         self._aiming = True
 
 
@@ -147,46 +203,73 @@ class Minigolf_Manager():
     def _pause_unpause(self) -> None:
         self._paused = not self._paused
         if self._paused:
+            self._unpaused.clear_threadsafe()
             print("Minigolf integration is now paused.")
         elif not self._paused:
+            self._unpaused.set_threadsafe()
             print("Minigolf integration is now unpaused.")
 
 
-    ##### Public functions
+    # To be called via hotkey only. Switches between democracy mode and anarchy mode.
+    def _toggle_democracy(self) -> None:
+        self._democracy = not self._democracy
+        self._votes = array("I", self._empty_votes)
+        if self._democracy:
+            print(f"Minigolf is now in democracy mode. Votes are counted every {self._vote_window}s using {self._vote_rule.value}.")
+        else:
+            print("Minigolf is now in anarchy mode. Every command is applied.")
 
-    async def terminate_module(self) -> None:
-        self._running = False
 
+    # Applies one decision from the votes counted over the last window, then starts a new window.
+    def _apply_votes(self) -> None:
 
-    async def update(self) -> None:
-        
-        self._running = True
-        while self._running:
-            if self._paused:
-                # Less frequent checking occurs while paused to improve performance.
-                await asyncio.sleep(1)
-                
-            else:
-                self._move_mouse(self._vectors[0], self._vectors[1])
+        votes = self._votes
+        self._votes = array("I", self._empty_votes)
 
-                await asyncio.sleep(0.02)
-    
+        # Votes for commands that can't be used in the current state are ignored.
+        valid_slots = self._aiming_slots if self._aiming else self._power_slots
 
+        total = 0
+        winner = valid_slots[0]
+        for slot in valid_slots:
+            total += votes[slot]
+            if votes[slot] > votes[winner]:
+                winner = slot
 
-    # Receives chat message event and directs it according to the matching command based on self._chat_commands.
-    async def _handle_chat_message(self, chat_message:"ChannelChatMessageEvent"):
+        if total == 0:
+            return
 
-        
-        # Normalizes username to lowercase and removes punctuation for flexible command matching.
-        text = str.lower(chat_message.event.message.text)
-        text.translate(str.maketrans('', '', string.punctuation))
+        match self._vote_rule:
+            case Vote_Rule.PLURALITY:
+                self._apply_command(self._commands[winner], confirmed = True)
+
+            case Vote_Rule.THRESHOLD:
+                if votes[winner] >= total * self._vote_threshold:
+                    self._apply_command(self._commands[winner], confirmed = True)
+
+            case Vote_Rule.WEIGHTED_AVERAGE:
+                direction_total = 0
+                x = 0
+                y = 0
+                for slot in valid_slots:
+                    vector = self._direction_vectors.get(slot)
+                    if vector is not None and votes[slot]:
+                        direction_total += votes[slot]
+                        x += vector[0] * votes[slot]
+                        y += vector[1] * votes[slot]
+
+                if direction_total >= votes[winner]:
+                    self._change_vectors(round(x / direction_total), round(y / direction_total))
+                else:
+                    self._apply_command(self._commands[winner], confirmed = True)
 
-        if self._paused:
-            return
+
+    # Applies a single command. Aim and fire normally need the same command twice in a row; a confirmed command, such as a vote result, doesn't.
+    def _apply_command(self, command:"str", confirmed:"bool" = False) -> None:
 
         # Some commands should only be usable while aiming, others should only be usable once aiming is over.
         if self._aiming:
-            match self._chat_commands.get(text):
+            match command:
                 case "up":
                     self._change_vectors(0, 4)
 
@@ -216,7 +299,7 @@ class Minigolf_Manager():
 
 
         else:
-            match self._chat_commands.get(text):
+            match command:
                 case "more":
                     self._change_vectors(0, 4)
 
@@ -236,14 +319,14 @@ class Minigolf_Manager():
                     print(self._slight_power_adjustment_counter)
 
                 case "aim":
-                    if self._last_command == "aim":
+                    if confirmed or self._last_command == "aim":
                         self._go_back_to_aiming()
 
                         # Power adjustment-related counters are reset when aiming.
                         self._slight_power_adjustment_counter = 0
 
                 case "fire":
-                    if self._last_command == "fire":
+                    if confirmed or self._last_command == "fire":
                         self._fire()
 
                         # All counters are reset when firing as the turn is over. 
@@ -252,13 +335,87 @@ class Minigolf_Manager():
                         self._power_total = 0
 
 
-        match self._chat_commands.get(text):
+        match command:
             case "stop":
                 self._reset_vectors()
             
             case "jump":
-                hold_and_release_key(J, 0.02)
+                self._keys.hold(J, 0.02)
+
+
+        self._last_command = command
+
 
+    ##### Public functions
+
+    async def terminate_module(self) -> None:
+        self._running = False
+
+        # Releases any held keys before the backend stops, so nothing is left pressed in the game.
+        await self._keys.stop()
+        await self._input.stop()
+
+        # Wakes update() if it is waiting while paused so it can exit.
+        self._unpaused.set()
+
+
+    async def update(self) -> None:
+        
+        self._running = True
+        self._unpaused.bind_loop()
+        self._input.start()
+        self._keys.start()
+
+        next_vote_time = self._clock.now() + self._vote_window
+
+        while self._running:
+            if self._paused:
+                # Sleeps until the pause hotkey or terminate_module() wakes it.
+                await self._unpaused.wait()
+
+                # The event is also set on termination, so the running state is checked again before moving.
+                continue
+                
+            else:
+                # Votes are applied once per window, on the movement tick that crosses it.
+                if self._democracy and self._clock.now() >= next_vote_time:
+                    self._apply_votes()
+                    next_vote_time = self._clock.now() + self._vote_window
+
+                self._move_mouse(self._vectors[0], self._vectors[1])
+
+                tick_start = self._clock.now()
+                await asyncio.sleep(0.02)
+                self._tick_jitter.observe(max(0.0, self._clock.now() - tick_start - 0.02))
+    
+
+
+    # Returns the eventsub event types this module handles. The Twitch connection only subscribes to types some module handles.
+    def get_event_types(self) -> list:
+        return [Event_Type.CHAT]
+
+
+    # Returns every chat command and alias this module reacts to. Used by the Twitch connection to build its command index.
+    def get_chat_commands(self) -> list:
+        return list(self._chat_commands.keys())
+
+
+    # Receives chat message event and directs it according to the matching command based on self._chat_commands.
+    async def handle_chat_message(self, chat_message:"Chat_Message"):
+
+        
+        # Text is already lowercased and stripped of punctuation by the Twitch connection.
+        text = chat_message.text
+
+        if self._paused:
+            return
+
+        command = self._chat_commands.get(text)
+        if command is None:
+            return
+
+        if self._democracy:
+            self._votes[self._command_slots[command]] += 1
+            return
 
-        if text in self._chat_commands.keys():
-            self._last_command = self._chat_commands.get(text)
\ No newline at end of file
+        self._apply_command(command)
@@ -4,41 +4,85 @@ from twitchAPI.twitch import Twitch
 from twitchAPI.helper import first
 from twitchAPI.oauth import UserAuthenticationStorageHelper
 from twitchAPI.type import AuthScope
-from twitchAPI.eventsub.websocket import EventSubWebsocket
 from twitchAPI.object.eventsub import ChannelChatMessageEvent, ChannelPointsCustomRewardRedemptionAddEvent
 
 
 #### General imports.
 
+import time
 import asyncio
+import functools
 
 
 #### Imports from this project.
 
-from utils_config import get_config
+from utils_config import get_config, Initialization_Config
+from utils_dispatch import Dispatch_Mode, Overflow_Policy, Module_Inbox
+from utils_events import Chat_Message, Point_Redemption, Event_Type, EVENT_CAPABILITIES, get_module_event_types
+from utils_async import Threadsafe_Event
+from utils_event_log import Event_Recorder, Logged_Event
+from utils_eventsub import EventSub_Supervisor, EventSub_Subscription
+from utils_throttle import Chat_Throttle
+from utils_metrics import metrics
 
 
 
 class Twitch_Connection():
-    def __init__(self, module_list:"list") -> None:
+    def __init__(self, module_list:"list", dispatch_mode:"Dispatch_Mode" = Dispatch_Mode.SERIAL, inbox_size:"int" = 100, overflow_policy:"Overflow_Policy" = Overflow_Policy.DROP_OLDEST, event_recorder:"Event_Recorder" = None, config:"Initialization_Config" = None, throttle:"Chat_Throttle" = None) -> None:
 
-        # Preps empty sets for all required callback functions from current modules.
-        self.chat_message_callbacks = set()
-        self.point_reward_callbacks = set()
+        # Callbacks of every module, by the event type they handle. Only event types with callbacks are subscribed to.
+        self._callbacks = {event_type: frozenset() for event_type in Event_Type}
+
+        # In concurrent dispatch mode, each module gets one inbox shared by all of its callbacks so per-module ordering is kept.
+        self.dispatch_mode = dispatch_mode
+        self._inboxes = {}
+        self._callback_inboxes = {}
+
+        # Merged index of every module's chat commands and aliases, mapped to the callbacks that can react to them.
+        # Modules with a chat callback but no get_chat_commands() receive every message.
+        self._command_index = {}
+        self._catch_all_chat_callbacks = ()
+
+        # Normalized text of the last chat message received, passed on with the next one.
+        self._last_chat_text = ""
+
+        # Kept so modules swapped in while running get the same kind of inbox.
+        self._inbox_size = inbox_size
+        self._overflow_policy = overflow_policy
+        self._inboxes_started = False
+
+        # In serial dispatch mode modules are timed here, since they have no inbox to time them.
+        self._callback_handle_times = {}
 
         # Cycles through all modules passed to the twitch connection on initialization and adds them to the lists.
         for module in module_list:
+            self._add_module(module)
 
-            # Verifies the callback functions exist in the module list, then adds existing functions to their relevant lists.
-            if callable(getattr(module, "handle_chat_message", None)):
-                self.chat_message_callbacks.add(module.handle_chat_message)
+        self._build_command_index()
 
-            if callable(getattr(module, "handle_point_reward", None)):
-                self.point_reward_callbacks.add(module.handle_point_reward)
+        # Routes each event type from eventsub to its ingress. Chat and redemptions do more than dispatch, so they have their own.
+        self._event_ingress = {event_type: functools.partial(self._on_event, event_type) for event_type in Event_Type}
+        self._event_ingress[Event_Type.CHAT] = self._on_chat_message
+        self._event_ingress[Event_Type.REDEMPTION] = self._on_point_redemption
+
+        # Events received and time spent in each eventsub callback, which includes waiting on modules in serial dispatch mode.
+        self._events_received = {event_type: metrics.counter("twitch_events_total", "Events received from eventsub.", event = event_type.value) for event_type in Event_Type}
+        self._chat_messages_matched = metrics.counter("twitch_chat_messages_matched_total", "Chat messages that matched a module command.")
+        self._dispatch_times = {event_type: metrics.histogram("twitch_dispatch_seconds", "Time spent in the eventsub callback per event.", event = event_type.value) for event_type in Event_Type}
+
+        # Credentials and the channel to join. Read from config.ini when the connection is initialized if not given.
+        self._config = config
+
+        # Optionally limits how often chat commands reach modules. Off unless a throttle is given.
+        self._throttle = throttle
+
+        # Optionally records every incoming event so the session can be replayed later. Off unless a recorder is given.
+        self._event_recorder = event_recorder
 
 
         # Declares main relevant variables for future usage.
         self.running = True
+        self._stop_event = Threadsafe_Event()
         self.client_id = None
         self.client_secret = None
         self.twitch = None
@@ -50,19 +94,161 @@ class Twitch_Connection():
     ##### Private Functions
 
 
+    def _get_all_callbacks(self) -> frozenset:
+        return frozenset().union(*self._callbacks.values())
+
+
+    # Adds a module's callbacks, and its inbox in concurrent dispatch mode. The command index must be rebuilt afterwards.
+    # Callback sets are replaced rather than changed, so an event being dispatched keeps the set it started with while modules are swapped.
+    def _add_module(self, module) -> None:
+
+        # Adds the module's handler for each event type it declares to that type's set.
+        for event_type in get_module_event_types(module):
+            callback = getattr(module, EVENT_CAPABILITIES[event_type].handler_name, None)
+            if not callable(callback):
+                print(f"{type(module).__name__} declares {event_type.value} events but has no {EVENT_CAPABILITIES[event_type].handler_name}(). Ignoring them.")
+                continue
+
+            self._callbacks[event_type] = self._callbacks[event_type] | {callback}
+
+        if self.dispatch_mode == Dispatch_Mode.CONCURRENT:
+            self._create_inbox(module, self._inbox_size, self._overflow_policy)
+            return
+
+        for callback in self._get_all_callbacks():
+            if callback.__self__ is module:
+                self._callback_handle_times[callback] = metrics.histogram("module_handle_seconds", "Time a module takes to handle one event.", module = type(module).__name__)
+
+
+    # Creates an inbox for a module and maps each of its callbacks to it. Modules without callbacks don't get an inbox.
+    def _create_inbox(self, module, inbox_size:"int", overflow_policy:"Overflow_Policy") -> None:
+
+        module_callbacks = [callback for callback in self._get_all_callbacks() if callback.__self__ is module]
+        if not module_callbacks:
+            return
+
+        inbox = Module_Inbox(type(module).__name__, inbox_size, overflow_policy)
+        self._inboxes[module] = inbox
+
+        for callback in module_callbacks:
+            self._callback_inboxes[callback] = inbox
+
+
+    # Merges the chat commands of every module into one lookup so unmatched messages are dropped with a single dict lookup.
+    def _build_command_index(self) -> None:
+
+        command_index = {}
+        catch_all = []
+
+        for callback in self._callbacks[Event_Type.CHAT]:
+            get_chat_commands = getattr(callback.__self__, "get_chat_commands", None)
+
+            if not callable(get_chat_commands):
+                catch_all.append(callback)
+                continue
+
+            for command in get_chat_commands():
+                command_index.setdefault(command, []).append(callback)
+
+        # Catch-all callbacks are appended to every entry so a matched message still reaches them.
+        self._catch_all_chat_callbacks = tuple(catch_all)
+        self._command_index = {command: tuple(callbacks) + self._catch_all_chat_callbacks for command, callbacks in command_index.items()}
+
+
+    # Hands data to every callback in the set, either by awaiting each in turn or by placing it in each module's inbox.
+    async def _dispatch(self, callbacks:"set | tuple", data) -> None:
+
+        # The lookups are held for the whole dispatch, since replace_module() swaps in new ones instead of changing them.
+        if self.dispatch_mode == Dispatch_Mode.CONCURRENT:
+            callback_inboxes = self._callback_inboxes
+            for callback in callbacks:
+                await callback_inboxes[callback].put(callback, data)
+            return
+
+        callback_handle_times = self._callback_handle_times
+        for callback in callbacks:
+            start = time.perf_counter()
+            await callback(data)
+            callback_handle_times[callback].observe(time.perf_counter() - start)
+
+
     ## Event callback functions: Calls all callbacks based on the given chat message.
 
-    # Only to be awaited by eventsub in run().
+    # Only to be awaited by eventsub in run(). Messages are normalized once, and only modules with a matching command receive them.
     async def _on_chat_message(self, data:"ChannelChatMessageEvent") -> None:
 
-        for callback in self.chat_message_callbacks:
-            await callback(data)
+        start = time.perf_counter()
+        self._events_received[Event_Type.CHAT].inc()
+
+        # Every message is seen here, before routing or throttling, so each record knows the message that really came before it.
+        chat_message = Chat_Message.from_event(data, self._last_chat_text)
+        self._last_chat_text = chat_message.text
+
+        if self._event_recorder is not None:
+            self._event_recorder.record(Logged_Event.CHAT, chat_message)
+
+        # Only commands are throttled. Messages that match no command still reach the modules that receive every message.
+        callbacks = self._command_index.get(chat_message.text)
+        if callbacks is None:
+            callbacks = self._catch_all_chat_callbacks
+        elif self._throttle is not None:
+            callbacks = self._throttle.filter(chat_message, callbacks)
+
+        if callbacks:
+            self._chat_messages_matched.inc()
+            await self._dispatch(callbacks, chat_message)
+
+        self._dispatch_times[Event_Type.CHAT].observe(time.perf_counter() - start)
 
 
+    # Redemptions are cut down to a record once, like chat messages, so modules and their inboxes never hold the eventsub object.
     async def _on_point_redemption(self, data:"ChannelPointsCustomRewardRedemptionAddEvent") -> None:
 
-        for callback in self.point_reward_callbacks:
-            await callback(data)
+        start = time.perf_counter()
+        self._events_received[Event_Type.REDEMPTION].inc()
+
+        point_redemption = Point_Redemption.from_event(data)
+
+        if self._event_recorder is not None:
+            self._event_recorder.record(Logged_Event.REDEMPTION, point_redemption)
+
+        await self._dispatch(self._callbacks[Event_Type.REDEMPTION], point_redemption)
+
+        self._dispatch_times[Event_Type.REDEMPTION].observe(time.perf_counter() - start)
+
+
+    # Ingress for event types that only need to reach the modules that handle them.
+    async def _on_event(self, event_type:"Event_Type", data) -> None:
+
+        start = time.perf_counter()
+        self._events_received[event_type].inc()
+
+        await self._dispatch(self._callbacks[event_type], data)
+
+        self._dispatch_times[event_type].observe(time.perf_counter() - start)
+
+
+    # Builds the eventsub subscriptions for every event type some module handles. Each handler wraps the payload in its event class.
+    def _build_subscriptions(self) -> list:
+
+        subscriptions = []
+        for event_type in self.get_event_types():
+            for subscription in EVENT_CAPABILITIES[event_type].subscriptions:
+
+                async def handle_payload(payload:"dict", event_type = event_type, event_class = subscription.event_class) -> None:
+                    await self._event_ingress[event_type](event_class(**payload))
+
+                condition = {key: self.user.id for key in subscription.condition_keys}
+                subscriptions.append(EventSub_Subscription(subscription.type, subscription.version, condition, handle_payload))
+
+        return subscriptions
+
+
+    # Returns headers for Helix requests, refreshing the user token first if it has expired.
+    async def _get_request_headers(self) -> dict:
+
+        token = await self.twitch.get_refreshed_user_auth_token()
+        return {"Client-ID": self.twitch.app_id, "Authorization": f"Bearer {token}", "Content-Type": "application/json"}
 
 
 
@@ -73,14 +259,21 @@ class Twitch_Connection():
     def stop_running(self) -> None:
 
         self.running = False
+        self._stop_event.set_threadsafe()
+
+
+    # Returns the event types handled by at least one module, which are the only ones subscribed to.
+    def get_event_types(self) -> list:
+        return [event_type for event_type in Event_Type if self._callbacks[event_type]]
 
 
     # Initializes Twitch object in the class based on data in config.ini.
     async def initialize_twitch(self) -> None:
-        initialization_dict = get_config("INITIALIZATION")
+        if self._config is None:
+            self._config = get_config().initialization
 
-        self.client_id = initialization_dict.get("client_id")
-        self.client_secret = initialization_dict.get("client_secret")
+        self.client_id = self._config.client_id
+        self.client_secret = self._config.client_secret
 
         # Initializes API instance with app authentication.
         self.twitch = await Twitch(self.client_id, self.client_secret)
@@ -88,9 +281,11 @@ class Twitch_Connection():
         print("App authentication complete.")
 
         # Initializes user authentication and sets up helper to maintain auth tokens.
+        # Only asks for the scopes the handled event types need, plus any extra scopes from config.ini.
         target_scopes = []
-        for scope in str(initialization_dict.get("scope")).split():
-            target_scopes.append(AuthScope[scope])
+        for scope in [scope for event_type in self.get_event_types() for scope in EVENT_CAPABILITIES[event_type].scopes] + self._config.scope.split():
+            if AuthScope(scope) not in target_scopes:
+                target_scopes.append(AuthScope(scope))
 
         self.helper = UserAuthenticationStorageHelper(self.twitch, target_scopes)
         await self.helper.bind()
@@ -99,31 +294,93 @@ class Twitch_Connection():
 
 
         # Establishes currently logged-in user and all information from it.
-        self.user = await first(self.twitch.get_users(logins=initialization_dict.get("login_name")))
+        self.user = await first(self.twitch.get_users(logins=self._config.login_name))
 
         print(f"Current user is {self.user.display_name}")
 
 
+    # Returns the number of pending events per module inbox. Empty in serial dispatch mode.
+    def get_inbox_depths(self) -> dict:
+
+        return {inbox.module_name: inbox.depth() for inbox in self._inboxes.values()}
+
+
+    # Swaps a running module for a rebuilt one without touching eventsub, so no events are missed while it reloads.
+    # Events still waiting in the old module's inbox are handed to the new module. The old module must be terminated by the caller.
+    async def replace_module(self, old_module, new_module) -> None:
+
+        subscribed_event_types = self.get_event_types()
+
+        old_callbacks = {callback for callback in self._get_all_callbacks() if callback.__self__ is old_module}
+        self._callbacks = {event_type: callbacks - old_callbacks for event_type, callbacks in self._callbacks.items()}
+        self._callback_inboxes = {callback: inbox for callback, inbox in self._callback_inboxes.items() if callback not in old_callbacks}
+        self._callback_handle_times = {callback: handle_time for callback, handle_time in self._callback_handle_times.items() if callback not in old_callbacks}
+        old_inbox = self._inboxes.pop(old_module, None)
+
+        self._add_module(new_module)
+        self._build_command_index()
+
+        # Subscriptions are only made at startup, so a type no module handled then won't arrive until a restart.
+        for event_type in get_module_event_types(new_module):
+            if event_type not in subscribed_event_types:
+                print(f"{type(new_module).__name__} now handles {event_type.value} events, which aren't subscribed to. Restart to receive them.")
+
+        new_inbox = self._inboxes.get(new_module)
+
+        # Events still waiting for the old module go to the new one's handler of the same name, before anything newer can arrive.
+        if old_inbox is not None:
+            dropped = 0
+            for callback, data, queued_time in old_inbox.take_pending():
+                new_callback = getattr(new_module, callback.__name__, None)
+                if new_inbox is None or new_callback is None or not new_inbox.put_pending(new_callback, data, queued_time):
+                    dropped += 1
+
+            if dropped:
+                print(f"Dropped {dropped} events waiting for {type(old_module).__name__} that the reloaded module can't receive.")
+
+        if new_inbox is not None and self._inboxes_started:
+            new_inbox.start()
+
+        if old_inbox is not None:
+            await old_inbox.stop()
+
+
     # Runs active event subscriptions until hotkey is detected to stop running the functions.
     async def run(self) -> None:
-        
-        # Starts the client 
-        eventsub = EventSubWebsocket(self.twitch)
-        eventsub.start()
 
+        # Module inbox workers must be running before the first event can arrive.
+        for inbox in self._inboxes.values():
+            inbox.start()
+        self._inboxes_started = True
 
-        # Sets up all callback functions.
-        await eventsub.listen_channel_chat_message(self.user.id, self.user.id, self._on_chat_message)
-        await eventsub.listen_channel_points_custom_reward_redemption_add(self.user.id, self._on_point_redemption)
+        if self._event_recorder is not None:
+            self._event_recorder.start()
 
+        # Starts the eventsub session, which reconnects on its own if the connection drops until it is stopped.
+        # Twitch closes sessions that have no subscriptions, so none is started if no module handles any events.
+        subscriptions = self._build_subscriptions()
+        eventsub = EventSub_Supervisor(subscriptions, self._get_request_headers, event_recorder = self._event_recorder)
+        eventsub_task = asyncio.create_task(eventsub.run()) if subscriptions else None
 
-        while self.running:
-            await asyncio.sleep(2)
+        print(f"Subscribing to {', '.join(event_type.value for event_type in self.get_event_types()) or 'no events'}.")
+
+
+        # Waits without polling until stop_running() is called.
+        await self._stop_event.wait()
 
         print("Closing eventsub and API connection...")
 
         await eventsub.stop()
+        if eventsub_task is not None:
+            await eventsub_task
         await self.twitch.close()
 
+        if self._event_recorder is not None:
+            self._event_recorder.record(Logged_Event.SESSION, {"state": "closed"})
+            await self._event_recorder.stop()
+
+        for inbox in self._inboxes.values():
+            await inbox.stop()
+
         print("Fully shut down. Exiting.")
 
@@ -0,0 +1,41 @@
+import asyncio
+
+
+
+#### asyncio.Event that can also be set or cleared from other threads, such as the keyboard hotkey thread.
+
+class Threadsafe_Event(asyncio.Event):
+    def __init__(self) -> None:
+        super().__init__()
+
+        # The loop is only known once something awaits the event or the owner binds it from inside the loop.
+        self._owner_loop = None
+
+
+
+    ##### Public Functions
+
+    # Binds the event to the running loop. Call from inside the loop before other threads can set the event.
+    def bind_loop(self) -> None:
+        self._owner_loop = asyncio.get_running_loop()
+
+
+    async def wait(self) -> bool:
+        self._owner_loop = asyncio.get_running_loop()
+        return await super().wait()
+
+
+    # Sets the event from any thread. Without a bound loop nothing can be waiting yet, so the flag is set directly.
+    def set_threadsafe(self) -> None:
+        if self._owner_loop is None or self._owner_loop.is_closed():
+            self.set()
+        else:
+            self._owner_loop.call_soon_threadsafe(self.set)
+
+
+    # Clears the event from any thread.
+    def clear_threadsafe(self) -> None:
+        if self._owner_loop is None or self._owner_loop.is_closed():
+            self.clear()
+        else:
+            self._owner_loop.call_soon_threadsafe(self.clear)
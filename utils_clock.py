@@ -0,0 +1,120 @@
+import time
+import asyncio
+import warnings
+import selectors
+import threading
+
+
+
+##############################################################################################
+###############  Clocks for time-based behaviour. Modules read the time from   ###############
+###############  a clock instead of the time module, and wait with asyncio,    ###############
+###############  which follows the event loop's clock. Virtual_Clock runs the  ###############
+###############  loop on simulated time that jumps straight to the next timer, ###############
+###############  so an hour of stream traffic can run in seconds.             ###############
+##############################################################################################
+
+
+
+#### Real time. Used everywhere unless a virtual clock is injected.
+
+class Clock(object):
+
+    # Returns monotonic seconds. Matches the default event loop's time().
+    def now(self) -> float:
+        return time.monotonic()
+
+
+    # Blocks the calling thread. Only for code running outside the event loop, like input backend threads.
+    def sleep_blocking(self, seconds:"float") -> None:
+        time.sleep(seconds)
+
+
+    def new_event_loop(self) -> "asyncio.AbstractEventLoop":
+        return asyncio.new_event_loop()
+
+
+
+#### Simulated time. Only moves forward when the event loop has nothing to run before its next timer, and then jumps straight to it.
+#### Run code on it with: asyncio.Runner(loop_factory = clock.new_event_loop).
+#### Threads still run in real time, so timing is only deterministic for work done on the event loop.
+
+class Virtual_Clock(Clock):
+    def __init__(self, start_time:"float" = 0.0) -> None:
+        self._time = start_time
+
+
+    def now(self) -> float:
+        return self._time
+
+
+    def advance(self, seconds:"float") -> None:
+        if seconds > 0:
+            self._time += seconds
+
+
+    # Returns immediately, since blocking a thread doesn't move simulated time.
+    def sleep_blocking(self, seconds:"float") -> None:
+        return
+
+
+    def new_event_loop(self) -> "asyncio.AbstractEventLoop":
+        return _Virtual_Event_Loop(self)
+
+
+
+# Instead of waiting for the next timer, advances the clock to it. Still waits for real when no timer is scheduled,
+# so callbacks from other threads and real sockets can wake the loop.
+class _Virtual_Selector(selectors.DefaultSelector):
+    def __init__(self, clock:"Virtual_Clock") -> None:
+        super().__init__()
+        self._clock = clock
+
+    def select(self, timeout = None):
+
+        events = super().select(0)
+        if events or timeout == 0:
+            return events
+
+        if timeout is None:
+            return super().select(None)
+
+        self._clock.advance(timeout)
+        return []
+
+
+
+class _Virtual_Event_Loop(asyncio.SelectorEventLoop):
+    def __init__(self, clock:"Virtual_Clock") -> None:
+        super().__init__(_Virtual_Selector(clock))
+        self._clock = clock
+
+    def time(self) -> float:
+        return self._clock.now()
+
+
+    # asyncio.Runner gives the default executor's threads a timeout to finish when it closes. On simulated time that timeout would expire at once,
+    # so it is timed on a real timer instead, since the threads run in real time.
+    async def shutdown_default_executor(self, timeout = None) -> None:
+
+        shutdown = self.create_task(super().shutdown_default_executor())
+        timer = None
+        if timeout is not None:
+            timer = threading.Timer(timeout, self.call_soon_threadsafe, (shutdown.cancel,))
+            timer.daemon = True
+            timer.start()
+
+        try:
+            await shutdown
+        except asyncio.CancelledError:
+            if not shutdown.cancelled():
+                raise
+            warnings.warn(f"The executor did not finish joining its threads within {timeout} seconds.", RuntimeWarning, stacklevel = 2)
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+
+
+# Shared by every module that isn't given a clock.
+real_clock = Clock()
@@ -1,68 +1,251 @@
 import os
 import configparser
-import time
-import random
+from typing import NamedTuple
 
 
 CONFIG_FILENAME = 'config.ini'
+PROFILES_FILENAME = 'profiles.ini'
 
 
-# Gets a specific section of the config file.
-def get_config(section:"str") -> dict:
-    config = configparser.ConfigParser()
-    config.read(CONFIG_FILENAME)
+
+######### Config Sections #########
+
+# Each section of config.ini is parsed into one of these. They are immutable, so a module can keep the one it was given.
+# Field names are the keys in config.ini, and the field types are what the values are converted to.
+
+class Initialization_Config(NamedTuple):
+
+    client_id: str
+    client_secret: str
+    scope: str
+    login_name: str
+    tts_reward_title: str
+
+
+# Every section below is optional. A missing section or key uses the default here.
+
+class Audio_Config(NamedTuple):
+
+    sample_cache_size: int = 64
+    polyphony: int = 8
+
+    # Volume sound effects start at. Below 1.0, spammed sounds merged into one play get louder with each trigger.
+    sound_effect_volume: float = 1.0
+
+
+class Sound_Effects_Config(NamedTuple):
+
+    preload_sounds: bool = True
+
+    # Seconds before the same sound can play again. 0 only skips a sound repeated in consecutive messages.
+    cooldown: float = 0.0
+
+    # Sound names with their voice priority, like "bonk:1 meow:0". When every voice is busy, a sound can only cut off sounds with the same or lower priority.
+    # Sounds not listed have priority 0.
+    sound_priorities: str = ""
+
+
+    # Returns sound_priorities as a dict of sound name to priority.
+    def get_sound_priorities(self) -> dict:
+
+        priorities = {}
+        for entry in self.sound_priorities.split():
+            sound_name, _, priority = entry.partition(":")
+            try:
+                priorities[sound_name] = int(priority)
+            except ValueError:
+                raise Exception(f"ERROR: sound_priorities in [SOUND_EFFECTS] must be sound:priority pairs like bonk:1, not {entry}.")
+
+        return priorities
+
+
+class TTS_Config(NamedTuple):
+
+    prefetch_count: int = 2
+    pytts_base_rate: int = 200
+    prewarm_file: str = "tts_prewarm.txt"
+
+
+class Minigolf_Config(NamedTuple):
+
+    democracy: bool = False
+    vote_window: float = 0.5
+    vote_rule: str = "plurality"
+    vote_threshold: float = 0.5
+    vector_limit: int = 50
+    power_limit: int = 2000
+
+
+# Chat command limits shared by every module. Rates are uses per second, and bursts how many uses can come at once. A rate of 0 turns that limit off.
+class Throttle_Config(NamedTuple):
+
+    user_rate: float = 1.0
+    user_burst: int = 4
+    command_rate: float = 0.0
+    command_burst: int = 10
+    module_rate: float = 0.0
+    module_burst: int = 20
+
+
+# The whole config file. Each field's section in config.ini is its name in capitals, like [SOUND_EFFECTS].
+class Config(NamedTuple):
+
+    initialization: Initialization_Config
+    audio: Audio_Config = Audio_Config()
+    sound_effects: Sound_Effects_Config = Sound_Effects_Config()
+    tts: TTS_Config = TTS_Config()
+    minigolf: Minigolf_Config = Minigolf_Config()
+    throttle: Throttle_Config = Throttle_Config()
+
+
+
+# Which modules to run, chosen without any prompts. Each section of profiles.ini is one profile, named by its header.
+# Start the program with one using: py main.py --profile [name]
+
+class Launch_Profile(NamedTuple):
+
+    sound_effects: bool = True
+    tts: bool = True
+
+    # Name of the game module to run, like Minigolf. Empty for none.
+    game: str = ""
+
+    record_events: bool = False
+    metrics: bool = False
+    watchdog: bool = False
+    memory_profiler: bool = False
+
+
+
+######### Private Functions #########
+
+# The config file is parsed once, by the first lookup or by validation. It only changes when reload_config() is called.
+_config = None
+
+
+# Converts a value from config.ini to the type of its field.
+def _convert(section:"str", key:"str", value:"str", field_type:"type"):
+
     try:
-        return dict(config.items(section))
-    except:
-        print("\n!! Config file invalid !!\n")
-        print(f"Attempted to get {section} from {config} but cannot read section.")
-        generate_config()
+        if field_type is bool:
+            return configparser.ConfigParser.BOOLEAN_STATES[value.lower()]
+        return field_type(value)
+
+    except (KeyError, ValueError):
+        raise Exception(f"ERROR: {key} in [{section}] must be a {field_type.__name__}, not {value}.")
+
+
+def _parse_section(parser:"configparser.ConfigParser", section:"str", section_class:"type") -> NamedTuple:
+
+    if not parser.has_section(section):
+        return section_class()
+
+    values = {}
+    for key, value in parser.items(section):
+        if key not in section_class._fields:
+            raise Exception(f"ERROR: Unknown key {key} in [{section}].")
+        values[key] = _convert(section, key, value, section_class.__annotations__[key])
+
+    return section_class(**values)
+
+
+def _parse_config(parser:"configparser.ConfigParser") -> Config:
+
+    for section in parser.sections():
+        if section not in [field.upper() for field in Config._fields]:
+            raise Exception(f"ERROR: Unknown config section [{section}].")
+
+    if not parser.has_section("INITIALIZATION") or set(parser.options("INITIALIZATION")) != set(Initialization_Config._fields):
+        raise Exception("ERROR: Config keys incorrect.")
+
+    return Config(**{field: _parse_section(parser, field.upper(), Config.__annotations__[field]) for field in Config._fields})
+
+
+def _read_config_file() -> "configparser.ConfigParser":
+
+    parser = configparser.ConfigParser()
+    parser.read(CONFIG_FILENAME)
+    return parser
+
+
+
+######### Public Functions #########
+
+# Returns the parsed config, reading config.ini the first time only.
+def get_config() -> Config:
+    global _config
+
+    if _config is None:
+        _config = _parse_config(_read_config_file())
+
+    return _config
 
 
-# Verifies if config.ini is present in the program folder and that it has the fields necessary.
-# If config.ini is not present or has incorrect contents, runs generate_config() from config_generator.py
-# Otherwise, if config.ini is present, confirms if user wants to generate a new config or if it is fine.
+# Reads config.ini again and returns the new config. Modules keep the config they were given until they are handed the new one.
+def reload_config() -> Config:
+    global _config
+
+    _config = _parse_config(_read_config_file())
+    return _config
+
+
+# Returns the named launch profile from profiles.ini.
+def get_launch_profile(name:"str") -> Launch_Profile:
+
+    parser = configparser.ConfigParser()
+    if not parser.read(PROFILES_FILENAME):
+        raise Exception(f"ERROR: {PROFILES_FILENAME} does not exist.")
+
+    if not parser.has_section(name):
+        raise Exception(f"ERROR: No launch profile named {name} in {PROFILES_FILENAME}. Profiles are: {', '.join(parser.sections())}")
+
+    return _parse_section(parser, name, Launch_Profile)
+
+
+# Adds a launch profile to profiles.ini, replacing any profile with the same name.
+def save_launch_profile(name:"str", profile:"Launch_Profile") -> None:
+
+    parser = configparser.RawConfigParser()
+    parser.read(PROFILES_FILENAME)
+    parser[name] = {key: str(value) for key, value in profile._asdict().items()}
+
+    with open(PROFILES_FILENAME, 'w') as profiles_file:
+        parser.write(profiles_file)
+
+
+# Verifies if config.ini is present in the program folder and that it has the fields necessary, then parses it for get_config().
+# If config.ini is not present or its [INITIALIZATION] section is incorrect, runs generate_config().
+# Mistakes in the optional module sections are reported instead, since generating a new config would lose them.
 def validate_config_file() -> None:
-    try:
-        config = configparser.ConfigParser()
+    global _config
 
+    try:
         if not os.path.isfile(CONFIG_FILENAME):
             raise Exception("ERROR: Config file does not exist.")
 
-        config.read(CONFIG_FILENAME)
+        parser = _read_config_file()
 
-        # Verify section headers.
-        sections = config.sections()
-        if sections != [
-            "INITIALIZATION"
-            ]:
+        # Verify the required section and its keys.
+        if not parser.has_section("INITIALIZATION"):
             raise Exception("ERROR: Config headers incorrect.")
-        
-        time.sleep(random.uniform(0.2,0.6))
-
-        # Defining required keys and any required values.
-        placeholder_sections = [
-                {
-                    'client_id': None,
-                    'client_secret': None,
-                    'scope': None,
-                    'login_name': None,
-                    'tts_reward_title': None
-                }
-        ]
-        
-        
-        # Replace section headers in list with their corresponding section dicts, then validate section keys.
-        for i, section in enumerate(sections):
-            sections[i] = dict(config.items(section))
-            
-            if sections[i].keys() != placeholder_sections[i].keys():
-                raise Exception("ERROR: Config keys incorrect.")
+
+        if set(parser.options("INITIALIZATION")) != set(Initialization_Config._fields):
+            raise Exception("ERROR: Config keys incorrect.")
 
     except Exception as e:
         print(str(e) + "\n")
         generate_config()
 
+    try:
+        _config = _parse_config(parser)
+
+    except Exception as e:
+        print("\n!! Config file invalid !!\n")
+        print(str(e))
+        print("\nPlease fix config.ini and run the program again. Press Enter to close the program.")
+        input()
+        exit()
+
 
 # Generates new config file if there are any issues with the existing config file.
 def generate_config() -> None:
@@ -81,11 +264,9 @@ def generate_config() -> None:
     print('\nIf you plan to use the Text To Speech part of this code, please input the title of your TTS point redemption.')
     tts_reward_title = input()
 
-    print('\nPlease input your desired scope.')
-    print('If you do not know your intended scope, press Enter without any input for the default scope.')
+    print('\nScopes for the events your modules use are requested automatically. Please input any extra scopes you need, separated by spaces.')
+    print('If you do not know your intended scope, press Enter without any input.')
     scope = input()
-    if scope == "":
-        scope = "channel:manage:redemptions moderator:manage:banned_users user:read:chat user:write:chat user:bot channel:manage:predictions bits:read channel:read:charity"
 
     # After requesting input on all optional fields, build the config file.
     config = configparser.RawConfigParser()
@@ -98,6 +279,10 @@ def generate_config() -> None:
         'tts_reward_title': tts_reward_title
         }
 
+    # Module sections are written with their defaults so they are easy to find and change.
+    for field in Config._fields[1:]:
+        config[field.upper()] = {key: str(value) for key, value in Config._field_defaults[field]._asdict().items()}
+
     with open(CONFIG_FILENAME, 'w') as configFile:
         config.write(configFile)
 
@@ -0,0 +1,154 @@
+import time
+import asyncio
+
+from enum import Enum
+
+from utils_metrics import metrics
+
+
+
+######### Enum List #########
+
+
+# Decides how events are handed to module callbacks by the Twitch connection.
+class Dispatch_Mode(Enum):
+
+    # Every callback is awaited one after another on the eventsub callback itself.
+    SERIAL = "serial"
+
+    # Every module gets its own bounded inbox and worker task, so a slow module only delays itself.
+    CONCURRENT = "concurrent"
+
+
+
+# Decides what happens when an event arrives for a module whose inbox is already full.
+class Overflow_Policy(Enum):
+
+    DROP_OLDEST = "drop oldest"
+    DROP_NEWEST = "drop newest"
+    BLOCK = "block"
+
+
+
+#### Bounded queue of pending callbacks for a single module, worked through in order by its own task.
+
+class Module_Inbox(object):
+    def __init__(self, module_name:"str", max_size:"int" = 100, overflow_policy:"Overflow_Policy" = Overflow_Policy.DROP_OLDEST) -> None:
+
+        self.module_name = module_name
+        self.overflow_policy = overflow_policy
+
+        # Items are (callback, data, time queued) so a module receives chat messages and point rewards in the order they arrived.
+        self._queue = asyncio.Queue(max_size)
+        self._worker = None
+
+        # Tracked for diagnostics. Dropped events are counted regardless of which end of the queue they were dropped from.
+        self.dropped = 0
+        self.handled = 0
+
+        self._wait_time = metrics.histogram("module_queue_wait_seconds", "Time an event waits in a module's inbox before it is handled.", module = module_name)
+        self._handle_time = metrics.histogram("module_handle_seconds", "Time a module takes to handle one event.", module = module_name)
+        metrics.gauge("module_inbox_depth", "Events waiting in a module's inbox.", function = self.depth, module = module_name)
+        metrics.counter("module_events_handled_total", "Events handled by a module.", function = lambda: self.handled, module = module_name)
+        metrics.counter("module_events_dropped_total", "Events dropped because a module's inbox was full.", function = lambda: self.dropped, module = module_name)
+
+
+
+    ##### Private Functions
+
+    # Awaits callbacks in order until the inbox is stopped. Exceptions are printed so one bad event can't kill the module's worker.
+    async def _run(self) -> None:
+
+        while True:
+            callback, data, queued_time = await self._queue.get()
+
+            start = time.perf_counter()
+            self._wait_time.observe(start - queued_time)
+
+            try:
+                await callback(data)
+            except Exception as e:
+                print(f"{self.module_name} failed to handle an event. Exception {e}")
+            finally:
+                self._handle_time.observe(time.perf_counter() - start)
+                self.handled += 1
+                self._queue.task_done()
+
+
+
+    ##### Public Functions
+
+    # Returns the number of events currently waiting to be handled.
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+
+    # Places a callback on the inbox according to the overflow policy. Only awaits when the policy is BLOCK and the inbox is full.
+    async def put(self, callback:"function", data) -> None:
+
+        item = (callback, data, time.perf_counter())
+
+        if not self._queue.full():
+            self._queue.put_nowait(item)
+            return
+
+        match self.overflow_policy:
+            case Overflow_Policy.DROP_OLDEST:
+                self._queue.get_nowait()
+                self._queue.task_done()
+                self._queue.put_nowait(item)
+                self.dropped += 1
+
+            case Overflow_Policy.DROP_NEWEST:
+                self.dropped += 1
+
+            case Overflow_Policy.BLOCK:
+                await self._queue.put(item)
+
+
+    # Removes the events still waiting and returns them as (callback, data, time queued), oldest first. Used to hand them to a reloaded module.
+    def take_pending(self) -> list:
+
+        pending = []
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+            self._queue.task_done()
+
+        return pending
+
+
+    # Queues an event taken from another inbox, keeping the time it was first queued. Returns False if the inbox is full.
+    def put_pending(self, callback:"function", data, queued_time:"float") -> bool:
+
+        if self._queue.full():
+            self.dropped += 1
+            return False
+
+        self._queue.put_nowait((callback, data, queued_time))
+        return True
+
+
+    # Starts the worker task. Must be called from inside the running event loop.
+    def start(self) -> None:
+
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+
+    # Stops the worker task. Pending events are discarded, which also frees anything blocked putting into a full inbox.
+    async def stop(self) -> None:
+
+        if self._worker is None:
+            return
+
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+
+        self._worker = None
+
+        while not self._queue.empty():
+            self._queue.get_nowait()
+            self._queue.task_done()
@@ -0,0 +1,311 @@
+import os
+import gzip
+import json
+import time
+import asyncio
+from enum import Enum
+from types import SimpleNamespace
+from datetime import datetime, timezone
+
+# Used for function annotation. Not required at runtime.
+from utils_events import Chat_Message, Point_Redemption
+
+
+
+##############################################################################################
+###############  Records incoming eventsub events to compressed JSON lines     ###############
+###############  logs, and replays them into the Twitch connection, so         ###############
+###############  problems seen on stream can be reproduced offline. Each line  ###############
+###############  is [seconds since recording started, event type, fields].     ###############
+###############  A recording is a folder of parts, rotated by size.            ###############
+##############################################################################################
+
+
+EVENT_LOG_FORMAT = "twitch integration event log"
+EVENT_LOG_VERSION = 1
+
+
+
+class Logged_Event(Enum):
+
+    CHAT = "chat"
+    REDEMPTION = "redemption"
+    SESSION = "session"
+
+
+
+# Builds a stand-in for eventsub's ChannelChatMessageEvent with the fields the connection reads, under the same names.
+def make_chat_message_event(message_id:"str", text:"str", user_id:"str", user_name:"str", timestamp:"float" = 0.0) -> SimpleNamespace:
+    return SimpleNamespace(
+        event = SimpleNamespace(
+            message_id = message_id,
+            message = SimpleNamespace(text = text),
+            chatter_user_id = user_id,
+            chatter_user_name = user_name
+        ),
+        metadata = SimpleNamespace(message_timestamp = datetime.fromtimestamp(timestamp, timezone.utc))
+    )
+
+
+# Builds a stand-in for eventsub's ChannelPointsCustomRewardRedemptionAddEvent with the fields the connection reads, under the same names.
+def make_redemption_event(redemption_id:"str", user_id:"str", user_name:"str", user_input:"str", reward_title:"str", timestamp:"float" = 0.0) -> SimpleNamespace:
+    return SimpleNamespace(event = SimpleNamespace(
+        id = redemption_id,
+        user_id = user_id,
+        user_name = user_name,
+        user_input = user_input,
+        reward = SimpleNamespace(title = reward_title),
+        redeemed_at = datetime.fromtimestamp(timestamp, timezone.utc)
+    ))
+
+
+
+#### Opt-in recorder for the Twitch connection. Recording an event only appends it to a list; a background task
+#### turns batches into JSON and writes them on a worker thread. Parts are flushed per batch, never fsynced.
+
+class Event_Recorder(object):
+    def __init__(self, directory:"str" = "event_logs", max_part_bytes:"int" = 16 * 1024 * 1024, flush_interval:"float" = 1.0, max_buffered_events:"int" = 100000) -> None:
+
+        # Every recording gets its own folder, named after the time it started.
+        self._directory = directory
+        self.recording_path = None
+        self._max_part_bytes = max_part_bytes
+        self._part_index = 0
+        self._raw_file = None
+        self._file = None
+
+        # Events waiting to be written, as (monotonic seconds since start, Logged_Event, event). Events past the limit are dropped and counted.
+        self._buffer = []
+        self._max_buffered_events = max_buffered_events
+        self._flush_interval = flush_interval
+
+        # The writer only wakes when the buffer goes from empty to holding an event, so an idle recorder costs nothing.
+        self._pending = asyncio.Event()
+        self._stopping = asyncio.Event()
+        self._running = False
+        self._start_time = 0.0
+        self._task = None
+
+        self.recorded = 0
+        self.dropped = 0
+
+
+
+    ##### Private Functions
+
+    async def _run(self) -> None:
+
+        while True:
+            await self._pending.wait()
+            self._pending.clear()
+
+            # Gives events a moment to gather into one batch. Stopping cuts the wait short.
+            if self._running:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout = self._flush_interval)
+                except TimeoutError:
+                    pass
+
+            batch, self._buffer = self._buffer, []
+            if batch:
+                await asyncio.to_thread(self._write_batch, batch)
+
+            if not self._running:
+                break
+
+        await asyncio.to_thread(self._close_part)
+
+
+    # Only runs on the worker thread.
+    def _write_batch(self, batch:"list") -> None:
+
+        lines = []
+        for timestamp, event_type, event in batch:
+            try:
+                lines.append(json.dumps([round(timestamp, 6), event_type.value, self._to_fields(event_type, event)], separators = (",", ":")))
+            except Exception as e:
+                print(f"Event recorder could not serialize a {event_type.value} event. Exception {e}")
+
+        if self._file is None or self._raw_file.tell() >= self._max_part_bytes:
+            self._open_next_part()
+
+        self._file.write(("\n".join(lines) + "\n").encode("utf-8"))
+
+        # A sync flush ends the compressed block, so everything up to the last batch can be read back after a crash.
+        self._file.flush()
+
+
+    def _to_fields(self, event_type:"Logged_Event", event) -> dict:
+
+        match event_type:
+            case Logged_Event.CHAT:
+                return {"id": event.message_id, "text": event.raw_text, "user_id": event.user_id, "user_name": event.user_name, "timestamp": event.timestamp}
+
+            case Logged_Event.REDEMPTION:
+                return {"id": event.redemption_id, "user_id": event.user_id, "user_name": event.user_name, "user_input": event.user_input, "reward_title": event.reward_title, "timestamp": event.timestamp}
+
+            case Logged_Event.SESSION:
+                return event
+
+
+    def _open_next_part(self) -> None:
+
+        self._close_part()
+
+        part_path = os.path.join(self.recording_path, f"part-{self._part_index:04d}.jsonl.gz")
+        self._part_index += 1
+
+        self._raw_file = open(part_path, "wb")
+        self._file = gzip.GzipFile(fileobj = self._raw_file, mode = "wb")
+
+        header = {"format": EVENT_LOG_FORMAT, "version": EVENT_LOG_VERSION, "part": self._part_index - 1}
+        self._file.write((json.dumps(header) + "\n").encode("utf-8"))
+
+
+    def _close_part(self) -> None:
+
+        if self._file is not None:
+            self._file.close()
+            self._raw_file.close()
+            self._file = None
+            self._raw_file = None
+
+
+
+    ##### Public Functions
+
+    # Starts a new recording. Must be called from inside the running event loop.
+    def start(self) -> None:
+
+        if self._task is not None:
+            return
+
+        self.recording_path = os.path.join(self._directory, time.strftime("%Y%m%d-%H%M%S"))
+        os.makedirs(self.recording_path, exist_ok = True)
+
+        self._running = True
+        self._start_time = time.monotonic()
+        self._task = asyncio.create_task(self._run())
+
+        print(f"Recording events to {self.recording_path}")
+
+
+    # Adds an event to the recording. Chat events take the connection's Chat_Message, redemptions its Point_Redemption and session events a dict.
+    def record(self, event_type:"Logged_Event", event:"Chat_Message | Point_Redemption | dict") -> None:
+
+        if not self._running:
+            return
+
+        if len(self._buffer) >= self._max_buffered_events:
+            self.dropped += 1
+            return
+
+        if not self._buffer:
+            self._pending.set()
+
+        self._buffer.append((time.monotonic() - self._start_time, event_type, event))
+        self.recorded += 1
+
+
+    # Writes everything still buffered and closes the recording.
+    async def stop(self) -> None:
+
+        if self._task is None:
+            return
+
+        self._running = False
+        self._stopping.set()
+        self._pending.set()
+        await self._task
+        self._task = None
+
+        print(f"Recorded {self.recorded} events to {self.recording_path}. Dropped {self.dropped}.")
+
+
+
+#### Reads a recording back and feeds it into a Twitch connection's eventsub callbacks, at recorded speed, N times faster or as fast as possible.
+
+class Event_Replayer(object):
+    def __init__(self, recording_path:"str") -> None:
+
+        # Either a recording folder, whose parts are replayed in order, or a single part.
+        if os.path.isdir(recording_path):
+            self._part_paths = sorted(os.path.join(recording_path, file_name) for file_name in os.listdir(recording_path) if file_name.endswith(".jsonl.gz"))
+        else:
+            self._part_paths = [recording_path]
+
+
+
+    ##### Private Functions
+
+    def _to_event(self, event_type:"Logged_Event", fields:"dict"):
+
+        match event_type:
+            case Logged_Event.CHAT:
+                return make_chat_message_event(fields["id"], fields["text"], fields["user_id"], fields["user_name"], fields.get("timestamp", 0.0))
+
+            case Logged_Event.REDEMPTION:
+                return make_redemption_event(fields["id"], fields["user_id"], fields["user_name"], fields["user_input"], fields["reward_title"], fields.get("timestamp", 0.0))
+
+            case Logged_Event.SESSION:
+                return fields
+
+
+
+    ##### Public Functions
+
+    # Yields (seconds since recording started, Logged_Event, event) for every recorded event, with chat and redemptions rebuilt as eventsub stand-ins.
+    # A part cut off by a crash is read up to its last complete batch.
+    def read_events(self):
+
+        for part_path in self._part_paths:
+            with gzip.open(part_path, "rt", encoding = "utf-8") as part:
+                try:
+                    for line in part:
+                        entry = json.loads(line)
+
+                        # Each part starts with a header object. Events are lists.
+                        if isinstance(entry, dict):
+                            if entry.get("format") != EVENT_LOG_FORMAT or entry.get("version") != EVENT_LOG_VERSION:
+                                raise Exception(f"{part_path} is not a version {EVENT_LOG_VERSION} event log.")
+                            continue
+
+                        timestamp, event_type, fields = entry
+                        event_type = Logged_Event(event_type)
+                        yield timestamp, event_type, self._to_event(event_type, fields)
+
+                except (EOFError, json.JSONDecodeError):
+                    print(f"{part_path} ends early, likely from a crash. Replaying what was written.")
+
+
+    # Feeds recorded chat and redemptions into the connection. A speed of 2 replays twice as fast; 0 replays as fast as possible.
+    # Returns the number of events replayed.
+    async def replay(self, connection, speed:"float" = 1.0) -> int:
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        first_timestamp = None
+        replayed = 0
+
+        for timestamp, event_type, event in self.read_events():
+            if event_type == Logged_Event.SESSION:
+                continue
+
+            if first_timestamp is None:
+                first_timestamp = timestamp
+
+            if speed > 0:
+                delay = start + (timestamp - first_timestamp) / speed - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            else:
+                await asyncio.sleep(0)
+
+            if event_type == Logged_Event.CHAT:
+                await connection._on_chat_message(event)
+            else:
+                await connection._on_point_redemption(event)
+
+            replayed += 1
+
+        return replayed
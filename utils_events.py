@@ -0,0 +1,138 @@
+import string
+
+from enum import Enum
+from typing import NamedTuple
+
+from twitchAPI.object.eventsub import ChannelChatMessageEvent, ChannelPointsCustomRewardRedemptionAddEvent, ChannelCheerEvent, CharityDonationEvent, ChannelPredictionEvent, ChannelPredictionEndEvent
+
+
+
+# Built once at import so normalizing a message never rebuilds the translation table.
+_PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation)
+
+
+# Lowercases text, strips punctuation and collapses whitespace so "Meow!!" and "  meow " both match the "meow" command.
+def normalize_text(text:"str") -> str:
+    return " ".join(text.lower().translate(_PUNCTUATION_TABLE).split())
+
+
+
+#### Event records. The Twitch connection turns each eventsub event into one of these as soon as it arrives, keeping only the fields
+#### modules use. Inboxes, queues and recordings hold the record, and the full eventsub object is freed straight away.
+#### Records are named tuples, which have empty __slots__, so each one is a single small tuple with no instance dict.
+
+# Immutable chat message record, normalized once and shared by every module that receives it.
+class Chat_Message(NamedTuple):
+
+    text: str
+    raw_text: str
+    user_id: str
+    user_name: str
+
+    # Twitch's id for the message, used to follow a message through dispatch. Empty for messages built outside eventsub.
+    message_id: str = ""
+
+    # When Twitch sent the message, in seconds since the epoch. 0 for messages built outside eventsub.
+    timestamp: float = 0.0
+
+    # Normalized text of the message sent to the channel just before this one, whether or not it was a command or reached any module.
+    previous_text: str = ""
+
+
+    # Builds a record from an eventsub chat message event.
+    @classmethod
+    def from_event(cls, chat_message:"ChannelChatMessageEvent", previous_text:"str" = "") -> "Chat_Message":
+
+        event = chat_message.event
+        return cls(normalize_text(event.message.text), event.message.text, event.chatter_user_id, event.chatter_user_name, event.message_id, chat_message.metadata.message_timestamp.timestamp(), previous_text)
+
+
+# Immutable channel point redemption record.
+class Point_Redemption(NamedTuple):
+
+    reward_title: str
+    user_input: str
+    user_id: str
+    user_name: str
+
+    # Twitch's id for the redemption. Empty for redemptions built outside eventsub.
+    redemption_id: str = ""
+
+    # When the reward was redeemed, in seconds since the epoch. 0 for redemptions built outside eventsub.
+    timestamp: float = 0.0
+
+
+    # Builds a record from an eventsub channel point redemption event.
+    @classmethod
+    def from_event(cls, point_reward:"ChannelPointsCustomRewardRedemptionAddEvent") -> "Point_Redemption":
+
+        event = point_reward.event
+        return cls(event.reward.title, event.user_input, event.user_id, event.user_name, event.id, event.redeemed_at.timestamp())
+
+
+
+#### Event types modules can handle. Modules declare theirs with get_event_types(), and the Twitch connection only subscribes to
+#### the types some module handles. A new event type is added here and in EVENT_CAPABILITIES, and nowhere else.
+
+class Event_Type(Enum):
+
+    CHAT = "chat"
+    REDEMPTION = "redemption"
+    CHEER = "cheer"
+    CHARITY = "charity"
+    PREDICTION = "prediction"
+
+
+
+# One eventsub subscription. Every condition key is filled with the broadcaster's user id, and payloads are wrapped in event_class.
+class Capability_Subscription(NamedTuple):
+
+    type: str
+    version: str
+    condition_keys: tuple
+    event_class: type
+
+
+# What the Twitch connection needs to deliver one event type: the module method that handles it, what to subscribe to and the scopes that requires.
+class Event_Capability(NamedTuple):
+
+    handler_name: str
+    subscriptions: tuple
+    scopes: tuple
+
+
+EVENT_CAPABILITIES = {
+    Event_Type.CHAT: Event_Capability("handle_chat_message",
+        (Capability_Subscription("channel.chat.message", "1", ("broadcaster_user_id", "user_id"), ChannelChatMessageEvent),),
+        ("user:read:chat",)),
+
+    Event_Type.REDEMPTION: Event_Capability("handle_point_reward",
+        (Capability_Subscription("channel.channel_points_custom_reward_redemption.add", "1", ("broadcaster_user_id",), ChannelPointsCustomRewardRedemptionAddEvent),),
+        ("channel:read:redemptions",)),
+
+    Event_Type.CHEER: Event_Capability("handle_cheer",
+        (Capability_Subscription("channel.cheer", "1", ("broadcaster_user_id",), ChannelCheerEvent),),
+        ("bits:read",)),
+
+    Event_Type.CHARITY: Event_Capability("handle_charity_donation",
+        (Capability_Subscription("channel.charity_campaign.donate", "1", ("broadcaster_user_id",), CharityDonationEvent),),
+        ("channel:read:charity",)),
+
+    # Predictions are one event type for modules, which can tell the stages apart by the subscription type in the event.
+    Event_Type.PREDICTION: Event_Capability("handle_prediction",
+        (Capability_Subscription("channel.prediction.begin", "1", ("broadcaster_user_id",), ChannelPredictionEvent),
+         Capability_Subscription("channel.prediction.progress", "1", ("broadcaster_user_id",), ChannelPredictionEvent),
+         Capability_Subscription("channel.prediction.lock", "1", ("broadcaster_user_id",), ChannelPredictionEvent),
+         Capability_Subscription("channel.prediction.end", "1", ("broadcaster_user_id",), ChannelPredictionEndEvent)),
+        ("channel:read:predictions",))
+}
+
+
+# Returns the event types a module handles. Modules without get_event_types() handle every type they have a handler method for.
+def get_module_event_types(module) -> list:
+
+    get_event_types = getattr(module, "get_event_types", None)
+    if callable(get_event_types):
+        return list(get_event_types())
+
+    return [event_type for event_type, capability in EVENT_CAPABILITIES.items() if callable(getattr(module, capability.handler_name, None))]
@@ -0,0 +1,432 @@
+import json
+import asyncio
+import aiohttp
+from enum import Enum
+from typing import NamedTuple
+from collections import OrderedDict
+
+from utils_clock import Clock, real_clock
+from utils_metrics import metrics
+
+from utils_event_log import Event_Recorder, Logged_Event
+
+
+
+##############################################################################################
+###############  Supervises the eventsub websocket session. Follows Twitch's   ###############
+###############  session_reconnect handoff without dropping events, holding    ###############
+###############  events from the new connection until the old one is done.     ###############
+###############  Reconnects and subscribes again if the connection is lost,    ###############
+###############  and drops redelivered events by message id, so a redemption   ###############
+###############  is never handled twice.                                       ###############
+##############################################################################################
+
+
+EVENTSUB_URL = "wss://eventsub.wss.twitch.tv/ws"
+SUBSCRIPTION_URL = "https://api.twitch.tv/helix/eventsub/subscriptions"
+
+# Twitch sends a keepalive when no event has been sent for this long. Missing one by more than the grace period means the connection is dead.
+DEFAULT_KEEPALIVE_SECONDS = 10
+KEEPALIVE_GRACE_SECONDS = 5
+
+# How long a new connection has to send its welcome, and how long the old connection has to close after a handoff.
+WELCOME_TIMEOUT_SECONDS = 10
+HANDOFF_TIMEOUT_SECONDS = 5
+
+
+
+class Message_Type(Enum):
+
+    SESSION_WELCOME = "session_welcome"
+    NOTIFICATION = "notification"
+    SESSION_KEEPALIVE = "session_keepalive"
+    SESSION_RECONNECT = "session_reconnect"
+    REVOCATION = "revocation"
+
+
+
+# One eventsub subscription. The handler is awaited with the notification payload: {"subscription", "event", "metadata"}.
+class EventSub_Subscription(NamedTuple):
+
+    type: str
+    version: str
+    condition: dict
+    handler: "function"
+
+
+
+#### Remembers recently delivered message ids. An id is forgotten once it is older than the window or the oldest of more than max_size ids.
+#### Twitch redelivers with the same message id, and redeliveries come within seconds, so the window only needs to outlast them.
+
+class Event_Deduplicator(object):
+    def __init__(self, max_size:"int" = 10000, window_seconds:"float" = 600, clock:"Clock" = None) -> None:
+
+        self._max_size = max_size
+        self._window_seconds = window_seconds
+        self._clock = clock if clock is not None else real_clock
+
+        # Message ids in the order they were first seen, with the time they were seen.
+        self._seen = OrderedDict()
+
+
+    # Returns True if the id was already seen within the window. Otherwise remembers it and returns False.
+    def is_duplicate(self, message_id:"str") -> bool:
+
+        now = self._clock.now()
+
+        # Ids are kept in arrival order, so expired ids are always at the front.
+        while self._seen and (len(self._seen) >= self._max_size or now - next(iter(self._seen.values())) > self._window_seconds):
+            self._seen.popitem(last = False)
+
+        if message_id in self._seen:
+            return True
+
+        self._seen[message_id] = now
+        return False
+
+
+
+#### One websocket connection and the messages read from it, in order. None is queued once the connection is closed or dead.
+
+class _EventSub_Connection(object):
+    def __init__(self, websocket:"aiohttp.ClientWebSocketResponse") -> None:
+
+        self.websocket = websocket
+        self.session_id = None
+        self.keepalive_seconds = DEFAULT_KEEPALIVE_SECONDS
+        self.messages = asyncio.Queue()
+        self._reader = asyncio.create_task(self._read())
+
+
+    async def _read(self) -> None:
+
+        try:
+            while True:
+                message = await asyncio.wait_for(self.websocket.receive(), timeout = self.keepalive_seconds + KEEPALIVE_GRACE_SECONDS)
+
+                if message.type == aiohttp.WSMsgType.TEXT:
+                    self.messages.put_nowait(json.loads(message.data))
+                elif message.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSING, aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                    return
+
+        except TimeoutError:
+            print(f"Eventsub session {self.session_id} missed its keepalive. Treating the connection as lost.")
+
+        except (aiohttp.ClientError, json.JSONDecodeError) as e:
+            print(f"Eventsub session {self.session_id} failed. Exception {e}")
+
+        finally:
+            self.messages.put_nowait(None)
+
+
+    async def close(self) -> None:
+
+        await self.websocket.close()
+        await self._reader
+
+
+
+#### Stream-long owner of the eventsub session. Run with run() and stop with stop().
+
+class EventSub_Supervisor(object):
+    def __init__(self, subscriptions:"list", get_request_headers:"function", connection_url:"str" = EVENTSUB_URL, subscription_url:"str" = SUBSCRIPTION_URL,
+                 reconnect_delays:"tuple" = (0, 1, 2, 4, 8, 16, 30), deduplicator:"Event_Deduplicator" = None, event_recorder:"Event_Recorder" = None) -> None:
+
+        # Subscriptions are created again on every new session, since Twitch drops them with the session they were made on. Handoffs keep them.
+        self._subscriptions = subscriptions
+        self._handlers = {subscription.type: subscription.handler for subscription in subscriptions}
+        self._get_request_headers = get_request_headers
+
+        self._connection_url = connection_url
+        self._subscription_url = subscription_url
+
+        # Seconds to wait before each attempt to reconnect after the connection is lost. The last delay repeats until it succeeds.
+        self._reconnect_delays = reconnect_delays
+
+        self._deduplicator = deduplicator if deduplicator is not None else Event_Deduplicator()
+        self._event_recorder = event_recorder
+
+        self._http = None
+        self._connections = set()
+        self._stop_event = asyncio.Event()
+        self.session_id = None
+
+        self._reconnects = {reason: metrics.counter("eventsub_reconnects_total", "Eventsub reconnects, by whether Twitch asked for a handoff or the connection was lost.", reason = reason) for reason in ("handoff", "lost")}
+        self._duplicates = metrics.counter("eventsub_duplicates_total", "Redelivered eventsub notifications that were dropped.")
+        self._revocations = metrics.counter("eventsub_revocations_total", "Eventsub subscriptions revoked by Twitch.")
+        self._handoff_time = metrics.histogram("eventsub_handoff_seconds", "Time from a session_reconnect message until the new connection takes over.")
+
+
+
+    ##### Private Functions
+
+    def _record_session(self, state:"str") -> None:
+
+        if self._event_recorder is not None:
+            self._event_recorder.record(Logged_Event.SESSION, {"state": state, "session_id": self.session_id})
+
+
+    # Connects and waits for the session welcome. Raises if the connection fails or doesn't welcome in time.
+    async def _open(self, url:"str") -> _EventSub_Connection:
+
+        connection = _EventSub_Connection(await self._http.ws_connect(url))
+        self._connections.add(connection)
+
+        try:
+            message = await asyncio.wait_for(connection.messages.get(), timeout = WELCOME_TIMEOUT_SECONDS)
+            if message is None or message["metadata"]["message_type"] != Message_Type.SESSION_WELCOME.value:
+                raise Exception(f"Expected a session welcome from {url}, got {message}")
+
+        except BaseException:
+            await self._close(connection)
+            raise
+
+        session = message["payload"]["session"]
+        connection.session_id = session["id"]
+        connection.keepalive_seconds = session.get("keepalive_timeout_seconds") or DEFAULT_KEEPALIVE_SECONDS
+        return connection
+
+
+    async def _close(self, connection:"_EventSub_Connection") -> None:
+
+        self._connections.discard(connection)
+        await connection.close()
+
+
+    # Opens a new session, waiting between attempts. Returns None if stopped first.
+    async def _connect(self) -> "_EventSub_Connection | None":
+
+        attempt = 0
+        while not self._stop_event.is_set():
+
+            delay = self._reconnect_delays[min(attempt, len(self._reconnect_delays) - 1)]
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._stop_event.wait(), timeout = delay)
+                    return None
+                except TimeoutError:
+                    pass
+
+            attempt += 1
+            try:
+                connection = await self._open(self._connection_url)
+            except Exception as e:
+                print(f"Could not connect to eventsub. Retrying. Exception {e}")
+                continue
+
+            try:
+                await self._subscribe(connection.session_id)
+            except Exception as e:
+                print(f"Could not subscribe to eventsub events. Retrying. Exception {e}")
+                await self._close(connection)
+                continue
+
+            # stop() only closes connections it knows about, so one still being opened when it was called is closed here.
+            if self._stop_event.is_set():
+                await self._close(connection)
+                return None
+
+            return connection
+
+        return None
+
+
+    async def _subscribe(self, session_id:"str") -> None:
+
+        headers = await self._get_request_headers()
+
+        for subscription in self._subscriptions:
+            data = {
+                "type": subscription.type,
+                "version": subscription.version,
+                "condition": subscription.condition,
+                "transport": {"method": "websocket", "session_id": session_id}
+            }
+
+            async with self._http.post(self._subscription_url, json = data, headers = headers) as response:
+                if response.status >= 400:
+                    raise Exception(f"Subscribing to {subscription.type} failed with {response.status}: {await response.text()}")
+
+
+    async def _handle_notification(self, message:"dict") -> None:
+
+        if self._deduplicator.is_duplicate(message["metadata"]["message_id"]):
+            self._duplicates.inc()
+            return
+
+        payload = message["payload"]
+        payload["metadata"] = message["metadata"]
+
+        handler = self._handlers.get(payload["subscription"]["type"])
+        if handler is None:
+            return
+
+        try:
+            await handler(payload)
+        except Exception as e:
+            print(f"Eventsub handler for {payload['subscription']['type']} failed. Exception {e}")
+
+
+    # Returns the next message from the connection, or None once it is closed or the supervisor is stopped.
+    # A connection a handoff was still opening when stop() was called is never closed by it, so reads also end on the stop event.
+    async def _next_message(self, connection:"_EventSub_Connection") -> "dict | None":
+
+        if not connection.messages.empty():
+            return connection.messages.get_nowait()
+
+        get_task = asyncio.create_task(connection.messages.get())
+        stop_task = asyncio.create_task(self._stop_event.wait())
+        done, _ = await asyncio.wait({get_task, stop_task}, return_when = asyncio.FIRST_COMPLETED)
+
+        if get_task in done:
+            stop_task.cancel()
+            return get_task.result()
+
+        get_task.cancel()
+        return None
+
+
+    # Handles one message from the current connection. Returns the connection to read from next.
+    async def _handle_message(self, connection:"_EventSub_Connection", message:"dict") -> _EventSub_Connection:
+
+        match message["metadata"]["message_type"]:
+
+            case Message_Type.NOTIFICATION.value:
+                await self._handle_notification(message)
+
+            case Message_Type.SESSION_RECONNECT.value:
+                return await self._handoff(connection, message["payload"]["session"]["reconnect_url"])
+
+            case Message_Type.REVOCATION.value:
+                self._revocations.inc()
+                subscription = message["payload"]["subscription"]
+                print(f"Twitch revoked the {subscription['type']} subscription: {subscription['status']}. Those events will stop until the program is restarted.")
+
+        return connection
+
+
+    # Stops opening a connection that is no longer needed, closing it if it already opened.
+    async def _abandon_open(self, open_task:"asyncio.Task") -> None:
+
+        open_task.cancel()
+        await asyncio.wait({open_task})
+
+        if not open_task.cancelled() and open_task.exception() is None:
+            await self._close(open_task.result())
+
+
+    # Moves to the connection Twitch asked for. Events from the old connection keep being delivered while the new one connects.
+    # The new connection's events wait in its queue until the old connection is done, so events stay in order.
+    # If the new connection fails, the old one is kept. Twitch will close it, and the session is rebuilt as if it was lost.
+    async def _handoff(self, old_connection:"_EventSub_Connection", reconnect_url:"str") -> _EventSub_Connection:
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        open_task = asyncio.create_task(self._open(reconnect_url))
+        old_closed = False
+
+        while not open_task.done():
+            get_task = asyncio.create_task(old_connection.messages.get())
+            done, _ = await asyncio.wait({open_task, get_task}, return_when = asyncio.FIRST_COMPLETED)
+
+            if get_task not in done:
+                get_task.cancel()
+                continue
+
+            message = get_task.result()
+            if message is None:
+                old_closed = True
+                await asyncio.wait({open_task})
+                break
+
+            # Another session_reconnect on the old connection moves straight to the newer connection, so this one isn't needed.
+            next_connection = await self._handle_message(old_connection, message)
+            if next_connection is not old_connection:
+                await self._abandon_open(open_task)
+                return next_connection
+
+        try:
+            new_connection = open_task.result()
+        except Exception as e:
+            print(f"Could not move to the new eventsub connection. Exception {e}")
+            if old_closed:
+                old_connection.messages.put_nowait(None)
+            return old_connection
+
+        # Twitch closes the old connection once the new one is welcomed. Anything it sent before closing is still delivered first.
+        while not old_closed:
+            try:
+                message = await asyncio.wait_for(old_connection.messages.get(), timeout = HANDOFF_TIMEOUT_SECONDS)
+            except TimeoutError:
+                break
+
+            if message is None:
+                break
+
+            next_connection = await self._handle_message(old_connection, message)
+            if next_connection is not old_connection:
+                await self._close(new_connection)
+                return next_connection
+
+        await self._close(old_connection)
+
+        self.session_id = new_connection.session_id
+        self._reconnects["handoff"].inc()
+        self._handoff_time.observe(loop.time() - start)
+        self._record_session("handoff")
+
+        return new_connection
+
+
+
+    ##### Public Functions
+
+    # Returns True once a session is subscribed and delivering events.
+    def is_connected(self) -> bool:
+        return self.session_id is not None
+
+
+    async def stop(self) -> None:
+
+        self._stop_event.set()
+        for connection in list(self._connections):
+            await self._close(connection)
+
+
+    # Keeps a session running until stopped, reconnecting whenever it is lost.
+    async def run(self) -> None:
+
+        self._http = aiohttp.ClientSession()
+
+        try:
+            while not self._stop_event.is_set():
+
+                connection = await self._connect()
+                if connection is None:
+                    break
+
+                self.session_id = connection.session_id
+                self._record_session("subscribed")
+                print(f"Eventsub session {self.session_id} subscribed.")
+
+                # Delivers events in the order they arrived until the connection is closed or dies.
+                while True:
+                    message = await self._next_message(connection)
+                    if message is None:
+                        break
+
+                    connection = await self._handle_message(connection, message)
+
+                await self._close(connection)
+                self.session_id = None
+
+                if not self._stop_event.is_set():
+                    self._reconnects["lost"].inc()
+                    self._record_session("lost")
+                    print("Eventsub connection lost. Reconnecting...")
+
+        finally:
+            for connection in list(self._connections):
+                await self._close(connection)
+
+            await self._http.close()
@@ -8,6 +8,10 @@ class Hotkey_Manager(object):
 
         self._hotkey_dict = {}
 
+        # Keyboard handles and (function, args) of every hotkey by name, so one hotkey can be removed without touching others on the same keys.
+        self._hotkey_handles = {}
+        self._hotkey_callbacks = {}
+
     def create_hotkey(self, hotkey_name:"str", hotkey_keys:"str", func:"function", force_assignment:"bool" = False, *args) -> bool:
         
         successful_assignment = True
@@ -35,7 +39,8 @@ class Hotkey_Manager(object):
                     print('{:<20}  |  {:<25}'.format(k,v))
 
 
-        keyboard.add_hotkey(hotkey_keys, func, *args)
+        self._hotkey_handles[hotkey_name] = keyboard.add_hotkey(hotkey_keys, func, args)
+        self._hotkey_callbacks[hotkey_name] = (func, args)
         if hotkey_name not in self._hotkey_dict.keys() or hotkey_keys != self._hotkey_dict.get(hotkey_name):
             self._hotkey_dict[hotkey_name] = hotkey_keys
         return successful_assignment
@@ -43,13 +48,20 @@ class Hotkey_Manager(object):
 
     def remove_hotkey(self, hotkey_name:"str") -> None:
 
-        hotkey_keys = self._hotkey_dict.get(hotkey_name)
-        keyboard.remove_hotkey(hotkey_keys)
+        keyboard.remove_hotkey(self._hotkey_handles.pop(hotkey_name))
+        self._hotkey_callbacks.pop(hotkey_name)
         self._hotkey_dict.pop(hotkey_name)
 
     def remove_all_hotkeys(self) -> None:
 
         keyboard.remove_all_hotkeys()
+        self._hotkey_handles.clear()
+        self._hotkey_callbacks.clear()
+        self._hotkey_dict.clear()
 
     def get_hotkey_dict(self) -> dict:
-        return self._hotkey_dict
\ No newline at end of file
+        return self._hotkey_dict
+
+    # Returns (function, args) of a hotkey, so it can be created again after being removed.
+    def get_hotkey_callback(self, hotkey_name:"str") -> tuple:
+        return self._hotkey_callbacks.get(hotkey_name)
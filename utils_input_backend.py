@@ -0,0 +1,264 @@
+import asyncio
+import threading
+from collections import deque
+from enum import Enum
+
+from utils_clock import Clock, real_clock
+
+
+
+##############################################################################################
+###############  Injects mouse and keyboard input from its own thread, so the  ###############
+###############  event loop never blocks on input injection. Callers only      ###############
+###############  append events to a queue. Relative mouse moves waiting in the ###############
+###############  queue are merged into one injection per frame.                ###############
+##############################################################################################
+
+
+
+class Input_Event(Enum):
+
+    MOVE = "move"
+    MOUSE_DOWN = "mouse down"
+    MOUSE_UP = "mouse up"
+    RIGHT_CLICK = "right click"
+    KEY_DOWN = "key down"
+    KEY_UP = "key up"
+    KEY_TAP = "key tap"
+
+
+
+#### Base class for input backends. Subclasses only implement the _inject functions, which always run on the backend thread.
+
+class Input_Backend(object):
+    def __init__(self, frame_interval:"float" = 0.02, clock:"Clock" = None) -> None:
+
+        self._clock = clock if clock is not None else real_clock
+
+        # deque appends and pops are atomic, so the event loop can add events while the backend thread drains them without a lock.
+        self._events = deque()
+        self._wake = threading.Event()
+
+        # After a move is injected the thread waits one frame, so moves arriving in the meantime are merged into the next injection.
+        self._frame_interval = frame_interval
+
+        self._running = False
+        self._thread = None
+
+        self.injected_moves = 0
+        self.merged_moves = 0
+
+
+
+    ##### Private Functions
+
+    def _run(self) -> None:
+
+        while self._running:
+            self._wake.wait()
+            self._wake.clear()
+
+            if self._drain():
+                self._clock.sleep_blocking(self._frame_interval)
+
+        # Events queued while the thread was sleeping or being stopped, like key releases on shutdown, are still injected.
+        self._drain()
+
+
+    # Injects the queue in order, merging each run of consecutive relative moves into a single move. Returns True if a move was injected.
+    def _drain(self) -> bool:
+
+        moved = False
+        pending_x = 0
+        pending_y = 0
+        pending_count = 0
+
+        while self._events:
+            event, args = self._events.popleft()
+
+            if event == Input_Event.MOVE:
+                pending_x += args[0]
+                pending_y += args[1]
+                pending_count += 1
+                continue
+
+            # Any other event flushes the merged move first so ordering is kept.
+            if pending_count:
+                self._flush_move(pending_x, pending_y, pending_count)
+                moved = True
+                pending_x = pending_y = pending_count = 0
+
+            self._inject(event, args)
+
+        if pending_count:
+            self._flush_move(pending_x, pending_y, pending_count)
+            moved = True
+
+        return moved
+
+
+    def _flush_move(self, x:"int", y:"int", count:"int") -> None:
+
+        self.injected_moves += 1
+        self.merged_moves += count - 1
+
+        if not (x or y):
+            return
+
+        # A failed move must not end the thread, or every event after it would be queued and never injected.
+        try:
+            self._inject_move(x, y)
+        except Exception as e:
+            print(f"Input backend failed to inject {Input_Event.MOVE.value}. Exception {e}")
+
+
+    def _inject(self, event:"Input_Event", args:"tuple") -> None:
+
+        try:
+            match event:
+                case Input_Event.MOUSE_DOWN:
+                    self._inject_mouse_button("left", True)
+                case Input_Event.MOUSE_UP:
+                    self._inject_mouse_button("left", False)
+                case Input_Event.RIGHT_CLICK:
+                    self._inject_mouse_button("right", True)
+                    self._inject_mouse_button("right", False)
+                case Input_Event.KEY_DOWN:
+                    self._inject_key(args[0], True)
+                case Input_Event.KEY_UP:
+                    self._inject_key(args[0], False)
+                case Input_Event.KEY_TAP:
+                    # Sleeping here only holds up the backend thread, never the event loop.
+                    self._inject_key(args[0], True)
+                    self._clock.sleep_blocking(args[1])
+                    self._inject_key(args[0], False)
+        except Exception as e:
+            print(f"Input backend failed to inject {event.value}. Exception {e}")
+
+
+    def _put(self, event:"Input_Event", args:"tuple" = ()) -> None:
+        self._events.append((event, args))
+        self._wake.set()
+
+
+    def _inject_move(self, x:"int", y:"int") -> None:
+        raise NotImplementedError
+
+
+    def _inject_mouse_button(self, button:"str", down:"bool") -> None:
+        raise NotImplementedError
+
+
+    def _inject_key(self, key_code:"int", down:"bool") -> None:
+        raise NotImplementedError
+
+
+
+    ##### Public Functions
+
+    def start(self) -> None:
+
+        if self._thread is not None:
+            return
+
+        self._running = True
+        self._thread = threading.Thread(target = self._run, name = type(self).__name__, daemon = True)
+        self._thread.start()
+
+
+    # Stops the backend thread once it has injected everything already queued. Waits for it off the event loop.
+    async def stop(self) -> None:
+
+        if self._thread is None:
+            return
+
+        self._running = False
+        self._wake.set()
+        await asyncio.to_thread(self._thread.join, 1)
+        self._thread = None
+
+
+    def move_relative(self, x:"int", y:"int") -> None:
+        self._put(Input_Event.MOVE, (x, y))
+
+
+    def mouse_down(self) -> None:
+        self._put(Input_Event.MOUSE_DOWN)
+
+
+    def mouse_up(self) -> None:
+        self._put(Input_Event.MOUSE_UP)
+
+
+    def right_click(self) -> None:
+        self._put(Input_Event.RIGHT_CLICK)
+
+
+    def key_down(self, key_code:"int") -> None:
+        self._put(Input_Event.KEY_DOWN, (key_code,))
+
+
+    def key_up(self, key_code:"int") -> None:
+        self._put(Input_Event.KEY_UP, (key_code,))
+
+
+    # Holds a key for the given number of seconds on the backend thread.
+    def tap_key(self, key_code:"int", seconds:"float") -> None:
+        self._put(Input_Event.KEY_TAP, (key_code, seconds))
+
+
+
+#### Injects input into games through DirectInput. Windows only.
+
+class Direct_Input_Backend(Input_Backend):
+    def __init__(self, frame_interval:"float" = 0.02, clock:"Clock" = None) -> None:
+        super().__init__(frame_interval, clock)
+
+        # Imported here so other backends can be used on systems without DirectInput.
+        import pydirectinput
+        import utils_keycodes
+
+        pydirectinput.FAILSAFE = False
+        self._pydirectinput = pydirectinput
+        self._keycodes = utils_keycodes
+
+
+    def _inject_move(self, x:"int", y:"int") -> None:
+        self._pydirectinput.moveRel(x, y, relative = True)
+
+
+    def _inject_mouse_button(self, button:"str", down:"bool") -> None:
+        if down:
+            self._pydirectinput.mouseDown(button = button)
+        else:
+            self._pydirectinput.mouseUp(button = button)
+
+
+    def _inject_key(self, key_code:"int", down:"bool") -> None:
+        if down:
+            self._keycodes.hold_key(key_code)
+        else:
+            self._keycodes.release_key(key_code)
+
+
+
+#### Records injected input instead of sending it anywhere. Used to test and benchmark game modes headless on any system.
+
+class Recording_Input_Backend(Input_Backend):
+    def __init__(self, frame_interval:"float" = 0.02, clock:"Clock" = None) -> None:
+        super().__init__(frame_interval, clock)
+
+        # Each entry is (clock timestamp, event name, arguments).
+        self.recorded = []
+
+
+    def _inject_move(self, x:"int", y:"int") -> None:
+        self.recorded.append((self._clock.now(), Input_Event.MOVE.value, (x, y)))
+
+
+    def _inject_mouse_button(self, button:"str", down:"bool") -> None:
+        self.recorded.append((self._clock.now(), "mouse down" if down else "mouse up", (button,)))
+
+
+    def _inject_key(self, key_code:"int", down:"bool") -> None:
+        self.recorded.append((self._clock.now(), "key down" if down else "key up", (key_code,)))
@@ -1,8 +1,14 @@
 # Credit to DougDoug for the module, currently placeholder. Will be final if I can't find a better solution.
 
+import sys
 import time
+import heapq
+import asyncio
 import ctypes
-import pynput
+import itertools
+from enum import Enum
+
+from utils_clock import Clock, real_clock
 
 #############################################################
 #################### DIRECT X KEY CODES #####################
@@ -122,7 +128,13 @@ MOUSE_WHEEL_DOWN = 0x109
 
 # Direct Input functions found at: https://stackoverflow.com/questions/53643273/how-to-keep-pynput-and-ctypes-from-clashing
 # Use these to prevent conflict errors with pynput.
-SendInput = ctypes.windll.user32.SendInput
+# Only exists on Windows. Key codes can still be imported elsewhere, for example by the recording input backend.
+# pynput looks for a display when imported, which fails on headless systems, so it is only imported where keys are sent through it.
+if sys.platform == "win32":
+    import pynput
+    SendInput = ctypes.windll.user32.SendInput
+else:
+    SendInput = None
 
 def hold_key(hexKeyCode) -> None:
     extra = ctypes.c_ulong(0)
@@ -138,8 +150,154 @@ def release_key(hexKeyCode):
     x = pynput._util.win32.INPUT(ctypes.c_ulong(1), ii_)
     SendInput(1, ctypes.pointer(x), ctypes.sizeof(x))
 
-# Holds down a key for the specified number of seconds
-def hold_and_release_key(hexKeyCode, seconds:float):
+# Holds down a key for the specified number of seconds. Blocks the calling thread, so use Key_Scheduler from async code.
+def hold_and_release_key(hexKeyCode, seconds:float, clock:"Clock" = real_clock):
     hold_key(hexKeyCode)
-    time.sleep(seconds)
-    release_key(hexKeyCode)
\ No newline at end of file
+    clock.sleep_blocking(seconds)
+    release_key(hexKeyCode)
+
+
+
+#############################################################
+################### TIMED KEY SCHEDULER #####################
+#############################################################
+
+# Plays timed key sequences (holds, chords, repeats and macros) from a single timer task instead of sleeping per key.
+# Every pending press and release sits in one deadline heap, so any number of overlapping holds run concurrently,
+# and the timer task sleeps without waking while nothing is scheduled.
+
+class Key_Action(Enum):
+
+    PRESS = "press"
+    RELEASE = "release"
+
+
+
+class Key_Scheduler(object):
+    def __init__(self, press_function = hold_key, release_function = release_key, clock:"Clock" = None) -> None:
+
+        # Game modes can route keys through their input backend instead of pressing them directly.
+        self._press = press_function
+        self._release = release_function
+
+        # Deadlines are in the clock's time, which must match the running event loop's.
+        self._clock = clock if clock is not None else real_clock
+
+        # Heap entries are (deadline, sequence number, action, key code). The sequence number keeps same-deadline steps in scheduled order.
+        self._heap = []
+        self._sequence = itertools.count()
+        self._wake = asyncio.Event()
+        self._task = None
+
+        # Overlapping holds of the same key are counted, so the key is only released when the last hold ends.
+        self._held_counts = {}
+
+
+
+    ##### Private Functions
+
+    async def _run(self) -> None:
+
+        while True:
+            if not self._heap:
+                await self._wake.wait()
+                self._wake.clear()
+                continue
+
+            delay = self._heap[0][0] - self._clock.now()
+            if delay > 0:
+                # Wakes early if a step with an earlier deadline is scheduled.
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout = delay)
+                except TimeoutError:
+                    pass
+                self._wake.clear()
+                continue
+
+            now = self._clock.now()
+            while self._heap and self._heap[0][0] <= now:
+                _, _, action, key_code = heapq.heappop(self._heap)
+                self._fire(action, key_code)
+
+
+    def _fire(self, action:"Key_Action", key_code:"int") -> None:
+
+        held_count = self._held_counts.get(key_code, 0)
+
+        try:
+            if action == Key_Action.PRESS:
+                if held_count == 0:
+                    self._press(key_code)
+                self._held_counts[key_code] = held_count + 1
+
+            elif held_count > 0:
+                if held_count == 1:
+                    self._release(key_code)
+                    del self._held_counts[key_code]
+                else:
+                    self._held_counts[key_code] = held_count - 1
+        except Exception as e:
+            print(f"Key scheduler failed to {action.value} key {key_code}. Exception {e}")
+
+
+
+    ##### Public Functions
+
+    # Starts the timer task. Must be called from inside the running event loop.
+    def start(self) -> None:
+
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+
+    # Stops the timer task, drops pending steps and releases every key still held.
+    async def stop(self) -> None:
+
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        self._heap.clear()
+        for key_code in list(self._held_counts):
+            self._release(key_code)
+        self._held_counts.clear()
+
+
+    # Schedules a sequence of (offset in seconds, Key_Action, key code) steps, with offsets measured from now plus the delay.
+    def schedule_sequence(self, steps:"list", delay:"float" = 0) -> None:
+
+        start = self._clock.now() + delay
+        for offset, action, key_code in steps:
+            heapq.heappush(self._heap, (start + offset, next(self._sequence), action, key_code))
+
+        self._wake.set()
+
+
+    # Holds a key for the given number of seconds.
+    def hold(self, key_code:"int", seconds:"float", delay:"float" = 0) -> None:
+        self.chord([key_code], seconds, delay)
+
+
+    # Holds several keys together for the given number of seconds.
+    def chord(self, key_codes:"list", seconds:"float", delay:"float" = 0) -> None:
+        steps = [(0, Key_Action.PRESS, key_code) for key_code in key_codes]
+        steps += [(seconds, Key_Action.RELEASE, key_code) for key_code in key_codes]
+        self.schedule_sequence(steps, delay)
+
+
+    # Taps a key a number of times, holding it for hold_seconds each time, with a tap starting every interval seconds.
+    def repeat(self, key_code:"int", hold_seconds:"float", interval:"float", count:"int", delay:"float" = 0) -> None:
+        steps = []
+        for i in range(count):
+            steps.append((i * interval, Key_Action.PRESS, key_code))
+            steps.append((i * interval + hold_seconds, Key_Action.RELEASE, key_code))
+        self.schedule_sequence(steps, delay)
+
+
+    # Returns the number of steps still waiting to fire.
+    def pending(self) -> int:
+        return len(self._heap)
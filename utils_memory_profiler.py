@@ -0,0 +1,199 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+import tracemalloc
+
+from utils_metrics import metrics
+
+
+
+##############################################################################################
+###############  Opt-in memory profiler for finding leaks over long streams.   ###############
+###############  Takes tracemalloc snapshots on an interval and diffs them by  ###############
+###############  module and by allocation site, alongside open handle, thread  ###############
+###############  and task counts. Logs growth trends as it goes and writes a   ###############
+###############  report on shutdown. Tracing slows allocations noticeably, so  ###############
+###############  it is meant for soak runs, replays and debugging streams.     ###############
+##############################################################################################
+
+
+# Allocations made by the profiler itself and by imports aren't leaks from the program.
+_SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>")
+)
+
+
+
+# Returns the number of open file descriptors, or handles on Windows. None if the platform doesn't offer a count.
+def count_open_handles() -> "int | None":
+
+    try:
+        if sys.platform == "win32":
+            import ctypes
+            handle_count = ctypes.c_ulong()
+            ctypes.windll.kernel32.GetProcessHandleCount(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(handle_count))
+            return handle_count.value
+
+        return len(os.listdir("/proc/self/fd"))
+
+    except Exception:
+        return None
+
+
+def format_bytes(size:"float") -> str:
+
+    for unit in ("B", "KB", "MB"):
+        if abs(size) < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+
+    return f"{size:.1f}GB"
+
+
+
+class Memory_Profiler(object):
+    def __init__(self, snapshot_interval:"float" = 300, top_count:"int" = 10, trace_frames:"int" = 5, report_file:"str" = "memory_report.txt") -> None:
+
+        self._snapshot_interval = snapshot_interval
+        self._top_count = top_count
+        self._report_file = report_file
+
+        # More frames make allocation sites easier to trace back to a caller, but cost more memory while tracing.
+        self._trace_frames = trace_frames
+
+        self._start_time = 0.0
+        self._first_snapshot = None
+        self._last_snapshot = None
+
+        # One sample per snapshot: (seconds since start, traced bytes, open handles, threads, asyncio tasks).
+        self.samples = []
+
+        self._stop_event = asyncio.Event()
+
+        metrics.gauge("process_traced_memory_bytes", "Memory allocated by Python, as traced by the memory profiler.", function = lambda: tracemalloc.get_traced_memory()[0])
+        metrics.gauge("process_open_handles", "Open file descriptors, or handles on Windows.", function = lambda: count_open_handles() or 0)
+        metrics.gauge("process_threads", "Running Python threads.", function = threading.active_count)
+
+
+
+    ##### Private Functions
+
+    def _take_snapshot(self) -> "tracemalloc.Snapshot":
+        return tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+
+
+    def _take_sample(self) -> tuple:
+        return (time.monotonic() - self._start_time, tracemalloc.get_traced_memory()[0], count_open_handles(), threading.active_count(), len(asyncio.all_tasks()))
+
+
+    # Returns the growth of traced memory in bytes per hour, as the least squares slope over every sample.
+    def _get_trend(self) -> float:
+
+        if len(self.samples) < 2:
+            return 0.0
+
+        times = [sample[0] for sample in self.samples]
+        sizes = [sample[1] for sample in self.samples]
+        mean_time = sum(times) / len(times)
+        mean_size = sum(sizes) / len(sizes)
+
+        variance = sum((t - mean_time) ** 2 for t in times)
+        if variance == 0:
+            return 0.0
+
+        return sum((t - mean_time) * (size - mean_size) for t, size in zip(times, sizes)) / variance * 3600
+
+
+    # Returns lines describing the largest growth between two snapshots, grouped by file ("filename") or by allocation site ("traceback").
+    def _describe_growth(self, snapshot:"tracemalloc.Snapshot", previous:"tracemalloc.Snapshot", key_type:"str", count:"int") -> list:
+
+        lines = []
+        growth = [difference for difference in snapshot.compare_to(previous, key_type) if difference.size_diff > 0]
+
+        for difference in growth[:count]:
+
+            # Tracebacks are stored oldest frame first, so the allocating frame is the last one.
+            frames = list(difference.traceback)[::-1]
+            location = os.path.basename(frames[0].filename) if key_type == "filename" else f"{os.path.basename(frames[0].filename)}:{frames[0].lineno}"
+            lines.append(f"  {format_bytes(difference.size_diff):>10} in {difference.count_diff:+} blocks   {location}")
+
+            # Shows the callers of an allocation site, nearest first, so it can be traced back to a module.
+            if key_type == "traceback":
+                for caller in frames[1:]:
+                    lines.append(f"{'':>28}from {os.path.basename(caller.filename)}:{caller.lineno}")
+
+        return lines
+
+
+    def _log_snapshot(self) -> None:
+
+        snapshot = self._take_snapshot()
+        sample = self._take_sample()
+        self.samples.append(sample)
+
+        previous_size = self.samples[-2][1] if len(self.samples) > 1 else sample[1]
+        print(f"Memory: {format_bytes(sample[1])} traced ({format_bytes(sample[1] - previous_size)} since last, trend {format_bytes(self._get_trend())}/h), {sample[2]} open handles, {sample[3]} threads, {sample[4]} tasks")
+
+        for line in self._describe_growth(snapshot, self._last_snapshot, "filename", 3):
+            print(line)
+
+        self._last_snapshot = snapshot
+
+
+    def _write_report(self) -> None:
+
+        snapshot = self._take_snapshot()
+        self.samples.append(self._take_sample())
+        first, last = self.samples[0], self.samples[-1]
+
+        lines = [
+            f"Memory report written {time.strftime('%Y-%m-%d %H:%M:%S')} after {last[0] / 60:.1f} minutes.",
+            f"Traced memory: {format_bytes(first[1])} -> {format_bytes(last[1])}, trend {format_bytes(self._get_trend())}/h. Peak {format_bytes(tracemalloc.get_traced_memory()[1])}.",
+            f"Open handles: {first[2]} -> {last[2]}. Threads: {first[3]} -> {last[3]}. Asyncio tasks: {first[4]} -> {last[4]}.",
+            "",
+            "Samples (minutes, traced, open handles, threads, tasks):"
+        ]
+        lines += [f"  {sample[0] / 60:8.1f}  {format_bytes(sample[1]):>10}  {sample[2]}  {sample[3]}  {sample[4]}" for sample in self.samples]
+
+        lines += ["", "Growth since start by module:"]
+        lines += self._describe_growth(snapshot, self._first_snapshot, "filename", self._top_count)
+
+        lines += ["", "Growth since start by allocation site:"]
+        lines += self._describe_growth(snapshot, self._first_snapshot, "traceback", self._top_count)
+
+        with open(self._report_file, "w") as report_file:
+            report_file.write("\n".join(lines) + "\n")
+
+        print(f"Memory report written to {self._report_file}")
+
+
+
+    ##### Public Functions
+
+    async def terminate_module(self) -> None:
+        self._stop_event.set()
+
+
+    # Starts tracing, then logs a snapshot every interval until terminated, and writes the report.
+    async def update(self) -> None:
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self._trace_frames)
+
+        self._start_time = time.monotonic()
+        self._first_snapshot = self._last_snapshot = self._take_snapshot()
+        self.samples.append(self._take_sample())
+
+        while not self._stop_event.is_set():
+            try:
+                await asyncio.wait_for(self._stop_event.wait(), timeout = self._snapshot_interval)
+            except TimeoutError:
+                self._log_snapshot()
+
+        self._write_report()
+        tracemalloc.stop()
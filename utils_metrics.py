@@ -0,0 +1,265 @@
+import time
+import asyncio
+from bisect import bisect_left
+
+
+
+##############################################################################################
+###############  Shared metrics registry for every module: counters, gauges    ###############
+###############  and fixed-bucket latency histograms. Recording a value is a   ###############
+###############  few attribute updates with no allocation. Metrics are served  ###############
+###############  in Prometheus text format from a local HTTP endpoint and      ###############
+###############  printed as a periodic console summary by Metrics_Reporter.    ###############
+##############################################################################################
+
+
+# Upper bounds in seconds, from 100 microseconds for dispatch up to 10 seconds for TTS synthesis.
+DEFAULT_LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+
+#### Metrics are recorded from the event loop thread. Values are plain attributes, so reading them from elsewhere is always safe.
+
+class Counter(object):
+    def __init__(self, name:"str", help_text:"str", labels:"dict", function:"function" = None) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.value = 0
+
+        # Counters kept by another object, like an inbox's dropped count, are read through a function when metrics are collected.
+        self._function = function
+
+    def inc(self, amount:"int" = 1) -> None:
+        self.value += amount
+
+    def get(self) -> float:
+        return self._function() if self._function is not None else self.value
+
+
+
+class Gauge(object):
+    def __init__(self, name:"str", help_text:"str", labels:"dict", function:"function" = None) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.value = 0
+
+        # Values like queue depths are read through a function when metrics are collected, so they cost nothing between collections.
+        self._function = function
+
+    def set(self, value:"float") -> None:
+        self.value = value
+
+    def get(self) -> float:
+        return self._function() if self._function is not None else self.value
+
+
+
+class Histogram(object):
+    def __init__(self, name:"str", help_text:"str", labels:"dict", buckets:"tuple" = DEFAULT_LATENCY_BUCKETS) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+
+        # One count per bucket plus one for values above the last bound. Counts are per bucket, not cumulative.
+        self._bounds = tuple(buckets)
+        self._counts = [0] * (len(self._bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value:"float") -> None:
+        self._counts[bisect_left(self._bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    # Returns (upper bound, cumulative count) per bucket, ending with infinity.
+    def get_buckets(self) -> list:
+
+        buckets = []
+        total = 0
+        for bound, count in zip(self._bounds + (float("inf"),), self._counts):
+            total += count
+            buckets.append((bound, total))
+
+        return buckets
+
+    # Estimates a quantile as the upper bound of the bucket it falls in.
+    def get_quantile(self, fraction:"float") -> float:
+
+        if self.count == 0:
+            return 0.0
+
+        target = fraction * self.count
+        for bound, total in self.get_buckets():
+            if total >= target:
+                return bound
+
+        return float("inf")
+
+
+
+class Metrics_Registry(object):
+    def __init__(self) -> None:
+
+        # Metrics by (name, sorted label items). Asking for an existing metric returns it, so instances of a module share their metrics.
+        self._metrics = {}
+
+
+
+    ##### Private Functions
+
+    def _get_or_create(self, metric_class:"type", name:"str", help_text:"str", labels:"dict", **kwargs):
+
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            metric = metric_class(name, help_text, labels, **kwargs)
+            self._metrics[key] = metric
+
+        elif not isinstance(metric, metric_class):
+            raise Exception(f"Metric {name} is already registered as a {type(metric).__name__}.")
+
+        # A metric read through a function follows the newest object registering it, so recreated modules still report.
+        elif kwargs.get("function") is not None:
+            metric._function = kwargs["function"]
+
+        return metric
+
+
+    def _format_labels(self, labels:"dict", extra:"dict" = None) -> str:
+
+        labels = {**labels, **extra} if extra else labels
+        if not labels:
+            return ""
+
+        return "{" + ",".join(f'{key}="{str(value)}"' for key, value in labels.items()) + "}"
+
+
+
+    ##### Public Functions
+
+    def counter(self, name:"str", help_text:"str", function:"function" = None, **labels) -> Counter:
+        return self._get_or_create(Counter, name, help_text, labels, function = function)
+
+
+    def gauge(self, name:"str", help_text:"str", function:"function" = None, **labels) -> Gauge:
+        return self._get_or_create(Gauge, name, help_text, labels, function = function)
+
+
+    def histogram(self, name:"str", help_text:"str", buckets:"tuple" = DEFAULT_LATENCY_BUCKETS, **labels) -> Histogram:
+        return self._get_or_create(Histogram, name, help_text, labels, buckets = buckets)
+
+
+    # Returns every metric in Prometheus text exposition format.
+    def render_prometheus(self) -> str:
+
+        lines = []
+        described = set()
+
+        for metric in sorted(self._metrics.values(), key = lambda metric: metric.name):
+            if metric.name not in described:
+                described.add(metric.name)
+                lines.append(f"# HELP {metric.name} {metric.help_text}")
+                lines.append(f"# TYPE {metric.name} {type(metric).__name__.lower()}")
+
+            if isinstance(metric, Histogram):
+                for bound, total in metric.get_buckets():
+                    lines.append(f"{metric.name}_bucket{self._format_labels(metric.labels, {'le': '+Inf' if bound == float('inf') else repr(bound)})} {total}")
+                lines.append(f"{metric.name}_sum{self._format_labels(metric.labels)} {metric.sum}")
+                lines.append(f"{metric.name}_count{self._format_labels(metric.labels)} {metric.count}")
+            else:
+                lines.append(f"{metric.name}{self._format_labels(metric.labels)} {metric.get()}")
+
+        return "\n".join(lines) + "\n"
+
+
+    # Returns one readable line per metric, with p50 and p99 estimates for histograms.
+    def render_summary(self) -> str:
+
+        lines = []
+        for metric in sorted(self._metrics.values(), key = lambda metric: (metric.name, str(metric.labels))):
+            name = metric.name + self._format_labels(metric.labels)
+
+            if isinstance(metric, Histogram):
+                if metric.count:
+                    lines.append(f"{name:<70} count {metric.count:<8} p50 <= {metric.get_quantile(0.5) * 1000:g}ms   p99 <= {metric.get_quantile(0.99) * 1000:g}ms")
+            else:
+                lines.append(f"{name:<70} {metric.get():g}")
+
+        return "\n".join(lines)
+
+
+
+# Shared by every module. Modules register their metrics here when they are created.
+metrics = Metrics_Registry()
+
+
+
+#### Stream module that serves the registry at http://127.0.0.1:[port]/metrics and prints a summary every summary_interval seconds.
+
+class Metrics_Reporter(object):
+    def __init__(self, registry:"Metrics_Registry" = metrics, host:"str" = "127.0.0.1", port:"int" = 9464, summary_interval:"float" = 60) -> None:
+
+        self._registry = registry
+        self._host = host
+        self._port = port
+        self._summary_interval = summary_interval
+
+        self._server = None
+        self._stop_event = asyncio.Event()
+
+
+
+    ##### Private Functions
+
+    # Answers a single HTTP request. Only GET /metrics is served.
+    async def _handle_request(self, reader:"asyncio.StreamReader", writer:"asyncio.StreamWriter") -> None:
+
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout = 5)
+            request_line = request.split(b"\r\n", 1)[0].decode("latin-1").split()
+
+            if len(request_line) >= 2 and request_line[0] == "GET" and request_line[1].split("?")[0] == "/metrics":
+                status = "200 OK"
+                body = self._registry.render_prometheus().encode("utf-8")
+            else:
+                status = "404 Not Found"
+                body = b"Not found. Metrics are at /metrics.\n"
+
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body)
+            await writer.drain()
+
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, TimeoutError, ConnectionError):
+            pass
+
+        finally:
+            writer.close()
+
+
+
+    ##### Public Functions
+
+    async def terminate_module(self) -> None:
+        self._stop_event.set()
+
+
+    async def update(self) -> None:
+
+        try:
+            self._server = await asyncio.start_server(self._handle_request, self._host, self._port)
+            print(f"Metrics available at http://{self._host}:{self._port}/metrics")
+        except OSError as e:
+            print(f"Metrics endpoint could not start on port {self._port}. Exception {e}")
+
+        # Prints the summary on an interval until terminated.
+        while not self._stop_event.is_set():
+            try:
+                await asyncio.wait_for(self._stop_event.wait(), timeout = self._summary_interval)
+            except TimeoutError:
+                print(f"\n##### Metrics at {time.strftime('%H:%M:%S')}\n{self._registry.render_summary()}\n")
+
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
@@ -0,0 +1,110 @@
+from collections import OrderedDict
+
+from utils_clock import Clock, real_clock
+from utils_metrics import metrics
+
+# Used for function annotation. Not required at runtime.
+from utils_events import Chat_Message
+
+
+
+##############################################################################################
+###############  Token bucket throttling for chat commands, shared by every    ###############
+###############  module. Limits how often each viewer can use commands, how    ###############
+###############  often each command can be used, and how many commands each    ###############
+###############  module receives. Throttled messages are counted and dropped   ###############
+###############  before any module sees them.                                  ###############
+##############################################################################################
+
+
+
+#### One token bucket per key, refilled at rate tokens per second up to burst. Each use takes a token.
+#### A bucket left idle long enough to refill is the same as a new one, so it is forgotten. Buckets are kept in order of last use,
+#### so idle ones are always at the front and each check only looks at the front. Memory follows active keys, not every key ever seen.
+
+class Token_Buckets(object):
+    def __init__(self, rate:"float", burst:"int", clock:"Clock" = None) -> None:
+
+        self._rate = rate
+        self._burst = burst
+        self._clock = clock if clock is not None else real_clock
+
+        # Seconds for an empty bucket to fill back up.
+        self._refill_seconds = burst / rate
+
+        # Key -> (tokens left, time of last use).
+        self._buckets = OrderedDict()
+
+
+    # Takes a token from the key's bucket. Returns False if it was empty.
+    def try_take(self, key) -> bool:
+
+        now = self._clock.now()
+        buckets = self._buckets
+
+        # Every bucket is removed at most once per time it was added, so this is O(1) amortized.
+        while buckets:
+            tokens, last_used = buckets[next(iter(buckets))]
+            if now - last_used < self._refill_seconds:
+                break
+            buckets.popitem(last = False)
+
+        state = buckets.pop(key, None)
+        tokens = self._burst if state is None else min(self._burst, state[0] + (now - state[1]) * self._rate)
+
+        if tokens < 1:
+            buckets[key] = (tokens, now)
+            return False
+
+        buckets[key] = (tokens - 1, now)
+        return True
+
+
+    # Returns the number of keys with a bucket that isn't full yet.
+    def get_size(self) -> int:
+        return len(self._buckets)
+
+
+
+#### Filters chat messages on the way from the Twitch connection to modules. A rate of 0 turns that limit off.
+
+class Chat_Throttle(object):
+    def __init__(self, user_rate:"float" = 1.0, user_burst:"int" = 4, command_rate:"float" = 0.0, command_burst:"int" = 10, module_rate:"float" = 0.0, module_burst:"int" = 20, clock:"Clock" = None) -> None:
+
+        # Per viewer across every command, per command across every viewer, and per module across every command it receives.
+        self._user_buckets = Token_Buckets(user_rate, user_burst, clock) if user_rate > 0 else None
+        self._command_buckets = Token_Buckets(command_rate, command_burst, clock) if command_rate > 0 else None
+        self._module_buckets = Token_Buckets(module_rate, module_burst, clock) if module_rate > 0 else None
+
+        self._throttled = {reason: metrics.counter("chat_throttled_total", "Chat commands dropped by throttling, by the limit they hit.", reason = reason) for reason in ("user", "command", "module")}
+        metrics.gauge("chat_throttle_users", "Viewers with a throttling bucket that hasn't refilled yet.", function = self.get_user_count)
+
+
+
+    ##### Public Functions
+
+    # Returns the number of viewers being tracked. Viewers are forgotten once their bucket has refilled.
+    def get_user_count(self) -> int:
+        return self._user_buckets.get_size() if self._user_buckets is not None else 0
+
+
+    # Returns the callbacks the message may reach. Empty if the viewer or the command is over its limit.
+    # Callbacks of modules over their budget are left out.
+    def filter(self, chat_message:"Chat_Message", callbacks:"tuple") -> tuple:
+
+        if self._user_buckets is not None and not self._user_buckets.try_take(chat_message.user_id):
+            self._throttled["user"].inc()
+            return ()
+
+        if self._command_buckets is not None and not self._command_buckets.try_take(chat_message.text):
+            self._throttled["command"].inc()
+            return ()
+
+        if self._module_buckets is None:
+            return callbacks
+
+        allowed = tuple(callback for callback in callbacks if self._module_buckets.try_take(type(callback.__self__).__name__))
+        if len(allowed) < len(callbacks):
+            self._throttled["module"].inc(len(callbacks) - len(allowed))
+
+        return allowed
@@ -0,0 +1,205 @@
+import os
+import sys
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+import traceback
+from typing import NamedTuple
+
+from utils_metrics import metrics
+
+
+
+##############################################################################################
+###############  Opt-in watchdog that measures event loop lag from its own     ###############
+###############  thread. When the loop stalls past a threshold, it captures    ###############
+###############  the loop thread's stack and names the module and function     ###############
+###############  that was blocking it. The worst stalls are kept and printed   ###############
+###############  on shutdown.                                                  ###############
+##############################################################################################
+
+
+# Frames from files in this folder belong to the program. Anything else is the standard library or a dependency.
+_PROJECT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+
+class Loop_Stall(NamedTuple):
+
+    duration: float
+    module: str
+    function: str
+    stack: str
+    wall_time: str
+
+
+
+class Loop_Watchdog(object):
+    def __init__(self, threshold:"float" = 0.1, check_interval:"float" = 0.1, worst_count:"int" = 10) -> None:
+
+        # A ping is sent to the loop every check_interval. A stall is any ping the loop takes longer than threshold to answer.
+        self._threshold = threshold
+        self._check_interval = check_interval
+
+        # Min-heap of (duration, sequence number, Loop_Stall), holding only the worst stalls.
+        self._worst_stalls = []
+        self._worst_count = worst_count
+        self._sequence = itertools.count()
+        self.stall_count = 0
+
+        self._loop = None
+        self._loop_thread_id = None
+        self._pong = threading.Event()
+        self._pong_time = 0.0
+
+        # The thread stop event also cuts the watchdog's sleeps short, so terminating never waits on an interval.
+        self._thread = None
+        self._thread_stop = threading.Event()
+        self._stop_event = asyncio.Event()
+
+        self._lag = metrics.histogram("loop_lag_seconds", "How long the event loop takes to run a callback scheduled from another thread.")
+
+
+
+    ##### Private Functions
+
+    # Runs on the event loop, so the lag is recorded from the loop thread like every other metric.
+    def _answer_ping(self, sent_time:"float") -> None:
+        self._pong_time = time.monotonic()
+        self._lag.observe(self._pong_time - sent_time)
+        self._pong.set()
+
+
+    # Runs on the watchdog thread.
+    def _run(self) -> None:
+
+        while not self._thread_stop.is_set():
+            self._pong.clear()
+            sent_time = time.monotonic()
+
+            try:
+                self._loop.call_soon_threadsafe(self._answer_ping, sent_time)
+            except RuntimeError:
+                # The loop has closed.
+                return
+
+            if not self._pong.wait(self._threshold):
+
+                # The loop is stalled right now, so its stack shows what is blocking it.
+                stack = self._capture_loop_stack()
+
+                self._pong.wait()
+                if self._thread_stop.is_set():
+                    return
+
+                # Stalls are recorded on the loop, since recording one can register a new labelled counter.
+                try:
+                    self._loop.call_soon_threadsafe(self._record_stall, self._pong_time - sent_time, stack)
+                except RuntimeError:
+                    return
+
+            self._thread_stop.wait(self._check_interval)
+
+
+    def _capture_loop_stack(self) -> "list | None":
+
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return None
+
+        return self._walk_stack(frame)
+
+
+    # Returns (FrameSummary, class name of self or None) for each frame, outermost first.
+    def _walk_stack(self, frame) -> list:
+
+        frames = []
+        while frame is not None:
+            owner = frame.f_locals.get("self")
+            frames.append((traceback.FrameSummary(frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_qualname, lookup_line = False), type(owner).__name__ if owner is not None else None))
+            frame = frame.f_back
+
+        frames.reverse()
+        return frames
+
+
+    # Names the innermost program frame on the stack as the cause, skipping this file.
+    def _attribute(self, stack:"list") -> tuple:
+
+        for frame_summary, owner in reversed(stack):
+            file_path = os.path.abspath(frame_summary.filename)
+            if os.path.dirname(file_path) == _PROJECT_DIRECTORY and file_path != os.path.abspath(__file__):
+                module = owner if owner is not None else os.path.splitext(os.path.basename(file_path))[0]
+                return module, frame_summary.name
+
+        return "unknown", stack[-1][0].name if stack else "unknown"
+
+
+    # Runs on the event loop.
+    def _record_stall(self, duration:"float", stack:"list | None") -> None:
+
+        if stack:
+            module, function = self._attribute(stack)
+            stack_text = "".join(traceback.format_list([frame_summary for frame_summary, _ in stack]))
+        else:
+            module, function, stack_text = "unknown", "unknown", ""
+
+        stall = Loop_Stall(duration, module, function, stack_text, time.strftime("%H:%M:%S"))
+        self.stall_count += 1
+        metrics.counter("loop_stalls_total", "Event loop stalls over the watchdog threshold, by the module that caused them.", module = module).inc()
+
+        print(f"Event loop stalled for {duration * 1000:.0f}ms in {module} ({function})")
+
+        entry = (duration, next(self._sequence), stall)
+        if len(self._worst_stalls) < self._worst_count:
+            heapq.heappush(self._worst_stalls, entry)
+        else:
+            heapq.heappushpop(self._worst_stalls, entry)
+
+
+
+    ##### Public Functions
+
+    # Returns the worst stalls so far, longest first.
+    def get_worst_stalls(self) -> list:
+        return [stall for _, _, stall in sorted(self._worst_stalls, reverse = True)]
+
+
+    # Returns a readable report of the worst stalls with their stacks.
+    def get_report(self) -> str:
+
+        lines = [f"Event loop watchdog: {self.stall_count} stalls over {self._threshold * 1000:.0f}ms."]
+        for i, stall in enumerate(self.get_worst_stalls()):
+            lines.append(f"\n#{i + 1}: {stall.duration * 1000:.0f}ms at {stall.wall_time} in {stall.module} ({stall.function})")
+            lines.append(stall.stack.rstrip())
+
+        return "\n".join(lines)
+
+
+    async def terminate_module(self) -> None:
+
+        self._stop_event.set()
+
+        # Releasing the pong wakes the thread if it is waiting on the loop. It is joined off the loop so terminating never blocks it.
+        self._thread_stop.set()
+        self._pong.set()
+
+        if self._thread is not None:
+            await asyncio.to_thread(self._thread.join, 1)
+            self._thread = None
+
+        print(self.get_report())
+
+
+    # Starts the watchdog thread on the running loop and waits until terminated.
+    async def update(self) -> None:
+
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+
+        self._thread = threading.Thread(target = self._run, name = "Loop_Watchdog", daemon = True)
+        self._thread.start()
+
+        await self._stop_event.wait()